@@ -0,0 +1,283 @@
+'''
+A local stand-in for the parts of Trove used by the harvester, so harvests can be timed
+without touching the real API.
+
+It serves:
+
+    /v2/result                                         -- API results, paged with nextStart tokens
+    /newspaper/rendition/nla.news-article{id}/level/{zoom}/prep  -- PDF renditions (with a configurable delay)
+    /newspaper/rendition/nla.news-article{id}.{zoom}.ping
+    /newspaper/rendition/nla.news-article{id}.{zoom}.pdf
+    /newspaper/rendition/nla.news-article{id}.txt      -- Australian Women's Weekly texts
+    /ndp/imageservice/nla.news-page{id}/level{level}   -- page images
+    /nla.news-article{id}                              -- article HTML with OCR zones
+
+Every response can be delayed by a fixed latency, and a proportion of responses
+can be replaced with 500 errors or 429 throttling responses. PDFs and page images can be
+requested by range, and (with compress) are gzipped for clients that accept it.
+
+Usage:
+
+    python benchmarks/fake_trove.py [--port 8000] [--total 1000] [--latency 0.05] [--errors 0.01]
+
+Or from Python:
+
+    server = FakeTrove(total=500).start()
+    configure(server.url)
+    ...
+    server.stop()
+'''
+
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+
+class FakeTrove:
+    '''
+    A threaded HTTP server that behaves (more or less) like Trove.
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, total=1000, latency=0, pdf_delay=0.5, errors=0, throttle=0, text_ratio=0.8, page_size=(2000, 3000), seed=1, compress=False):
+        self.total = total
+        self.latency = latency
+        self.pdf_delay = pdf_delay
+        self.errors = errors
+        self.throttle = throttle
+        self.text_ratio = text_ratio
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.preps = {}
+        self.hits = {}
+        image = BytesIO()
+        Image.new('L', page_size, 230).save(image, 'JPEG', quality=75)
+        self.page_image = image.getvalue()
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_date(self, i):
+        # Articles are in date order
+        days = i * 3
+        return '{}-{:02d}-{:02d}'.format(1900 + days // 336, 1 + days % 336 // 28, 1 + days % 28)
+
+    def get_title_id(self, i):
+        return str(10 + i % 7)
+
+    def make_article(self, i):
+        article_id = str(100000 + i)
+        article = {
+            'id': article_id,
+            'url': '/newspaper/article/{}'.format(article_id),
+            'heading': 'Article number {}'.format(i),
+            'category': ['Article', 'Advertising', 'Family Notices'][i % 3],
+            'title': {'id': self.get_title_id(i), 'value': 'The Daily Example {}'.format(i % 7)},
+            'edition': None,
+            'page': 1 + i % 8,
+            'pageSequence': 1 + i % 8,
+            'date': self.get_date(i),
+            'relevance': {'score': 1.0, 'value': 'very relevant'},
+            'troveUrl': 'https://trove.nla.gov.au/ndp/del/article/{}'.format(article_id),
+            'trovePageUrl': 'https://trove.nla.gov.au/ndp/del/page/{}'.format(5000 + i // 4),
+            'snippet': 'Some OCRd text',
+            'wordCount': 50 + i % 1000,
+            'correctionCount': i % 3,
+            'tagCount': 0,
+            'commentCount': 0,
+            'illustrated': 'N',
+            'identifier': 'http://nla.gov.au/nla.news-article{}'.format(article_id),
+        }
+        # Some articles (like the Women's Weekly) don't include their text
+        if (i % 100) < self.text_ratio * 100:
+            paragraphs = ['<p>{}</p>'.format(' '.join(['Line {} of article {} with some OCRd words'.format(n, i)] * 3)) for n in range(1 + i % 20)]
+            article['articleText'] = '<span>{}</span>'.format(''.join(paragraphs))
+        return article
+
+    def get_results(self, query):
+        start = query.get('s', ['*'])[0]
+        start = 0 if start == '*' else int(start)
+        number = int(query.get('n', ['20'])[0])
+        articles = range(self.total)
+        # Only date ranges (and l-title, l-decade, and l-year) in the query are understood, eg: date:[1920-01-01T00:00:00Z TO *]
+        date_range = re.search(r'date:\[(\d{4}-\d{2}-\d{2})\S* TO \*\]', query.get('q', [''])[0])
+        if date_range:
+            articles = [i for i in articles if self.get_date(i) > date_range.group(1)]
+        if 'l-title' in query:
+            articles = [i for i in articles if self.get_title_id(i) == query['l-title'][0]]
+        for facet, width in [('l-decade', 3), ('l-year', 4)]:
+            if facet in query:
+                articles = [i for i in articles if self.get_date(i)[:width] == query[facet][0]]
+        records = {'s': query.get('s', ['*'])[0], 'n': str(number), 'total': str(len(articles))}
+        if number:
+            page = articles[start:start + number]
+            records['n'] = str(len(page))
+            records['article'] = [self.make_article(i) for i in page]
+            if start + number < len(articles):
+                records['nextStart'] = str(start + number)
+        zone = {'name': query.get('zone', ['newspaper'])[0], 'records': records}
+        if 'facet' in query:
+            facet = query['facet'][0]
+            width = 3 if facet == 'decade' else 4
+            counts = {}
+            for i in range(self.total):
+                key = self.get_title_id(i) if facet == 'title' else self.get_date(i)[:width]
+                counts[key] = counts.get(key, 0) + 1
+            zone['facets'] = {'facet': {'name': facet, 'term': [{'search': key, 'display': key, 'count': str(count)} for key, count in sorted(counts.items())]}}
+        return {'response': {'zone': [zone]}}
+
+    def get_article_html(self, article_id):
+        i = int(article_id) - 100000
+        page_id = 5000 + i // 4
+        zones = []
+        for line in range(10 + i % 30):
+            zones.append('<div class="zone onPage" data-page-id="{}" data-x="{}" data-y="{}" data-w="{}" data-h="30"><span class="word">OCRd</span> <span class="word">text</span></div>'.format(
+                page_id, 100 + (i % 4) * 450, 200 + line * 35, 400))
+        # Every fifth article continues on the next page
+        if i % 5 == 0:
+            for line in range(5):
+                zones.append('<div class="zone offPage" data-page-id="{}" data-x="100" data-y="{}" data-w="400" data-h="30"></div>'.format(page_id + 1, 200 + line * 35))
+        return '<html><head><title>Article</title></head><body><div class="ocr-text"><div class="read">{}</div></div></body></html>'.format(''.join(zones))
+
+    def record(self, endpoint):
+        with self.lock:
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Otherwise keep-alive connections stall waiting for delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b'', content_type='text/plain', headers=None):
+                if isinstance(body, str):
+                    body = body.encode('utf-8')
+                headers = headers or {}
+                match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+                if status == 200 and match and content_type in ['application/pdf', 'image/jpeg']:
+                    offset = int(match.group(1))
+                    if offset >= len(body):
+                        headers['Content-Range'] = 'bytes */{}'.format(len(body))
+                        status, body = 416, b''
+                    else:
+                        headers['Content-Range'] = 'bytes {}-{}/{}'.format(offset, len(body) - 1, len(body))
+                        status, body = 206, body[offset:]
+                if server.compress and body and content_type in ['application/pdf', 'image/jpeg'] and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    headers['Content-Encoding'] = 'gzip'
+                    body = gzip.compress(body)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:
+                    chance = server.random.random()
+                if chance < server.errors:
+                    server.record('error')
+                    return self.send(500, 'Internal Server Error')
+                if chance < server.errors + server.throttle:
+                    server.record('throttled')
+                    return self.send(429, 'Too Many Requests', headers={'Retry-After': '1'})
+                if path.endswith('/v2/result'):
+                    server.record('api')
+                    return self.send(200, json.dumps(server.get_results(parse_qs(url.query))), 'application/json')
+                match = re.search(r'nla\.news-article(\d+)/level/\d+/prep$', path)
+                if match:
+                    server.record('prep')
+                    with server.lock:
+                        server.preps[match.group(1)] = time.time()
+                    return self.send(200, 'prep-{}'.format(match.group(1)))
+                match = re.search(r'nla\.news-article(\d+)\.\d+\.ping$', path)
+                if match:
+                    server.record('ping')
+                    with server.lock:
+                        prepped = server.preps.get(match.group(1))
+                    if prepped is None:
+                        return self.send(404, 'Not Found')
+                    return self.send(200 if time.time() - prepped >= server.pdf_delay else 423)
+                match = re.search(r'nla\.news-article(\d+)\.\d+\.pdf$', path)
+                if match:
+                    server.record('pdf')
+                    return self.send(200, b'%PDF-1.4\n' + b'0' * 50000, 'application/pdf')
+                match = re.search(r'nla\.news-article(\d+)\.txt$', path)
+                if match:
+                    server.record('txt')
+                    return self.send(200, '<html><body><p>Header</p><hr/><p>The text of article {}</p></body></html>'.format(match.group(1)), 'text/html')
+                if re.search(r'imageservice/nla\.news-page\d+/level\d+$', path):
+                    server.record('image')
+                    return self.send(200, server.page_image, 'image/jpeg')
+                match = re.search(r'nla\.news-article(\d+)$', path)
+                if match:
+                    server.record('article')
+                    return self.send(200, server.get_article_html(match.group(1)), 'text/html')
+                return self.send(404, 'Not Found')
+
+        return Handler
+
+
+def configure(url):
+    '''
+    Point the harvester (and its page image cache) at a fake Trove running at url.
+    '''
+    from troveharvester.__main__ import Harvester, PageImageCache
+    Harvester.api_url = '{}/v2/result'.format(url)
+    Harvester.rendition_url = '{}/newspaper/rendition/'.format(url)
+    Harvester.article_url = '{}/nla.news-article{{}}'.format(url)
+    PageImageCache.image_url = '{}/ndp/imageservice/nla.news-page{{}}/level{{}}'.format(url)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--total', type=int, default=1000, help='Number of articles in the results')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before each response')
+    parser.add_argument('--pdf_delay', type=float, default=0.5, help='Seconds before a PDF rendition is ready')
+    parser.add_argument('--errors', type=float, default=0, help='Proportion of requests that get a 500 error')
+    parser.add_argument('--throttle', type=float, default=0, help='Proportion of requests that get a 429 response')
+    args = parser.parse_args()
+    server = FakeTrove(port=args.port, total=args.total, latency=args.latency, pdf_delay=args.pdf_delay, errors=args.errors, throttle=args.throttle)
+    print('Serving a fake Trove at {}'.format(server.url))
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.hits))
+        server.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+'''
+Benchmark complete harvests against a local fake Trove (see fake_trove.py).
+
+Each mode is harvested in a separate process so that the memory use of one doesn't
+hide the memory use of the next. For each mode it reports the number of articles
+harvested per second, the peak RSS, and the time spent in each stage of processing
+(as recorded in harvest.db).
+
+The peak RSS is the largest total of the harvester and all the processes under it (the forkserver
+and the text and image conversion workers it starts), sampled from /proc while the harvest runs.
+Where there's no /proc (eg on macOS) it falls back to getrusage, which only covers the harvester
+and the child processes that have finished.
+
+Usage:
+
+    python benchmarks/harvest.py [--total 1000] [--modes metadata text pdf image] [--latency 0.02] [--errors 0.01]
+
+Save the results with --output to compare them with a later run.
+'''
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from fake_trove import FakeTrove, configure
+
+MODES = ['metadata', 'text', 'pdf', 'image']
+
+
+def get_tree_rss(pid):
+    '''
+    Get the total RSS (in bytes) of a process and all its descendants, from /proc.
+    '''
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(entry), 'r') as stat_file:
+                    # The command name is in brackets (and can include spaces), the parent id is the second field after it
+                    ppid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        pids.extend(children.get(pid, []))
+        try:
+            with open('/proc/{}/statm'.format(pid), 'r') as statm_file:
+                rss += int(statm_file.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            # The process has finished
+            pass
+    return rss
+
+
+class MemorySampler:
+    '''
+    Keep track of the peak total RSS of this process and its descendants, sampling it in a background thread.
+    '''
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while True:
+            self.peak = max(self.peak, get_tree_rss(os.getpid()))
+            if self.stopped.wait(self.interval):
+                return
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+
+def get_peak_rss(sampled):
+    '''
+    Combine the sampled peak with getrusage's (which catches any peak of this process between samples).
+    '''
+    # ru_maxrss is in KB on Linux (but bytes on macOS)
+    scale = 1 if sys.platform == 'darwin' else 1024
+    if sampled:
+        return max(sampled, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale)
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def run_harvest(args):
+    '''
+    Run a single harvest against the fake Trove at args.url and print the results as JSON.
+    '''
+    from troveharvester.__main__ import limiter, start_harvest, HarvestState, make_dir
+    configure(args.url)
+    # The fake Trove can go as fast as we like, so don't hold the harvester back
+    for endpoint in ['api', 'rendition', 'image', 'article']:
+        limiter.set_rate(endpoint, args.rate)
+    data_dir = args.data_dir
+    for output in ['pdf', 'text', 'image']:
+        make_dir(os.path.join(data_dir, output))
+    with open(os.path.join(data_dir, 'metadata.json'), 'w') as meta_file:
+        json.dump({'query': 'benchmark', 'start': '*'}, meta_file)
+    options = {mode: args.worker == mode for mode in ['pdf', 'text', 'image']}
+    sampler = MemorySampler().start() if os.path.isdir('/proc') else None
+    started = time.perf_counter()
+    try:
+        start_harvest(data_dir=data_dir, key='benchmark', query='https://trove.nla.gov.au/newspaper/result?q=benchmark', include_linebreaks=False, start='*', max=0, text_workers=args.text_workers, format=args.format, **options)
+    finally:
+        elapsed = time.perf_counter() - started
+        sampled = sampler.stop() if sampler else None
+    state = HarvestState(data_dir)
+    harvested = len(state.get_saved(str(100000 + i) for i in range(args.total)))
+    timings = state.get_timings()
+    state.close()
+    print(json.dumps({'mode': args.worker, 'harvested': harvested, 'seconds': elapsed, 'peak_rss': get_peak_rss(sampled), 'timings': timings}))
+
+
+def format_report(results):
+    lines = ['{:<10} {:>9} {:>9} {:>12} {:>10}  {}'.format('mode', 'articles', 'seconds', 'articles/s', 'peak MB', 'stages (seconds)')]
+    for result in results:
+        if 'error' in result:
+            lines.append('{:<10} failed: {}'.format(result['mode'], result['error']))
+            continue
+        stages = ', '.join('{} {:.2f}'.format(stage, timing['seconds']) for stage, timing in sorted(result['timings'].items()))
+        lines.append('{:<10} {:>9} {:>9.2f} {:>12.1f} {:>10.1f}  {}'.format(
+            result['mode'], result['harvested'], result['seconds'], result['harvested'] / result['seconds'], result['peak_rss'] / 1024 / 1024, stages))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--total', type=int, default=1000, help='Number of articles in the fake results')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES, help='Modes to benchmark')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds the fake Trove waits before each response')
+    parser.add_argument('--pdf_delay', type=float, default=0.5, help='Seconds before a PDF rendition is ready')
+    parser.add_argument('--errors', type=float, default=0, help='Proportion of requests that get a 500 error')
+    parser.add_argument('--throttle', type=float, default=0, help='Proportion of requests that get a 429 response')
+    parser.add_argument('--rate', type=float, default=1000, help='Requests per second allowed to each endpoint')
+    parser.add_argument('--text_workers', type=int, help='Number of processes used to convert text')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Format of the results')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    # Used to run each harvest in its own process
+    parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--data_dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        return run_harvest(args)
+    server = FakeTrove(total=args.total, latency=args.latency, pdf_delay=args.pdf_delay, errors=args.errors, throttle=args.throttle).start()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.environ.get('PYTHONPATH', '')]))
+    results = []
+    try:
+        for mode in args.modes:
+            data_dir = tempfile.mkdtemp(prefix='trove-benchmark-')
+            command = [sys.executable, os.path.abspath(__file__), '--worker', mode, '--url', server.url, '--data_dir', data_dir, '--total', str(args.total), '--rate', str(args.rate), '--format', args.format]
+            if args.text_workers is not None:
+                command += ['--text_workers', str(args.text_workers)]
+            process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if process.returncode == 0:
+                results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+            else:
+                results.append({'mode': mode, 'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else process.returncode})
+            shutil.rmtree(data_dir, ignore_errors=True)
+    finally:
+        server.stop()
+    print(format_report(results))
+    print('Requests: {}'.format(', '.join('{} {}'.format(endpoint, count) for endpoint, count in sorted(server.hits.items()))))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'options': {key: value for key, value in vars(args).items() if key not in ['worker', 'url', 'data_dir', 'output']}, 'results': results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+Micro-benchmark of the extraction of article boxes from the zones in an article's HTML.
+
+Compares the zone scanner used by Harvester.get_article_boxes with the BeautifulSoup
+version it replaced, using synthetic article pages.
+
+Usage:
+
+    python benchmarks/zones.py [--zones 200] [--pages 3] [--repeat 50]
+'''
+
+import argparse
+import random
+import timeit
+from bs4 import BeautifulSoup
+from troveharvester.__main__ import Harvester
+
+
+def make_article_html(num_zones, num_pages):
+    '''
+    Create some HTML that looks like a Trove article, with the zones spread over a number of pages.
+    '''
+    lines = ['<html><head><title>Article</title></head><body><div class="ocr-text"><div class="read">']
+    page_id = 1000000
+    per_page = max(1, num_zones // num_pages)
+    for i in range(num_zones):
+        if i and i % per_page == 0 and page_id < 1000000 + num_pages - 1:
+            page_id += 1
+        zone_class = 'onPage' if page_id == 1000000 else 'offPage'
+        lines.append(
+            '<div class="zone {}" data-page-id="{}" data-x="{}" data-y="{}" data-w="{}" data-h="{}">'
+            '<span class="word">Some</span> <span class="word">OCRd</span> <span class="word">text</span></div>'.format(
+                zone_class, page_id, random.randint(100, 3000), random.randint(100, 5000), random.randint(200, 900), random.randint(20, 40)
+            )
+        )
+    lines.append('</div></div></body></html>')
+    return '\n'.join(lines)
+
+
+def soup_get_box(zones):
+    # The original implementation from Harvester.get_box
+    left = 10000
+    right = 0
+    top = 10000
+    bottom = 0
+    page_id = zones[0]['data-page-id']
+    for zone in zones:
+        if int(zone['data-y']) < top:
+            top = int(zone['data-y'])
+        if int(zone['data-x']) < left:
+            left = int(zone['data-x'])
+        if (int(zone['data-x']) + int(zone['data-w'])) > right:
+            right = int(zone['data-x']) + int(zone['data-w'])
+        if (int(zone['data-y']) + int(zone['data-h'])) > bottom:
+            bottom = int(zone['data-y']) + int(zone['data-h'])
+    return {'page_id': page_id, 'left': left, 'top': top, 'right': right, 'bottom': bottom}
+
+
+def soup_get_article_boxes(html):
+    # The original implementation from Harvester.get_article_boxes
+    boxes = []
+    soup = BeautifulSoup(html, 'lxml')
+    zones = soup.select('div.zone.onPage')
+    boxes.append(soup_get_box(zones))
+    off_page_zones = soup.select('div.zone.offPage')
+    if off_page_zones:
+        current_page = off_page_zones[0]['data-page-id']
+        zones = []
+        for zone in off_page_zones:
+            if zone['data-page-id'] == current_page:
+                zones.append(zone)
+            else:
+                boxes.append(soup_get_box(zones))
+                zones = [zone]
+                current_page = zone['data-page-id']
+        boxes.append(soup_get_box(zones))
+    return boxes
+
+
+def scan_get_article_boxes(html):
+    # Harvester.get_article_boxes without the download
+    return Harvester.__new__(Harvester).get_zone_boxes(html)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zones', type=int, default=200, help='Number of zones (lines of text) in each article')
+    parser.add_argument('--pages', type=int, default=3, help='Number of pages the article is spread across')
+    parser.add_argument('--repeat', type=int, default=50, help='Number of times to extract the boxes')
+    args = parser.parse_args()
+    html = make_article_html(args.zones, args.pages)
+    # Make sure they agree before timing them
+    assert soup_get_article_boxes(html) == scan_get_article_boxes(html)
+    for name, func in [('BeautifulSoup', soup_get_article_boxes), ('Zone scanner', scan_get_article_boxes)]:
+        seconds = timeit.timeit(lambda: func(html), number=args.repeat)
+        print('{}: {:.2f} ms per article'.format(name, seconds / args.repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,10 @@ setup(name='troveharvester',
       author_email='tim@discontents.com.au',
       licence='CC0',
       url='https://github.com/wragge/troveharvester',
-      install_requires=['pandas', 'requests', 'arrow', 'tqdm', 'pillow', 'bs4', 'lxml', 'html2text', 'trove-query-parser', 'trove-newspaper-images'],
+      install_requires=['numpy', 'requests', 'arrow', 'tqdm', 'pillow', 'html2text', 'trove-query-parser', 'trove-newspaper-images'],
+      extras_require={
+          'parquet': ['pyarrow']
+      },
       entry_points={
           'console_scripts': [
               'troveharvester = troveharvester.__main__:main'
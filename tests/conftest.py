@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_trove import FakeTrove, configure  # noqa: E402
+from troveharvester.__main__ import limiter, prepare_query  # noqa: E402
+
+QUERY = 'https://trove.nla.gov.au/search/category/newspapers?keyword=wragge'
+TOTAL = 250
+
+
+@pytest.fixture(scope='session')
+def trove():
+    '''
+    A fake Trove with TOTAL articles (in pages of 100) that the harvester is pointed at.
+    '''
+    server = FakeTrove(total=TOTAL, pdf_delay=0).start()
+    configure(server.url)
+    # The fake Trove can go as fast as we like
+    for endpoint in ['api', 'rendition', 'image', 'article']:
+        limiter.set_rate(endpoint, 1000)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def query_params(trove):
+    return prepare_query(QUERY, False, 'test')
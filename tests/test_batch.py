@@ -0,0 +1,54 @@
+import csv
+import json
+import os
+import sys
+
+from troveharvester.__main__ import main, run_batch, write_metadata, get_metadata
+from conftest import QUERY, TOTAL
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['troveharvester'] + list(args))
+    main()
+
+
+def read_ids(harvest_dir):
+    with open(os.path.join(harvest_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+        return [row['article_id'] for row in csv.DictReader(results_file)]
+
+
+def start_batch(trove, tmp_path, monkeypatch, *options):
+    monkeypatch.chdir(tmp_path)
+    # The second query overlaps the first (it's limited to one newspaper)
+    with open('queries.txt', 'w') as queries_file:
+        queries_file.write('{}\n{}&l-title=10\n'.format(QUERY, QUERY))
+    run(monkeypatch, 'batch', 'queries.txt', 'test', '--prefetch', '0', *options)
+    batch = os.listdir('data')[0]
+    return os.path.join('data', batch)
+
+
+def test_batch_fetches_each_article_once(trove, tmp_path, monkeypatch):
+    pdfs = trove.hits.get('pdf', 0)
+    batch_dir = start_batch(trove, tmp_path, monkeypatch, '--pdf', '--text', '--text_workers', '0')
+    all_ids = read_ids(os.path.join(batch_dir, '001'))
+    title_ids = read_ids(os.path.join(batch_dir, '002'))
+    assert len(set(all_ids)) == len(all_ids) == TOTAL
+    assert title_ids and set(title_ids) < set(all_ids)
+    # Each article's PDF and text was saved once, in the shared store
+    assert trove.hits['pdf'] - pdfs == TOTAL
+    assert len(os.listdir(os.path.join(batch_dir, 'store', 'pdf'))) == TOTAL
+    assert len(os.listdir(os.path.join(batch_dir, 'store', 'text'))) == TOTAL
+    assert not os.path.exists(os.path.join(batch_dir, '002', 'pdf')) or not os.listdir(os.path.join(batch_dir, '002', 'pdf'))
+    # The harvests know where to find the store
+    assert get_metadata(os.path.join(batch_dir, '002'))['store'] == os.path.join('..', 'store')
+
+
+def test_batch_rejects_conflicting_options(trove, tmp_path, monkeypatch, capsys):
+    batch_dir = start_batch(trove, tmp_path, monkeypatch, '--max', '100')
+    with open(os.path.join(batch_dir, 'batch.json'), 'r') as batch_file:
+        harvests = json.load(batch_file)['harvests']
+    meta = get_metadata(os.path.join(batch_dir, harvests[1]))
+    meta['bundle_size'] = 10
+    write_metadata(os.path.join(batch_dir, harvests[1]), meta)
+    run_batch(batch_dir, harvests)
+    assert 'different options (bundle_size)' in capsys.readouterr().out
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tarfile
+from io import BytesIO
+
+from troveharvester.__main__ import Harvester, BundleReader, make_dir
+from conftest import TOTAL
+
+BUNDLE_SIZE = 0.05
+
+
+def harvest_texts(query_params, data_dir, **kwargs):
+    make_dir(os.path.join(data_dir, 'text'))
+    harvester = Harvester(query_params=query_params, key='test', data_dir=data_dir, text=True, text_workers=0, prefetch=0, **kwargs)
+    harvester.harvest()
+
+
+def count_bundles(files, max_size):
+    '''
+    Pack the files, in order, into as few in-memory tar files of at most max_size bytes as possible.
+    '''
+    bundles = 0
+    members = []
+    for name, content in files:
+        output = BytesIO()
+        with tarfile.open(fileobj=output, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            for member_name, member_content in members + [(name, content)]:
+                info = tarfile.TarInfo(member_name)
+                info.size = len(member_content)
+                tar.addfile(info, BytesIO(member_content))
+        if members and len(output.getvalue()) > max_size:
+            bundles += 1
+            members = []
+        members.append((name, content))
+    return bundles + 1
+
+
+def test_bundle_round_trip(query_params, tmp_path):
+    files_dir = str(tmp_path / 'files')
+    bundle_dir = str(tmp_path / 'bundles')
+    harvest_texts(query_params, files_dir)
+    # Small (fractional MB) bundles, so the texts are spread across a few of them
+    harvest_texts(query_params, bundle_dir, bundle=True, bundle_size=BUNDLE_SIZE)
+    text_files = sorted(os.listdir(os.path.join(files_dir, 'text')))
+    assert len(text_files) == TOTAL
+    reader = BundleReader(os.path.join(bundle_dir, 'text'))
+    try:
+        assert len(reader) == TOTAL
+        assert reader.keys() == [filename[:-4] for filename in text_files]
+        for filename in text_files:
+            with open(os.path.join(files_dir, 'text', filename), 'rb') as text_file:
+                content = text_file.read()
+            key = filename[:-4]
+            article_id = key.split('-')[-1]
+            assert article_id in reader
+            assert reader.get(article_id) == content
+            assert reader.get_by_key(key) == content
+    finally:
+        reader.close()
+    # The files in the order they were added
+    index = sqlite3.connect(os.path.join(bundle_dir, 'text', 'index.db'))
+    keys = [key for key, in index.execute('SELECT key FROM files ORDER BY bundle, offset')]
+    index.close()
+    files = []
+    for key in keys:
+        with open(os.path.join(files_dir, 'text', key + '.txt'), 'rb') as text_file:
+            files.append((key + '.txt', text_file.read()))
+    max_size = int(BUNDLE_SIZE * 1024 * 1024)
+    bundles = sorted(filename for filename in os.listdir(os.path.join(bundle_dir, 'text')) if filename.endswith('.tar'))
+    assert len(bundles) == count_bundles(files, max_size)
+    assert len(bundles) > 1
+    members = []
+    for bundle in bundles:
+        assert os.path.getsize(os.path.join(bundle_dir, 'text', bundle)) <= max_size
+        # The bundles are ordinary tar files too
+        with tarfile.open(os.path.join(bundle_dir, 'text', bundle)) as tar:
+            members += tar.getnames()
+    assert sorted(members) == text_files
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from fake_trove import FakeTrove
+from troveharvester.__main__ import Downloader, HarvestMetrics, PageImageCache
+
+
+@pytest.fixture
+def page_url(trove):
+    return PageImageCache.image_url.format(1000, 7)
+
+
+def download(url, path):
+    metrics = HarvestMetrics(None)
+    Downloader().download(url, str(path), metrics)
+    with open(str(path), 'rb') as saved:
+        return saved.read(), metrics.counters
+
+
+def test_download_then_skip(trove, page_url, tmp_path):
+    content, counters = download(page_url, tmp_path / 'page.jpg')
+    assert content == trove.page_image
+    assert counters == {'downloads': 1}
+    content, counters = download(page_url, tmp_path / 'page.jpg')
+    assert counters == {'downloads_skipped': 1}
+    assert not os.path.exists(str(tmp_path / 'page.jpg.part'))
+
+
+def test_resume_partial_download(trove, page_url, tmp_path):
+    with open(str(tmp_path / 'page.jpg.part'), 'wb') as part_file:
+        part_file.write(trove.page_image[:1000])
+    content, counters = download(page_url, tmp_path / 'page.jpg')
+    assert content == trove.page_image
+    assert counters == {'downloads': 1, 'downloads_resumed': 1}
+
+
+def test_complete_part_file_is_kept(trove, page_url, tmp_path):
+    # The server answers 416, as there's nothing left to send
+    with open(str(tmp_path / 'page.jpg.part'), 'wb') as part_file:
+        part_file.write(trove.page_image)
+    content, counters = download(page_url, tmp_path / 'page.jpg')
+    assert content == trove.page_image
+    assert counters == {'downloads': 1, 'downloads_resumed': 1}
+
+
+def test_oversized_part_file_is_replaced(trove, page_url, tmp_path):
+    # A 416 for a part file that's bigger than the file (eg if the file has changed) means starting again
+    with open(str(tmp_path / 'page.jpg.part'), 'wb') as part_file:
+        part_file.write(b'x' * (len(trove.page_image) + 10))
+    content, counters = download(page_url, tmp_path / 'page.jpg')
+    assert content == trove.page_image
+    assert counters == {'downloads': 1}
+    assert not os.path.exists(str(tmp_path / 'page.jpg.part'))
+
+
+def test_compressing_server(trove, tmp_path):
+    server = FakeTrove(total=10, compress=True).start()
+    try:
+        url = '{}/ndp/imageservice/nla.news-page1000/level7'.format(server.url)
+        content, counters = download(url, tmp_path / 'page.jpg')
+    finally:
+        server.stop()
+    assert content == server.page_image
+    assert counters == {'downloads': 1}
@@ -0,0 +1,36 @@
+from itertools import islice
+
+import pytest
+
+from troveharvester.__main__ import Harvester
+from conftest import TOTAL
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_resume_after_a_full_page(query_params, prefetch):
+    harvester = Harvester(query_params=query_params, key='test', prefetch=prefetch)
+    articles = harvester.iter_articles()
+    first = [row['article_id'] for row in islice(articles, 100)]
+    articles.close()
+    # Taking exactly one page moves on to the next
+    assert harvester.harvested == 100
+    assert harvester.start not in (None, '*')
+    # The harvester (and its state) can be used again
+    rest = [row['article_id'] for row in harvester.iter_articles(start=harvester.start)]
+    harvester.close()
+    assert len(first) + len(rest) == TOTAL
+    assert len(set(first + rest)) == TOTAL
+
+
+def test_resume_part_way_through_a_page(query_params):
+    harvester = Harvester(query_params=query_params, key='test', text=True, text_workers=1)
+    articles = harvester.iter_articles()
+    first = [row['article_id'] for row in islice(articles, 150)]
+    articles.close()
+    # The unfinished page is yielded again
+    assert harvester.harvested == 100
+    rest = [row for row in harvester.iter_articles(start=harvester.start)]
+    harvester.close()
+    assert [row['article_id'] for row in rest][:50] == first[100:]
+    assert len(set(first + [row['article_id'] for row in rest])) == TOTAL
+    assert all(row['text'] for row in rest)
@@ -0,0 +1,161 @@
+import datetime
+import threading
+import time
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from troveharvester.__main__ import RequestBudget, RateLimiter, ThrottledAdapter, HTTPClient, get_retry_after, size_pool
+
+
+class Response:
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+@pytest.fixture
+def throttling_server():
+    '''
+    A server that answers the first `throttled` requests with a 429 (and the given Retry-After header).
+    '''
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            with server.lock:
+                server.times.append(time.monotonic())
+                throttle = len(server.times) <= server.throttled
+            if throttle:
+                self.send_response(429)
+                if server.retry_after is not None:
+                    self.send_header('Retry-After', server.retry_after)
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.lock = threading.Lock()
+    server.times = []
+    server.throttled = 0
+    server.retry_after = None
+    server.url = 'http://127.0.0.1:{}/article'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_session(limiter, **kwargs):
+    session = requests.Session()
+    session.mount('http://', ThrottledAdapter(limiter, **kwargs))
+    return session
+
+
+def test_get_retry_after():
+    assert get_retry_after(Response({'Retry-After': '3'})) == 3
+    assert get_retry_after(Response({'Retry-After': '-1'})) == 0
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+    assert 25 < get_retry_after(Response({'Retry-After': format_datetime(later, usegmt=True)})) <= 30
+    assert get_retry_after(Response({'Retry-After': 'soon'})) is None
+    assert get_retry_after(Response({})) is None
+
+
+def test_budget_limits_rate():
+    budget = RequestBudget(rate=20, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        budget.acquire()
+        budget.release()
+    # The first request uses the burst, the other five wait for a token each
+    assert time.monotonic() - started >= 5 / 20 * 0.9
+
+
+def test_budget_limits_concurrency():
+    budget = RequestBudget(rate=1000, concurrency=2)
+    budget.acquire()
+    budget.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        budget.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.2)
+    budget.release()
+    assert acquired.wait(1)
+    thread.join()
+    # Successes build up the concurrency slowly, errors halve it
+    assert budget.concurrency == 2.5
+    budget.release(ok=False)
+    assert budget.concurrency == 1.25
+
+
+def test_budget_holds_requests_for_retry_after():
+    budget = RequestBudget(rate=1000)
+    budget.acquire()
+    budget.release(ok=False, retry_after=0.5)
+    started = time.monotonic()
+    budget.acquire()
+    assert time.monotonic() - started >= 0.45
+    budget.release()
+
+
+def test_rate_limiter_endpoints():
+    limiter = RateLimiter()
+    assert limiter.get_endpoint('https://api.trove.nla.gov.au/v2/result?q=wragge') == 'api'
+    assert limiter.get_endpoint('https://trove.nla.gov.au/newspaper/rendition/nla.news-article1.txt') == 'rendition'
+    assert limiter.get_endpoint('https://trove.nla.gov.au/ndp/imageservice/nla.news-page1/level7') == 'image'
+    assert limiter.get_endpoint('https://trove.nla.gov.au/newspaper/article/1') == 'article'
+    limiter.set_rate('api', 50)
+    assert limiter.endpoints['api'].rate == 50
+    assert limiter.endpoints['api'].burst == 50
+
+
+def test_throttled_requests_wait_for_retry_after(throttling_server):
+    throttling_server.throttled = 1
+    throttling_server.retry_after = '1'
+    limiter = RateLimiter({'article': {'rate': 1000}})
+    session = make_session(limiter)
+    response = session.get(throttling_server.url)
+    assert response.status_code == 200
+    first, second = throttling_server.times
+    assert second - first >= 0.9
+    budget = limiter.endpoints['article']
+    assert budget.errors == 1
+    assert budget.requests == 2
+
+
+def test_throttled_requests_give_up(throttling_server):
+    throttling_server.throttled = 10
+    throttling_server.retry_after = '0.05'
+    limiter = RateLimiter({'article': {'rate': 1000}})
+    session = make_session(limiter, throttle_retries=2)
+    response = session.get(throttling_server.url)
+    # After the retries run out, the 429 is returned to the caller
+    assert response.status_code == 429
+    assert len(throttling_server.times) == 3
+
+
+def test_pool_sized_for_workers():
+    session = requests.Session()
+    client = HTTPClient(session=session, workers=16)
+    size_pool(session=session, client=client)
+    # The client's threads, plus a harvest's PDF threads, prefetcher, and main thread
+    assert session.adapters['https://'].pool_maxsize == 16 + 10 + 1 + 1
+    size_pool(harvests=4, pdf_workers=5, prefetch=0, session=session, client=client)
+    assert session.adapters['http://'].pool_maxsize == 16 + 4 * (5 + 1)
+    # Pools don't shrink
+    size_pool(harvests=1, pdf_workers=0, session=session, client=client)
+    adapter = session.adapters['https://']
+    assert adapter.pool_maxsize == 40
+    assert adapter._pool_block
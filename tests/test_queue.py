@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+import pytest
+
+from troveharvester.__main__ import WorkQueue, LeaseLost
+
+UNIT = {'params': {}, 'total': 100}
+
+
+def make_queues(queue_dir, *workers):
+    return [WorkQueue(str(queue_dir), lease_time=0.2, worker=worker) for worker in workers]
+
+
+def test_expired_lease_is_stolen(tmp_path):
+    first, second = make_queues(tmp_path, 'first', 'second')
+    first.add('10', UNIT)
+    assert first.claim() == ('10', UNIT)
+    # It's taken until the lease expires
+    assert second.claim() is None
+    time.sleep(0.3)
+    assert second.claim() == ('10', UNIT)
+    stolen = second.get_token(second.get_path('leases', '10'))
+    # The first worker finds out as soon as it tries to renew the lease, without touching the new one
+    with pytest.raises(LeaseLost):
+        first.renew('10')
+    with pytest.raises(LeaseLost):
+        first.finish('10', 100)
+    first.release('10')
+    assert second.get_token(second.get_path('leases', '10')) == stolen
+    assert second.read_lease('10')['worker'] == 'second'
+    assert second.get_done() == set()
+    second.renew('10')
+    second.finish('10', 100)
+    assert second.get_done() == {'10'}
+    assert second.get_leases() == {}
+
+
+def test_renewal_extends_the_lease(tmp_path):
+    first, second = make_queues(tmp_path, 'first', 'second')
+    first.add('10', UNIT)
+    assert first.claim() is not None
+    for _ in range(3):
+        time.sleep(0.1)
+        first.renew('10')
+        assert second.claim() is None
+
+
+def test_lease_is_given_back_if_stolen_first(tmp_path, monkeypatch):
+    first, second, third = make_queues(tmp_path, 'first', 'second', 'third')
+    first.add('10', UNIT)
+    assert first.acquire('10')
+    time.sleep(0.3)
+    read_lease = second.read_lease
+
+    def read_then_lose_race(unit_id, path=None):
+        # The third worker steals the expired lease between the second worker reading and renaming it
+        lease = read_lease(unit_id, path)
+        if path is None:
+            assert third.acquire(unit_id)
+        return lease
+
+    monkeypatch.setattr(second, 'read_lease', read_then_lose_race)
+    assert not second.acquire('10')
+    assert first.read_lease('10')['worker'] == 'third'
+    third.renew('10')
+    assert sorted(os.listdir(tmp_path / 'leases')) == ['10.json']
+
+
+def test_lease_renewed_during_steal_is_given_back(tmp_path, monkeypatch):
+    first, second = make_queues(tmp_path, 'first', 'second')
+    first.add('10', UNIT)
+    assert first.acquire('10')
+    time.sleep(0.3)
+    read_lease = second.read_lease
+
+    def read_then_renewed(unit_id, path=None):
+        # The first worker renews its lease after the second worker has seen it expired
+        lease = read_lease(unit_id, path)
+        if path is None:
+            first.renew('10')
+        return lease
+
+    monkeypatch.setattr(second, 'read_lease', read_then_renewed)
+    assert not second.acquire('10')
+    first.renew('10')
+    assert first.read_lease('10')['worker'] == 'first'
+    assert sorted(os.listdir(tmp_path / 'leases')) == ['10.json']
+
+
+def test_idle_worker_wakes_when_a_unit_is_finished(tmp_path, monkeypatch):
+    monkeypatch.setattr(WorkQueue, 'poll_interval', 10)
+    queue = WorkQueue(str(tmp_path), lease_time=60, worker='first')
+    queue.add('10', UNIT)
+    assert queue.claim() is not None
+    waited = []
+
+    def idle():
+        started = time.monotonic()
+        queue.wait()
+        waited.append(time.monotonic() - started)
+
+    thread = threading.Thread(target=idle)
+    thread.start()
+    time.sleep(0.1)
+    queue.finish('10', 100)
+    thread.join()
+    assert waited[0] < 1
@@ -0,0 +1,36 @@
+import csv
+import os
+import sys
+
+import pytest
+
+from troveharvester.__main__ import main
+from conftest import QUERY
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['troveharvester'] + list(args))
+    main()
+
+
+def read_ids(harvest_dir):
+    with open(os.path.join(harvest_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+        return [row['article_id'] for row in csv.DictReader(results_file)]
+
+
+@pytest.mark.parametrize('options', [
+    # Prefetched pages beyond the maximum are saved, but their rows aren't
+    ['--max', '150', '--prefetch', '2'],
+    # Shards' pages are saved in whatever order they're fetched
+    ['--shard_by', 'year', '--max', '180', '--prefetch', '2'],
+])
+def test_rebuild_replays_saved_rows(trove, tmp_path, monkeypatch, options):
+    monkeypatch.chdir(tmp_path)
+    run(monkeypatch, 'start', QUERY, 'test', '--text', '--text_workers', '0', *options)
+    source = os.listdir('data')[0]
+    run(monkeypatch, 'rebuild', '--harvest', source, '--text', '--workers', '1')
+    rebuilt = [harvest for harvest in os.listdir('data') if harvest != source][0]
+    source_ids = read_ids(os.path.join('data', source))
+    rebuilt_ids = read_ids(os.path.join('data', rebuilt))
+    assert sorted(rebuilt_ids) == sorted(source_ids)
+    assert sorted(os.listdir(os.path.join('data', rebuilt, 'text'))) == sorted(os.listdir(os.path.join('data', source, 'text')))
@@ -0,0 +1,79 @@
+import csv
+import os
+
+import pytest
+
+from troveharvester.__main__ import Harvester, HarvestState, ResultsWriter, ParquetResultsWriter, load_pyarrow
+from conftest import TOTAL
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_after(monkeypatch, writer_class, pages):
+    '''
+    Stop the harvest (without closing anything) once `pages` pages of rows have been written,
+    but before the harvester saves its nextStart token.
+    '''
+    write_rows = writer_class.write_rows
+    written = []
+
+    def crashing_write_rows(self, rows):
+        added = write_rows(self, rows)
+        written.append(added)
+        if len(written) == pages:
+            raise Crash()
+        return added
+
+    monkeypatch.setattr(writer_class, 'write_rows', crashing_write_rows)
+    monkeypatch.setattr(Harvester, 'close', lambda self: None)
+
+
+def restart(query_params, data_dir, format):
+    state = HarvestState(str(data_dir))
+    start, harvested = state.get_cursor() or ('*', 0)
+    state.close()
+    harvester = Harvester(query_params=query_params, key='test', data_dir=str(data_dir), start=start, format=format, prefetch=0)
+    harvester.harvest()
+    return start
+
+
+def read_csv_ids(csv_file):
+    with open(csv_file, 'r', newline='', encoding='utf-8') as results_file:
+        return [row['article_id'] for row in csv.DictReader(results_file)]
+
+
+def test_csv_restart_after_crash(query_params, tmp_path, monkeypatch):
+    harvester = Harvester(query_params=query_params, key='test', data_dir=str(tmp_path), prefetch=0)
+    crash_after(monkeypatch, ResultsWriter, 2)
+    with pytest.raises(Crash):
+        harvester.harvest()
+    monkeypatch.undo()
+    # The second page was written, but the harvest starts again from it
+    assert len(read_csv_ids(tmp_path / 'results.csv')) == 200
+    assert restart(query_params, tmp_path, 'csv') not in (None, '*')
+    article_ids = read_csv_ids(tmp_path / 'results.csv')
+    assert len(article_ids) == TOTAL
+    assert len(set(article_ids)) == TOTAL
+
+
+def test_parquet_restart_after_crash(query_params, tmp_path, monkeypatch):
+    load_pyarrow()
+    import pyarrow.parquet as pq
+    state = HarvestState(str(tmp_path))
+    # Two pages to a part file, so the crash comes after one part file is finished and while the next is being written
+    writer = ParquetResultsWriter(str(tmp_path), state, pages_per_file=2)
+    harvester = Harvester(query_params=query_params, key='test', data_dir=str(tmp_path), format='parquet', prefetch=0, state=state, writer=writer)
+    crash_after(monkeypatch, ParquetResultsWriter, 3)
+    with pytest.raises(Crash):
+        harvester.harvest()
+    monkeypatch.undo()
+    parquet_dir = tmp_path / 'results.parquet'
+    assert any(filename.endswith('.tmp') for filename in os.listdir(parquet_dir))
+    assert restart(query_params, tmp_path, 'parquet') not in (None, '*')
+    assert not any(filename.endswith('.tmp') for filename in os.listdir(parquet_dir))
+    article_ids = pq.read_table(str(parquet_dir), columns=['article_id']).column('article_id').to_pylist()
+    assert len(article_ids) == TOTAL
+    assert len(set(article_ids)) == TOTAL
+
@@ -0,0 +1,74 @@
+import csv
+import os
+from itertools import islice
+
+import pytest
+
+from troveharvester.__main__ import Harvester, HarvestState, ResultsWriter
+
+
+@pytest.fixture
+def rows(query_params):
+    harvester = Harvester(query_params=query_params, key='test', prefetch=0)
+    rows = list(islice(harvester.iter_articles(), 150))
+    harvester.close()
+    return rows
+
+
+def read_csv_ids(csv_file):
+    with open(csv_file, 'r', newline='', encoding='utf-8') as results_file:
+        return [row['article_id'] for row in csv.DictReader(results_file)]
+
+
+def test_results_writer_appends_new_rows(rows, tmp_path):
+    csv_file = str(tmp_path / 'results.csv')
+    writer = ResultsWriter(csv_file)
+    assert writer.write_rows(rows[:100]) == 100
+    # Overlapping pages only add the rows not already written
+    assert writer.write_rows(rows[50:120]) == 20
+    assert len(writer) == 120
+    writer.close()
+    # Reopening an existing file (with no state) collects the ids already there, and appends after them
+    writer = ResultsWriter(csv_file)
+    assert len(writer) == 120
+    assert writer.write_rows(rows) == 30
+    writer.close()
+    assert read_csv_ids(csv_file) == [str(row['article_id']) for row in rows]
+
+
+@pytest.mark.parametrize('with_state', [False, True])
+def test_results_writer_picks_up_existing_file(rows, tmp_path, with_state):
+    csv_file = str(tmp_path / 'results.csv')
+    writer = ResultsWriter(csv_file)
+    writer.write_rows(rows[:100])
+    writer.close()
+    # An existing results.csv without a record in harvest.db has its ids added to the state
+    state = HarvestState(str(tmp_path)) if with_state else None
+    writer = ResultsWriter(csv_file, state=state)
+    assert len(writer) == 100
+    assert writer.write_rows(rows[90:]) == 50
+    writer.close()
+    if state:
+        assert state.get_output('results.csv') == (os.path.getsize(csv_file), 150)
+        state.close()
+    assert read_csv_ids(csv_file) == [str(row['article_id']) for row in rows]
+
+
+def test_results_writer_truncates_to_recorded_size(rows, tmp_path):
+    csv_file = str(tmp_path / 'results.csv')
+    state = HarvestState(str(tmp_path))
+    writer = ResultsWriter(csv_file, state=state)
+    assert writer.write_rows(rows[:100]) == 100
+    writer.close()
+    size = os.path.getsize(csv_file)
+    # A row that was only partly written before a crash
+    with open(csv_file, 'a', encoding='utf-8') as results_file:
+        results_file.write('{},The Daily Exa'.format(rows[100]['article_id']))
+    writer = ResultsWriter(csv_file, state=state)
+    assert os.path.getsize(csv_file) == size
+    assert len(writer) == 100
+    # Rows already saved are skipped
+    assert writer.write_rows(rows[50:]) == 50
+    writer.close()
+    state.close()
+    assert read_csv_ids(csv_file) == [str(row['article_id']) for row in rows]
@@ -0,0 +1,98 @@
+import csv
+import json
+import os
+import sys
+
+import pytest
+
+from troveharvester.__main__ import main, count_rows, rebuild_stats, get_metadata, Harvester, HarvestState, ResultsWriter
+from conftest import QUERY, TOTAL
+from test_restart import Crash, crash_after, restart
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['troveharvester'] + list(args))
+    main()
+
+
+def read_rows(data_dir):
+    with open(os.path.join(data_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+        return list(csv.DictReader(results_file))
+
+
+def get_stats(data_dir):
+    state = HarvestState(str(data_dir))
+    stats = state.get_stats()
+    state.close()
+    return stats
+
+
+def test_count_rows():
+    rows = [
+        {'date': '1901-02-03', 'newspaper_id': '10', 'newspaper_title': 'The Daily', 'category': 'Article', 'words': '120'},
+        {'date': '1901-12-31', 'newspaper_id': '11', 'newspaper_title': 'The Weekly', 'category': 'Advertising', 'words': 99},
+        {'date': '1902-01-01', 'newspaper_id': '10', 'newspaper_title': 'The Daily', 'category': 'Article', 'words': '20000'},
+        {'date': None, 'newspaper_id': '12', 'category': '', 'words': None}
+    ]
+    stats = count_rows(rows)
+    assert stats[('total', '')] == [None, 4, 20219]
+    assert stats[('year', '1901')] == [None, 2, 219]
+    assert stats[('year', '')] == [None, 1, 0]
+    assert stats[('newspaper', '10')] == ['The Daily', 2, 20120]
+    assert stats[('category', 'Article')] == [None, 2, 20120]
+    assert stats[('words', '0')] == [None, 2, 99]
+    assert stats[('words', '100')] == [None, 1, 120]
+    assert stats[('words', '10000')] == [None, 1, 20000]
+    # Adding to existing statistics
+    count_rows(rows[:1], stats)
+    assert stats[('total', '')] == [None, 5, 20339]
+
+
+@pytest.mark.parametrize('format', ['csv', 'parquet'])
+def test_stats_match_results(trove, tmp_path, monkeypatch, format):
+    if format == 'parquet':
+        pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    run(monkeypatch, 'start', QUERY, 'test', '--format', format, '--max', '150', '--prefetch', '0')
+    harvest = os.listdir('data')[0]
+    data_dir = os.path.join('data', harvest)
+    stats = get_stats(data_dir)
+    assert stats[('total', '')][1] == 200
+    # Recalculating them from the results gives the same statistics
+    state = HarvestState(data_dir)
+    assert rebuild_stats(data_dir, get_metadata(data_dir), state) == stats
+    assert state.get_stats() == stats
+    state.close()
+    if format == 'csv':
+        assert stats == count_rows(read_rows(data_dir))
+
+
+def test_stats_after_restart(query_params, tmp_path, monkeypatch):
+    harvester = Harvester(query_params=query_params, key='test', data_dir=str(tmp_path), prefetch=0)
+    crash_after(monkeypatch, ResultsWriter, 2)
+    with pytest.raises(Crash):
+        harvester.harvest()
+    monkeypatch.undo()
+    restart(query_params, tmp_path, 'csv')
+    # The page written before the crash, then harvested again, is only counted once
+    stats = get_stats(tmp_path)
+    assert stats[('total', '')][1] == TOTAL
+    assert stats == count_rows(read_rows(tmp_path))
+
+
+def test_stats_command(trove, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    run(monkeypatch, 'start', QUERY, 'test', '--prefetch', '0')
+    harvest = os.listdir('data')[0]
+    stats = count_rows(read_rows(os.path.join('data', harvest)))
+    capsys.readouterr()
+    run(monkeypatch, 'stats', '--harvest', harvest, '--facet', 'year')
+    output = capsys.readouterr().out
+    assert 'Articles: {}'.format(TOTAL) in output
+    for (facet, key), (label, articles, words) in stats.items():
+        if facet == 'year':
+            assert any(line.split()[:2] == [key, str(articles)] for line in output.splitlines())
+    run(monkeypatch, 'stats', '--harvest', harvest, '--export', 'stats.json')
+    with open('stats.json', 'r') as stats_file:
+        exported = json.load(stats_file)
+    assert {(row['facet'], row['key']): [row['label'], row['articles'], row['words']] for row in exported} == stats
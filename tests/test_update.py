@@ -0,0 +1,73 @@
+import csv
+import datetime
+import json
+import os
+import sys
+
+import pytest
+
+from troveharvester.__main__ import main, get_latest_date, load_pyarrow
+from conftest import QUERY, TOTAL
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['troveharvester'] + list(args))
+    main()
+
+
+def read_rows(harvest_dir):
+    with open(os.path.join(harvest_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+        return list(csv.DictReader(results_file))
+
+
+def test_update_adds_only_new_articles(trove, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Only the older articles have been published when the harvest is made
+    monkeypatch.setattr(trove, 'total', 150)
+    run(monkeypatch, 'start', QUERY, 'test', '--text', '--text_workers', '0', '--prefetch', '0')
+    harvest = os.listdir('data')[0]
+    harvest_dir = os.path.join('data', harvest)
+    rows = read_rows(harvest_dir)
+    assert len(rows) == 150
+    latest = max(row['date'] for row in rows)
+    monkeypatch.setattr(trove, 'total', TOTAL)
+    run(monkeypatch, 'update', '--harvest', harvest, '--overlap', '7')
+    with open(os.path.join(harvest_dir, 'metadata.json'), 'r') as meta_file:
+        meta = json.load(meta_file)
+    since = (datetime.date.fromisoformat(latest) - datetime.timedelta(days=7)).isoformat()
+    assert meta['updates'][-1]['since'] == since
+    rows = read_rows(harvest_dir)
+    article_ids = [row['article_id'] for row in rows]
+    # The overlapping articles were fetched again, but not added again
+    assert len(article_ids) == TOTAL
+    assert len(set(article_ids)) == TOTAL
+    assert len(os.listdir(os.path.join(harvest_dir, 'text'))) == TOTAL
+    assert get_latest_date(harvest_dir, meta) == max(row['date'] for row in rows)
+
+
+def test_latest_date_from_csv(tmp_path):
+    with open(tmp_path / 'results.csv', 'w', newline='', encoding='utf-8') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=['article_id', 'date'])
+        writer.writeheader()
+        for article_id, date in [(1, '1901-02-03'), (2, '1903-01-01'), (3, ''), (4, '1902-12-31')]:
+            writer.writerow({'article_id': article_id, 'date': date})
+    assert get_latest_date(str(tmp_path), {'format': 'csv'}) == '1903-01-01'
+    assert get_latest_date(str(tmp_path / 'missing'), {'format': 'csv'}) is None
+
+
+def test_latest_date_from_finished_parquet_files(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    load_pyarrow()
+    import pyarrow.parquet as pq
+    parquet_dir = tmp_path / 'results.parquet'
+    parquet_dir.mkdir()
+
+    def write(filename, dates):
+        table = pa.table({'article_id': [str(i) for i in range(len(dates))], 'date': pa.array(dates, type=pa.date32())})
+        pq.write_table(table, str(parquet_dir / filename))
+
+    write('part-00000.parquet', [datetime.date(1901, 1, 1), None])
+    write('shard-1900-part-00000.parquet', [datetime.date(1902, 6, 30), datetime.date(1900, 1, 1)])
+    # A part that was still being written (and so may not be complete)
+    write('part-00001.parquet.tmp', [datetime.date(1950, 1, 1)])
+    assert get_latest_date(str(tmp_path), {'format': 'parquet'}) == '1902-06-30'
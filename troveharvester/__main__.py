@@ -13,31 +13,376 @@ import argparse
 import os
 import datetime
 import arrow
-from tqdm import tqdm
 import json
+import csv
+import sqlite3
+import tarfile
+import gzip
+import hashlib
+import math
+import shutil
+import socket
 from pprint import pprint
 import re
+import threading
+import multiprocessing
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from itertools import repeat
+from email.utils import parsedate_to_datetime
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from requests.exceptions import HTTPError
-from bs4 import BeautifulSoup
-from PIL import Image
-from io import BytesIO
-import re
-import html2text
-import pandas as pd
+from io import BytesIO, StringIO
 try:
     from urllib.parse import urlparse, parse_qsl, parse_qs
 except ImportError:
     from urlparse import urlparse, parse_qsl
 from pathlib import Path
-from trove_query_parser.parser import parse_query
+# The heavier libraries (numpy, Pillow, html2text, tqdm, trove_query_parser, and pyarrow)
+# are imported where they're used, so that `report` and `restart` start quickly.
+# Parquet output is optional, pyarrow is loaded by load_pyarrow()
+pa = None
+pq = None
+
+
+class RequestBudget:
+    '''
+    A token bucket that limits the rate of requests to one class of endpoint,
+    combined with a limit on the number of requests in flight that adapts to errors:
+    it grows slowly while requests succeed and is halved when they fail (AIMD).
+    '''
+
+    def __init__(self, rate, burst=None, concurrency=4, max_concurrency=16):
+        # Rate is requests per second
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.blocked_until = 0
+        self.requests = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        '''
+        Wait until a request can be made.
+        '''
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.active >= int(self.concurrency):
+                    # Wait for another request to finish
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+                self.condition.wait(wait)
+
+    def release(self, ok=True, retry_after=None):
+        '''
+        Record the outcome of a request, adjusting the concurrency limit.
+        If the server asked us to back off, hold all requests to this endpoint until the time is up.
+        '''
+        with self.condition:
+            self.active -= 1
+            self.requests += 1
+            if ok:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            else:
+                self.errors += 1
+                self.concurrency = max(1, self.concurrency / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            self.condition.notify_all()
+
+
+class RateLimiter:
+    '''
+    Separate request budgets for each class of Trove endpoint, shared by every request made through the session.
+    '''
+    budgets = {
+        'api': {'rate': 3, 'burst': 5},
+        'rendition': {'rate': 10, 'burst': 10},
+        'image': {'rate': 10, 'burst': 10},
+        'article': {'rate': 10, 'burst': 10}
+    }
+
+    def __init__(self, budgets=None):
+        self.endpoints = {}
+        for endpoint, budget in (budgets or self.budgets).items():
+            self.endpoints[endpoint] = RequestBudget(**budget)
+
+    def get_endpoint(self, url):
+        if 'api.trove.nla.gov.au' in url or urlparse(url).path.endswith('/result'):
+            return 'api'
+        elif '/rendition/' in url:
+            return 'rendition'
+        elif 'imageservice' in url:
+            return 'image'
+        else:
+            return 'article'
+
+    def get_budget(self, url):
+        return self.endpoints[self.get_endpoint(url)]
+
+    def set_rate(self, endpoint, rate, burst=None):
+        budget = self.endpoints[endpoint]
+        with budget.condition:
+            budget.rate = rate
+            budget.burst = burst or max(1, rate)
+
+
+def get_retry_after(response):
+    '''
+    Get the number of seconds to wait from a Retry-After header (either seconds or a date).
+    '''
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(0, float(value))
+        except ValueError:
+            try:
+                return max(0, (parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return None
+
 
+class ThrottledAdapter(HTTPAdapter):
+    '''
+    Send every request through the rate limiter.
+    If Trove responds with a 429 or 503 status, hold requests to that endpoint for as long as
+    the Retry-After header says (or an increasing delay if there isn't one) and try again.
+    '''
+    throttle_status = [429, 503]
+
+    def __init__(self, limiter, throttle_retries=5, **kwargs):
+        self.limiter = limiter
+        self.throttle_retries = throttle_retries
+        self.pool_maxsize = kwargs.get('pool_maxsize', requests.adapters.DEFAULT_POOLSIZE)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        budget = self.limiter.get_budget(request.url)
+        for attempt in range(self.throttle_retries + 1):
+            budget.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                budget.release(ok=False)
+                raise
+            if response.status_code in self.throttle_status:
+                budget.release(ok=False, retry_after=get_retry_after(response) or 2 ** attempt)
+                if attempt < self.throttle_retries:
+                    response.close()
+                    continue
+            else:
+                budget.release(ok=response.status_code < 500)
+            return response
+
+
+limiter = RateLimiter()
 s = requests.Session()
-retries = Retry(total=5, backoff_factor=1, status_forcelist=[ 500, 502, 503, 504 ])
-s.mount('http://', HTTPAdapter(max_retries=retries))
-s.mount('https://', HTTPAdapter(max_retries=retries))
+# 429 and 503 responses are retried by the ThrottledAdapter so the rate limiter knows about them
+retries = Retry(total=5, backoff_factor=1, status_forcelist=[ 500, 502, 504 ], respect_retry_after_header=False)
+
+
+class HTTPClient:
+    '''
+    All the harvester's requests go through here.
+    Requests use the pooled session, so connections to each Trove host are kept alive and reused,
+    failed requests are retried, and everything is throttled by the rate limiter.
+    Batches of requests can be run concurrently in a shared pool of threads.
+    '''
+
+    def __init__(self, session=s, workers=16, timeout=30):
+        self.session = session
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Run a function that makes requests in the shared pool, returning a future.
+        '''
+        return self.get_executor().submit(func, *args, **kwargs)
+
+    def map(self, func, items):
+        '''
+        Run a function that makes requests over a list of items concurrently, returning the results in order.
+        '''
+        return list(self.get_executor().map(func, items))
+
+    def as_completed(self, func, items):
+        '''
+        Run a function that makes requests over a list of items concurrently,
+        yielding (item, result) pairs as they finish.
+        '''
+        executor = self.get_executor()
+        futures = {executor.submit(func, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
+http = HTTPClient()
+pool_lock = threading.Lock()
+
+
+def size_pool(harvests=1, pdf_workers=10, prefetch=2, session=s, client=http):
+    '''
+    Make the session's connection pools (one for each Trove host) big enough for every thread that can be
+    making a request at once -- the HTTP client's shared threads (AWW texts, page images, and downloads),
+    plus the PDF rendition threads, prefetcher, and main thread of each of the harvests running together.
+    The pools only ever grow. Requests beyond the pool size wait for a connection to be free,
+    rather than opening extra connections that would be thrown away.
+    '''
+    size = client.workers + harvests * (pdf_workers + (1 if prefetch else 0) + 1)
+    with pool_lock:
+        adapter = session.adapters.get('https://')
+        if isinstance(adapter, ThrottledAdapter) and adapter.pool_maxsize >= size:
+            return
+        for prefix in ['http://', 'https://']:
+            session.mount(prefix, ThrottledAdapter(limiter, max_retries=retries, pool_maxsize=size, pool_block=True))
+
+
+size_pool()
+
+
+class Downloader:
+    '''
+    Save PDFs and images to disk.
+    Responses are streamed to a .part file in large chunks and the file is renamed once it's complete,
+    so a file that exists is always complete, and is skipped rather than downloaded again.
+    If a download is interrupted, the next attempt asks for the rest of the .part file with a Range header.
+    Downloads run in the HTTP client's pool, which is shared by the PDF and image paths.
+    '''
+
+    def __init__(self, client=http, chunk_size=1024 * 1024):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        # Only one thread at a time can download to a path -- each path has a lock and a count of the threads using it
+        self.paths = {}
+
+    @contextmanager
+    def path_lock(self, path):
+        '''
+        Hold the lock for a path. The lock is only discarded once no other thread is holding or waiting for it.
+        '''
+        with self.lock:
+            lock, users = self.paths.get(path, (None, 0))
+            lock = lock or threading.Lock()
+            self.paths[path] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                lock, users = self.paths[path]
+                if users > 1:
+                    self.paths[path] = (lock, users - 1)
+                else:
+                    del self.paths[path]
+
+    def download(self, url, path, metrics=None):
+        '''
+        Save the file at url to path (unless it's already there), returning the path.
+        Downloads, skips and resumes are counted in metrics (if given).
+        '''
+        with self.path_lock(path):
+            if os.path.exists(path):
+                if metrics is not None:
+                    metrics.increment('downloads_skipped')
+                return path
+            resumed = self.save(url, path)
+            if metrics is not None:
+                metrics.increment('downloads')
+                if resumed:
+                    metrics.increment('downloads_resumed')
+            return path
+
+    def save(self, url, path):
+        '''
+        Download url to path, returning True if an earlier partial download was resumed.
+        '''
+        part_path = '{}.part'.format(path)
+        try:
+            offset = os.path.getsize(part_path)
+        except OSError:
+            offset = 0
+        # Ask for the file as it is, so Content-Length (and any Range) counts the bytes that are saved
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        with self.client.get(url, headers=headers, stream=True) as response:
+            if offset and response.status_code == 416:
+                # The .part file might already have everything -- but only if it's the size of the whole file
+                match = re.match(r'bytes \*/(\d+)$', response.headers.get('Content-Range', ''))
+                if match and int(match.group(1)) == offset:
+                    os.replace(part_path, path)
+                    return True
+                # Otherwise it's stale (or the file has changed), so start again
+                os.remove(part_path)
+                return self.save(url, path)
+            response.raise_for_status()
+            # If the server ignored the Range header, start again
+            resumed = response.status_code == 206
+            # The length can only be checked if the response isn't compressed (in case the server ignores identity)
+            encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+            expected = None if encoded else response.headers.get('Content-Length')
+            written = 0
+            with open(part_path, 'ab' if resumed else 'wb') as part_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    part_file.write(chunk)
+                    written += len(chunk)
+        if expected is not None and written != int(expected):
+            # Leave the .part file to be resumed
+            raise IOError('Incomplete download of {}: got {} of {} bytes'.format(url, written, expected))
+        os.replace(part_path, path)
+        return resumed
+
+    def fetch(self, url):
+        '''
+        Get the contents of the file at url (for files that aren't saved individually).
+        '''
+        response = self.client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    def submit(self, func, *args):
+        return self.client.submit(func, *args)
 
 FIELDS = [
     'article_id',
@@ -55,6 +400,1540 @@ FIELDS = [
     'page_url'
 ]
 
+# Lines of OCR are in divs with the class 'zone', the position of each line is in data attributes
+ZONE_TAG = re.compile(r'''<div\s[^>]*?(?<![\w-])class\s*=\s*["'][^"']*(?<![\w-])zone(?![\w-])[^"']*["'][^>]*>''', re.IGNORECASE)
+ZONE_ATTRS = re.compile(r'''(?<![\w-])(class|data-page-id|data-x|data-y|data-w|data-h)\s*=\s*["']([^"']*)["']''', re.IGNORECASE)
+ZONE_DATA = ['data-page-id', 'data-x', 'data-y', 'data-w', 'data-h']
+
+
+def extract_zones(html):
+    '''
+    Scan the HTML version of an article for OCR zones, without building a parse tree.
+    Returns a dictionary of arrays -- the page id, x, y, width and height of each zone,
+    and whether it's on the article's own page ('onPage') or a following page ('offPage').
+    Zones that are neither are ignored, but a zone without its page id or position raises a ValueError
+    (rather than quietly leaving the article without an image).
+    '''
+    import numpy as np
+    page_ids = []
+    coords = []
+    on_page = []
+    for tag in ZONE_TAG.finditer(html):
+        attrs = {name.lower(): value for name, value in ZONE_ATTRS.findall(tag.group(0))}
+        classes = attrs['class'].lower().split()
+        if 'onpage' in classes:
+            on_page.append(True)
+        elif 'offpage' in classes:
+            on_page.append(False)
+        else:
+            continue
+        missing = [name for name in ZONE_DATA if not attrs.get(name)]
+        if missing:
+            raise ValueError('OCR zone is missing {}: {}'.format(', '.join(missing), tag.group(0)))
+        page_ids.append(attrs['data-page-id'])
+        coords.append((int(attrs['data-x']), int(attrs['data-y']), int(attrs['data-w']), int(attrs['data-h'])))
+    coords = np.array(coords, dtype=np.int32).reshape(-1, 4)
+    return {
+        'page_id': np.array(page_ids, dtype=str),
+        'x': coords[:, 0],
+        'y': coords[:, 1],
+        'w': coords[:, 2],
+        'h': coords[:, 3],
+        'on_page': np.array(on_page, dtype=bool)
+    }
+
+
+def make_process_pool(max_workers=None):
+    '''
+    Create a process pool whose workers are started by a fork server rather than forked from this process.
+    By the time a pool is needed the HTTP, download and writer threads are running, and forking
+    a process with threads (and the locks they hold) can leave the workers deadlocked.
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+
+
+def convert_text(html_text, include_linebreaks=False):
+    '''
+    Convert the HTML version of an article's OCRd text to plain text.
+    This is a module-level function so it can be run in a process pool.
+    '''
+    import html2text
+    text = html2text.html2text(html_text)
+    if include_linebreaks == False:
+        text = re.sub(r"\s+", " ", text)
+    return text
+
+
+# Lower bounds of the ranges of article lengths (in words) counted in the statistics
+WORD_BUCKETS = [0, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def count_rows(rows, stats=None):
+    '''
+    Count the articles and words in some rows of results by year, newspaper, category, and length,
+    returning (or adding to) a dictionary of [label, articles, words] keyed by (facet, key).
+    '''
+    stats = {} if stats is None else stats
+    for row in rows:
+        words = to_int(row.get('words')) or 0
+        bucket = WORD_BUCKETS[bisect_right(WORD_BUCKETS, words) - 1]
+        for facet, key, label in [
+            ('total', '', None),
+            ('year', str(row.get('date') or '')[:4], None),
+            ('newspaper', str(row.get('newspaper_id') or ''), row.get('newspaper_title')),
+            ('category', row.get('category') or '', None),
+            ('words', str(bucket), None)
+        ]:
+            count = stats.setdefault((facet, key), [label, 0, 0])
+            count[1] += 1
+            count[2] += words
+    return stats
+
+
+# Texts downloaded from the web interface start with a header paragraph and a rule
+TEXT_HEADER = re.compile(r'<p\b[^>]*>.*?</p>', re.S | re.I)
+TEXT_RULE = re.compile(r'<hr\b[^>]*>', re.I)
+
+
+def strip_text_header(html_text):
+    '''
+    Remove the header (the first paragraph and horizontal rule) from a text downloaded from the web interface.
+    '''
+    html_text = TEXT_HEADER.sub('', html_text, count=1)
+    return TEXT_RULE.sub('', html_text, count=1)
+
+
+class HarvestState:
+    '''
+    Keeps track of a harvest's progress in a SQLite database (harvest.db) in the harvest directory.
+    The database holds the nextStart token of the harvest (or of each shard), the ids of the articles
+    saved to results.csv along with the size of the file, flags showing which of each article's
+    PDF, text, and images have been saved, the time spent on each stage of the harvest, and statistics
+    (the number of articles and words by year, newspaper, category, and length) updated as rows are saved.
+    Updates are made in transactions, so the state survives a crash in the middle of a page.
+    If there's no data_dir (as when articles are streamed with Harvester.iter_articles), the database is kept in memory.
+    The database uses WAL journaling unless another journal_mode is given -- WAL needs shared memory,
+    so it can't be used for databases on network storage (like the work units of a queued harvest).
+    '''
+    db_file = 'harvest.db'
+    stages = ['pdf', 'text', 'image']
+
+    def __init__(self, data_dir, journal_mode='WAL'):
+        self.path = os.path.join(data_dir, self.db_file) if data_dir else ':memory:'
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS cursors (shard TEXT PRIMARY KEY, start TEXT, harvested INTEGER)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS outputs (name TEXT PRIMARY KEY, size INTEGER, rows INTEGER)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS articles (article_id TEXT PRIMARY KEY, saved INTEGER DEFAULT 0, pdf INTEGER DEFAULT 0, text INTEGER DEFAULT 0, image INTEGER DEFAULT 0)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS timings (stage TEXT PRIMARY KEY, seconds REAL, count INTEGER)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (seq INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT, start TEXT, path TEXT, UNIQUE (query, start))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS dates (name TEXT PRIMARY KEY, date TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS stats (facet TEXT, key TEXT, label TEXT, articles INTEGER, words INTEGER, PRIMARY KEY (facet, key))')
+            # The position of the last row in an output file (added later, so may be missing from older databases)
+            try:
+                self.db.execute('ALTER TABLE outputs ADD COLUMN last_row INTEGER')
+            except sqlite3.OperationalError:
+                pass
+            # The saved API response each article's row came from (also added later)
+            try:
+                self.db.execute('ALTER TABLE articles ADD COLUMN response TEXT')
+            except sqlite3.OperationalError:
+                pass
+
+    def get_cursor(self, shard=''):
+        '''
+        Get the saved nextStart token and number of articles harvested, or None if there isn't one.
+        '''
+        with self.lock:
+            return self.db.execute('SELECT start, harvested FROM cursors WHERE shard = ?', (shard,)).fetchone()
+
+    def get_cursors(self):
+        with self.lock:
+            return {shard: (start, harvested) for shard, start, harvested in self.db.execute('SELECT shard, start, harvested FROM cursors')}
+
+    def save_cursor(self, start, harvested, shard=''):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO cursors (shard, start, harvested) VALUES (?, ?, ?)', (shard, start, harvested))
+
+    def get_output(self, name):
+        '''
+        Get the size (in bytes) and number of rows of an output file, or None if it hasn't been recorded.
+        '''
+        with self.lock:
+            return self.db.execute('SELECT size, rows FROM outputs WHERE name = ?', (name,)).fetchone()
+
+    def get_last_row(self, name):
+        '''
+        Get the offset (in bytes) of the last row written to an output file, or None if it hasn't been recorded.
+        '''
+        with self.lock:
+            row = self.db.execute('SELECT last_row FROM outputs WHERE name = ?', (name,)).fetchone()
+            return row[0] if row else None
+
+    def get_latest_date(self):
+        '''
+        Get the publication date (YYYY-MM-DD) of the newest article harvested, or None if it hasn't been recorded.
+        '''
+        with self.lock:
+            row = self.db.execute("SELECT date FROM dates WHERE name = 'latest'").fetchone()
+            return row[0] if row else None
+
+    def save_latest_date(self, date):
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO dates (name, date) VALUES ('latest', ?) ON CONFLICT(name) DO UPDATE SET date = MAX(date, excluded.date)", (date,))
+
+    def get_saved(self, article_ids):
+        '''
+        Return the ids from the supplied list of articles that have already been saved.
+        '''
+        with self.lock:
+            return self.select_ids('SELECT article_id FROM articles WHERE saved = 1 AND article_id IN ({})', article_ids)
+
+    def save_rows(self, name, article_ids, size, last_row=None, stats=None):
+        '''
+        Record that rows have been added to an output file, the file's new size, and where the last row starts,
+        along with the statistics of the new rows (from count_rows), so they always match the rows saved.
+        '''
+        with self.lock, self.db:
+            if stats:
+                self.insert_stats(stats)
+            self.db.executemany('INSERT INTO articles (article_id, saved) VALUES (?, 1) ON CONFLICT(article_id) DO UPDATE SET saved = 1', [(str(article_id),) for article_id in article_ids])
+            self.db.execute('INSERT INTO outputs (name, size, rows, last_row) VALUES (?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET size = excluded.size, rows = rows + excluded.rows, last_row = COALESCE(excluded.last_row, last_row)', (name, size, len(article_ids), last_row))
+
+    def insert_stats(self, stats):
+        self.db.executemany(
+            'INSERT INTO stats (facet, key, label, articles, words) VALUES (?, ?, ?, ?, ?) ON CONFLICT(facet, key) DO UPDATE SET label = COALESCE(excluded.label, label), articles = articles + excluded.articles, words = words + excluded.words',
+            [(facet, key, label, articles, words) for (facet, key), (label, articles, words) in stats.items()]
+        )
+
+    def add_stats(self, stats, replace=False):
+        '''
+        Add to the statistics (or replace them).
+        '''
+        with self.lock, self.db:
+            if replace:
+                self.db.execute('DELETE FROM stats')
+            self.insert_stats(stats)
+
+    def get_stats(self):
+        '''
+        Get the statistics as a dictionary of [label, articles, words] keyed by (facet, key).
+        '''
+        with self.lock:
+            return {(facet, key): [label, articles, words] for facet, key, label, articles, words in self.db.execute('SELECT facet, key, label, articles, words FROM stats')}
+
+    def get_completed(self, stage, article_ids):
+        '''
+        Return the ids from the supplied list of articles for which this stage (pdf, text, or image) is complete.
+        '''
+        assert stage in self.stages
+        with self.lock:
+            return self.select_ids('SELECT article_id FROM articles WHERE {} = 1 AND article_id IN ({{}})'.format(stage), article_ids)
+
+    def mark_completed(self, stage, article_ids):
+        assert stage in self.stages
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO articles (article_id, {0}) VALUES (?, 1) ON CONFLICT(article_id) DO UPDATE SET {0} = 1'.format(stage), [(str(article_id),) for article_id in article_ids])
+
+    def add_articles(self, path):
+        '''
+        Copy the saved and completed flags (and saved responses) of the articles recorded in another harvest.db.
+        '''
+        with self.lock:
+            self.db.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                with self.db:
+                    self.db.execute('''
+                        INSERT INTO articles (article_id, saved, pdf, text, image, response) SELECT article_id, saved, pdf, text, image, response FROM other.articles WHERE true
+                        ON CONFLICT(article_id) DO UPDATE SET saved = MAX(saved, excluded.saved), pdf = MAX(pdf, excluded.pdf), text = MAX(text, excluded.text), image = MAX(image, excluded.image),
+                        response = CASE WHEN saved THEN response ELSE excluded.response END
+                    ''')
+            finally:
+                self.db.execute('DETACH DATABASE other')
+
+    def select_ids(self, sql, article_ids):
+        article_ids = [str(article_id) for article_id in article_ids]
+        found = set()
+        # Keep under SQLite's limit on the number of parameters
+        for i in range(0, len(article_ids), 500):
+            batch = article_ids[i:i + 500]
+            found.update(row[0] for row in self.db.execute(sql.format(','.join('?' * len(batch))), batch))
+        return found
+
+    def add_timing(self, stage, seconds, count=1):
+        with self.lock, self.db:
+            self.db.execute('INSERT INTO timings (stage, seconds, count) VALUES (?, ?, ?) ON CONFLICT(stage) DO UPDATE SET seconds = seconds + excluded.seconds, count = count + excluded.count', (stage, seconds, count))
+
+    def get_timings(self):
+        with self.lock:
+            return {stage: {'seconds': seconds, 'count': count} for stage, seconds, count in self.db.execute('SELECT stage, seconds, count FROM timings')}
+
+    def add_response(self, query, start, path):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR IGNORE INTO responses (query, start, path) VALUES (?, ?, ?)', (query, start, path))
+
+    def get_responses(self):
+        '''
+        Get the query keys, nextStart tokens, and paths of the saved API responses in the order they were harvested.
+        '''
+        with self.lock:
+            return self.db.execute('SELECT query, start, path FROM responses ORDER BY seq').fetchall()
+
+    def add_page(self, path, article_ids):
+        '''
+        Record the saved API response that a page of articles came from, before their rows are written.
+        Articles whose rows have already been saved (from another page) keep the response they were saved from.
+        '''
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO articles (article_id, response) VALUES (?, ?) ON CONFLICT(article_id) DO UPDATE SET response = excluded.response WHERE saved = 0', [(str(article_id), path) for article_id in article_ids])
+
+    def get_pages(self):
+        '''
+        Get the ids of the articles whose rows were saved from each saved API response, keyed by the response's path.
+        Responses that were fetched but never processed (or whose rows were never committed) aren't included.
+        '''
+        pages = {}
+        with self.lock:
+            for path, article_id in self.db.execute('SELECT response, article_id FROM articles WHERE saved = 1 AND response IS NOT NULL'):
+                pages.setdefault(path, set()).add(article_id)
+        return pages
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class HarvestMetrics:
+    '''
+    Counters and latency histograms for the stages of a harvest.
+    The metrics are saved in the harvest directory as metrics.json and, in the Prometheus
+    text format, as metrics.prom -- every `interval` seconds while the harvest runs, and when it finishes.
+    Metrics saved by an earlier run are loaded, so a restarted harvest keeps adding to the totals.
+    If there's no data_dir, the metrics are only kept in memory.
+    '''
+    json_file = 'metrics.json'
+    prom_file = 'metrics.prom'
+    # Upper bounds (in seconds) of the histogram buckets
+    buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    def __init__(self, data_dir, interval=10):
+        self.data_dir = data_dir
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.stages = {}
+        self.written = time.monotonic()
+        self.load()
+
+    def load(self):
+        if not self.data_dir:
+            return
+        try:
+            with open(os.path.join(self.data_dir, self.json_file), 'r') as metrics_file:
+                metrics = json.load(metrics_file)
+        except (IOError, ValueError):
+            return
+        if metrics.get('buckets') == self.buckets:
+            self.counters = metrics.get('counters', {})
+            self.stages = metrics.get('stages', {})
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                # The last bucket is +Inf
+                self.stages[stage] = {'count': 0, 'seconds': 0, 'buckets': [0] * (len(self.buckets) + 1)}
+            histogram = self.stages[stage]
+            histogram['count'] += 1
+            histogram['seconds'] += seconds
+            histogram['buckets'][bisect_left(self.buckets, seconds)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def quantile(self, stage, q):
+        '''
+        Estimate a quantile of a stage's latency -- the upper bound of the bucket it falls in.
+        '''
+        histogram = self.stages[stage]
+        rank = q * histogram['count']
+        total = 0
+        for bound, count in zip(self.buckets + [float('inf')], histogram['buckets']):
+            total += count
+            if total >= rank:
+                return bound
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'updated': arrow.now().format('YYYY-MM-DD HH:mm:ss'),
+                'buckets': self.buckets,
+                'counters': dict(self.counters),
+                'stages': {stage: {'count': histogram['count'], 'seconds': histogram['seconds'], 'buckets': list(histogram['buckets'])} for stage, histogram in self.stages.items()}
+            }
+
+    def to_prometheus(self, metrics):
+        lines = []
+        for name, value in sorted(metrics['counters'].items()):
+            lines.append('# TYPE troveharvester_{}_total counter'.format(name))
+            lines.append('troveharvester_{}_total {}'.format(name, value))
+        if metrics['stages']:
+            lines.append('# HELP troveharvester_stage_seconds Time spent in each stage of the harvest.')
+            lines.append('# TYPE troveharvester_stage_seconds histogram')
+        for stage, histogram in sorted(metrics['stages'].items()):
+            total = 0
+            for bound, count in zip(self.buckets + ['+Inf'], histogram['buckets']):
+                total += count
+                lines.append('troveharvester_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, bound, total))
+            lines.append('troveharvester_stage_seconds_sum{{stage="{}"}} {}'.format(stage, histogram['seconds']))
+            lines.append('troveharvester_stage_seconds_count{{stage="{}"}} {}'.format(stage, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        '''
+        Save the metrics, writing to temporary files first so a crash can't leave them half written.
+        '''
+        if not self.data_dir:
+            return
+        metrics = self.snapshot()
+        for filename, content in [(self.json_file, json.dumps(metrics, indent=4)), (self.prom_file, self.to_prometheus(metrics))]:
+            path = os.path.join(self.data_dir, filename)
+            tmp_path = '{}.tmp'.format(path)
+            with open(tmp_path, 'w') as metrics_file:
+                metrics_file.write(content)
+            os.replace(tmp_path, path)
+        self.written = time.monotonic()
+
+    def write_periodically(self):
+        if time.monotonic() - self.written >= self.interval:
+            self.write()
+
+
+class ContentStore:
+    '''
+    A directory of texts, PDFs, and images shared by a batch of harvests.
+    The files that have been saved are recorded in the store's own harvest.db, and the articles
+    a harvest is working on are claimed, so the other harvests in the batch skip them rather than
+    fetching them again. The files are named as they would be in a single harvest.
+    '''
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        for output in ['pdf', 'text', 'image']:
+            make_dir(os.path.join(store_dir, output))
+        self.state = HarvestState(store_dir)
+        self.lock = threading.Lock()
+        self.claimed = {stage: set() for stage in HarvestState.stages}
+
+    def claim(self, stage, article_ids):
+        '''
+        Claim the articles that haven't had this stage (pdf, text, or image) saved, and aren't claimed by another harvest.
+        Returns the ids of the articles claimed.
+        '''
+        with self.lock:
+            done = self.state.get_completed(stage, article_ids)
+            claimed = set(str(article_id) for article_id in article_ids) - done - self.claimed[stage]
+            self.claimed[stage].update(claimed)
+        return claimed
+
+    def release(self, stage, article_ids):
+        with self.lock:
+            self.claimed[stage].difference_update(article_ids)
+
+    def close(self):
+        self.state.close()
+
+
+class SearchIndex:
+    '''
+    A full-text index of the harvested texts, kept in a SQLite database (search.db) next to the text files.
+    The texts (and headings) go in an FTS5 table, keyed by article id, and the articles' metadata
+    (the FIELDS of results.csv, less the snippet) in an ordinary table, so searches can be filtered
+    by date, newspaper, and category. Texts are added a page at a time as they're saved,
+    so the index is always as complete as the harvest. Like HarvestState, it uses WAL journaling unless
+    another journal_mode is given.
+    '''
+    db_file = 'search.db'
+    fields = [field for field in FIELDS if field != 'snippet']
+
+    def __init__(self, index_dir, journal_mode='WAL'):
+        self.path = os.path.join(index_dir, self.db_file)
+        self.lock = threading.Lock()
+        # Shards and batches write from their own connections, so wait for each other's transactions
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            columns = ', '.join(['article_id INTEGER PRIMARY KEY'] + self.fields[1:])
+            self.db.execute('CREATE TABLE IF NOT EXISTS articles ({})'.format(columns))
+            self.db.execute('CREATE INDEX IF NOT EXISTS articles_date ON articles (date)')
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS texts USING fts5(title, text, tokenize='unicode61 remove_diacritics 2')")
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM texts').fetchone()[0]
+
+    def add(self, rows, texts):
+        '''
+        Add the texts of some articles to the index, along with their rows of metadata.
+        `texts` is a dictionary of article ids and texts, articles without a text aren't added.
+        '''
+        rows = [row for row in rows if texts.get(row['article_id'])]
+        if not rows:
+            return
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO articles ({}) VALUES ({})'.format(', '.join(self.fields), ', '.join('?' * len(self.fields))),
+                [[row.get(field) for field in self.fields] for row in rows]
+            )
+            # FTS5 doesn't do INSERT OR REPLACE, so remove any texts indexed before a restart
+            self.db.executemany('DELETE FROM texts WHERE rowid = ?', [(int(row['article_id']),) for row in rows])
+            self.db.executemany('INSERT INTO texts (rowid, title, text) VALUES (?, ?, ?)', [(int(row['article_id']), row.get('title'), texts[row['article_id']]) for row in rows])
+
+    def search(self, query, start_date=None, end_date=None, newspaper=None, category=None, limit=20):
+        '''
+        Search the texts and headings, using the FTS5 query syntax (words, "phrases", AND, OR, NOT, prefix*, NEAR()).
+        Dates can be a year, a year and month, or a full date (eg 1920, 1920-05, or 1920-05-01) and are inclusive.
+        The newspaper can be an id or part of a title. Returns a list of rows with a snippet of the text, best matches first.
+        '''
+        sql = "SELECT articles.*, snippet(texts, 1, '[', ']', '...', 16) AS snippet FROM texts JOIN articles ON articles.article_id = texts.rowid WHERE texts MATCH ?"
+        params = [query]
+        if start_date:
+            sql += ' AND substr(articles.date, 1, ?) >= ?'
+            params += [len(start_date), start_date]
+        if end_date:
+            sql += ' AND substr(articles.date, 1, ?) <= ?'
+            params += [len(end_date), end_date]
+        if newspaper:
+            sql += ' AND (articles.newspaper_id = ? OR articles.newspaper_title LIKE ?)'
+            params += [newspaper, '%{}%'.format(newspaper)]
+        if category:
+            sql += ' AND articles.category = ? COLLATE NOCASE'
+            params.append(category)
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+    def add_index(self, index_dir):
+        '''
+        Add the contents of another search index (eg one made by a work unit) to this one.
+        '''
+        with self.lock:
+            self.db.execute('ATTACH DATABASE ? AS other', (os.path.join(index_dir, self.db_file),))
+            try:
+                with self.db:
+                    self.db.execute('INSERT OR REPLACE INTO articles SELECT * FROM other.articles')
+                    self.db.execute('DELETE FROM texts WHERE rowid IN (SELECT rowid FROM other.texts)')
+                    self.db.execute('INSERT INTO texts (rowid, title, text) SELECT rowid, title, text FROM other.texts')
+            finally:
+                self.db.execute('DETACH DATABASE other')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class LeaseLost(Exception):
+    '''
+    Raised when another worker has taken over a work unit.
+    '''
+
+
+class WorkQueue:
+    '''
+    A queue of work units (parts of a harvest), kept as files in a directory on shared storage,
+    so that workers on any number of machines can harvest them.
+    Each unit is a JSON file in units/. A worker claims a unit by creating its lease file in leases/ -- creation
+    fails if the file already exists, so only one worker gets it. While the unit is harvested its lease is renewed
+    in the background, so if a worker dies the lease expires, and another worker can steal the unit and carry on
+    from where it stopped. A lease is stolen by renaming it out of the way first, so only one worker can take it.
+    A lease expires `lease_time` seconds after its file was last modified. It's renewed by touching the file
+    the worker created (identified by a random token in it), never by replacing it, and then checking it's still in place --
+    so a renewal can't overwrite a lease that has just been stolen, and a worker that has lost its lease finds out.
+    Finished units are recorded in done/.
+    Files are used rather than a database, as creating and renaming files is atomic on network file systems,
+    where SQLite's locking can't be relied on. Leases expire by the clock, so the machines' clocks should agree.
+    '''
+    # Seconds between checks for units to claim (or finished) by idle workers
+    poll_interval = 2
+
+    def __init__(self, queue_dir, lease_time=600, worker=None):
+        self.queue_dir = queue_dir
+        for name in ['units', 'leases', 'done']:
+            make_dir(os.path.join(queue_dir, name))
+        self.lease_time = lease_time
+        self.worker = worker or '{}-{}'.format(socket.gethostname(), os.getpid())
+        # The token in the lease file held on each unit
+        self.held = {}
+        self.lock = threading.Lock()
+        # Idle workers in this process are woken when a unit is finished or given up
+        self.changed = threading.Condition()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    def get_path(self, kind, unit_id):
+        return os.path.join(self.queue_dir, kind, '{}.json'.format(unit_id))
+
+    def write_json(self, path, data):
+        tmp_path = '{}.{}.{}.tmp'.format(path, self.worker, threading.get_ident())
+        with open(tmp_path, 'w') as json_file:
+            json.dump(data, json_file)
+        os.replace(tmp_path, path)
+
+    def add(self, unit_id, unit):
+        self.write_json(self.get_path('units', unit_id), unit)
+
+    def get_units(self):
+        units = {}
+        for filename in os.listdir(os.path.join(self.queue_dir, 'units')):
+            if filename.endswith('.json'):
+                with open(os.path.join(self.queue_dir, 'units', filename), 'r') as unit_file:
+                    units[filename[:-5]] = json.load(unit_file)
+        return units
+
+    def get_done(self):
+        return {filename[:-5] for filename in os.listdir(os.path.join(self.queue_dir, 'done')) if filename.endswith('.json')}
+
+    def get_leases(self):
+        return {filename[:-5]: self.read_lease(filename[:-5]) for filename in os.listdir(os.path.join(self.queue_dir, 'leases')) if filename.endswith('.json')}
+
+    def read_lease(self, unit_id, path=None):
+        '''
+        Get the worker holding a lease and the time it expires, or None if there's no lease.
+        '''
+        path = path or self.get_path('leases', unit_id)
+        try:
+            with open(path, 'r') as lease_file:
+                modified = os.fstat(lease_file.fileno()).st_mtime
+                try:
+                    lease = json.load(lease_file)
+                except ValueError:
+                    # The lease is still being written
+                    lease = {'worker': None}
+        except FileNotFoundError:
+            return None
+        lease['expires'] = modified + lease.get('lease_time', self.lease_time)
+        return lease
+
+    def get_token(self, path):
+        lease = self.read_lease(None, path)
+        return lease.get('token') if lease else None
+
+    def create_lease(self, unit_id):
+        '''
+        Create a lease on a unit, returning False if there's one already.
+        '''
+        try:
+            lease_file = os.open(self.get_path('leases', unit_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        token = os.urandom(16).hex()
+        with os.fdopen(lease_file, 'w') as lease_file:
+            json.dump({'worker': self.worker, 'lease_time': self.lease_time, 'token': token}, lease_file)
+        with self.lock:
+            self.held[unit_id] = token
+        return True
+
+    def lose(self, unit_id):
+        with self.lock:
+            self.held.pop(unit_id, None)
+        raise LeaseLost(unit_id)
+
+    def acquire(self, unit_id):
+        '''
+        Take out a lease on a unit, stealing it if the current lease has expired.
+        '''
+        if self.create_lease(unit_id):
+            return True
+        lease = self.read_lease(unit_id)
+        if lease is None or lease['expires'] > time.time():
+            return False
+        path = self.get_path('leases', unit_id)
+        stale_path = '{}.{}.stale'.format(path, self.worker)
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            # Someone else got there first
+            return False
+        lease = self.read_lease(unit_id, stale_path)
+        if lease is not None and lease['expires'] > time.time():
+            # Another worker stole it between our reading and renaming it, so give it back
+            try:
+                os.link(stale_path, path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        return self.create_lease(unit_id)
+
+    def claim(self):
+        '''
+        Claim an unfinished unit that no one else is working on, largest first.
+        Returns the unit's id and details, or None if there isn't one.
+        '''
+        done = self.get_done()
+        units = self.get_units()
+        for unit_id, unit in sorted(units.items(), key=lambda item: item[1]['total'] or 0, reverse=True):
+            if unit_id in done or unit_id in self.held:
+                continue
+            if self.acquire(unit_id):
+                # It might have been finished while we were looking
+                if os.path.exists(self.get_path('done', unit_id)):
+                    self.release(unit_id)
+                    continue
+                return unit_id, unit
+        return None
+
+    def renew(self, unit_id):
+        '''
+        Extend the lease on a unit, raising LeaseLost if another worker has taken it.
+        The lease file is touched through a handle on the file this worker created, then checked to be still in place.
+        If it was stolen in between, either the thief sees the new time and gives it back, or it's gone and we've lost it.
+        '''
+        with self.lock:
+            token = self.held.get(unit_id)
+        path = self.get_path('leases', unit_id)
+        try:
+            lease_file = open(path, 'r')
+        except FileNotFoundError:
+            self.lose(unit_id)
+        with lease_file:
+            try:
+                lease = json.load(lease_file)
+            except ValueError:
+                lease = {}
+            if token is None or lease.get('token') != token:
+                self.lose(unit_id)
+            os.utime(lease_file.fileno())
+        if self.get_token(path) != token:
+            self.lose(unit_id)
+
+    def release(self, unit_id):
+        '''
+        Give up the lease on a unit (if this worker still holds it).
+        The lease is moved out of the way before it's removed, so a lease that another worker
+        has just taken is put back rather than deleted.
+        '''
+        with self.lock:
+            token = self.held.pop(unit_id, None)
+        path = self.get_path('leases', unit_id)
+        if token is not None and self.get_token(path) == token:
+            released_path = '{}.{}.released'.format(path, self.worker)
+            try:
+                os.rename(path, released_path)
+            except FileNotFoundError:
+                pass
+            else:
+                if self.get_token(released_path) != token:
+                    try:
+                        os.link(released_path, path)
+                    except FileExistsError:
+                        pass
+                os.remove(released_path)
+        with self.changed:
+            self.changed.notify_all()
+
+    def finish(self, unit_id, harvested):
+        '''
+        Record a unit as finished, raising LeaseLost (and leaving it unfinished) if another worker has taken it.
+        '''
+        self.renew(unit_id)
+        self.write_json(self.get_path('done', unit_id), {'worker': self.worker, 'harvested': harvested, 'date_finished': datetime.datetime.now().isoformat()})
+        self.release(unit_id)
+
+    def wait(self):
+        '''
+        Wait until a unit is finished or given up by a worker in this process, or for poll_interval seconds
+        (to see what the workers on other machines have done).
+        '''
+        with self.changed:
+            self.changed.wait(min(self.poll_interval, self.lease_time / 4))
+
+    def renew_leases(self):
+        # Renew the leases well before they expire
+        while not self.stopped.wait(self.lease_time / 3):
+            with self.lock:
+                held = list(self.held)
+            for unit_id in held:
+                try:
+                    self.renew(unit_id)
+                except LeaseLost:
+                    pass
+
+    def start(self):
+        self.heartbeat = threading.Thread(target=self.renew_leases, daemon=True)
+        self.heartbeat.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+
+
+class ResultsWriter:
+    '''
+    Append rows to a harvest's results.csv as they're harvested.
+    Rather than reloading and rewriting the whole file for every page of results,
+    new rows are appended and flushed to disk, and the ids of articles already written
+    are kept so that duplicates are skipped.
+    If a HarvestState is supplied, the ids and the size of the file are recorded there,
+    otherwise the ids are kept in a set.
+    '''
+
+    def __init__(self, csv_file, fields=FIELDS, state=None):
+        self.csv_file = csv_file
+        self.name = os.path.basename(csv_file)
+        self.fields = fields
+        self.state = state
+        self.article_ids = set()
+        self.rows = 0
+        self.output = None
+        self.writer = None
+        # Shards of a harvest can share a writer
+        self.lock = threading.Lock()
+        output = state.get_output(self.name) if state else None
+        if output:
+            size, self.rows = output
+            # Remove anything written after the last recorded page (eg if the harvest crashed in between)
+            if os.path.exists(csv_file) and os.path.getsize(csv_file) > size:
+                with open(csv_file, 'r+b') as existing:
+                    existing.truncate(size)
+        else:
+            # If we're adding to an existing file, collect the ids already harvested (and their statistics)
+            stats = {}
+            try:
+                with open(csv_file, 'r', newline='', encoding='utf-8') as existing:
+                    for row in csv.DictReader(existing):
+                        if str(row['article_id']) not in self.article_ids:
+                            self.article_ids.add(str(row['article_id']))
+                            count_rows([row], stats)
+            except FileNotFoundError:
+                pass
+            self.rows = len(self.article_ids)
+            if state and self.article_ids:
+                state.save_rows(self.name, self.article_ids, os.path.getsize(csv_file), stats=stats)
+                self.article_ids = set()
+
+    def __len__(self):
+        return self.rows
+
+    def open(self):
+        new_file = not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0
+        self.output = open(self.csv_file, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.output, fieldnames=self.fields, extrasaction='ignore')
+        if new_file:
+            self.writer.writeheader()
+
+    def write_rows(self, rows):
+        '''
+        Append any rows that haven't already been written, then make sure they're on disk.
+        Returns the number of new rows.
+        '''
+        with self.lock:
+            if self.output is None:
+                self.open()
+            seen = self.state.get_saved([row['article_id'] for row in rows]) if self.state else self.article_ids
+            new_rows = []
+            for row in rows:
+                article_id = str(row['article_id'])
+                if article_id not in seen:
+                    seen.add(article_id)
+                    new_rows.append(row)
+            new_ids = [str(row['article_id']) for row in new_rows]
+            last_row = None
+            if new_rows:
+                self.writer.writerows(new_rows[:-1])
+                # Note where the last row starts, so it can be read without loading the whole file
+                last_row = self.output.tell()
+                self.writer.writerow(new_rows[-1])
+            self.output.flush()
+            os.fsync(self.output.fileno())
+            if self.state:
+                self.state.save_rows(self.name, new_ids, self.output.tell(), last_row, stats=count_rows(new_rows))
+            self.rows += len(new_ids)
+        return len(new_ids)
+
+    def close(self):
+        with self.lock:
+            if self.output is not None:
+                self.output.close()
+                self.output = None
+                self.writer = None
+
+
+class PDFRenditions:
+    '''
+    Generate and download the PDFs for a batch of articles concurrently.
+    PDFs are requested all at once, the ping urls of the pending renditions are polled together
+    (backing off between rounds), and each PDF is downloaded as soon as it's ready.
+    The prep ids of renditions that are in progress are saved in pdf_pending.json
+    so that a restarted harvest can pick them up rather than asking for them again.
+    '''
+    state_file = 'pdf_pending.json'
+
+    def __init__(self, harvester, workers=10, tries=5, wait=2, backoff=1.5, max_wait=30):
+        self.harvester = harvester
+        if harvester.shard:
+            self.state_file = 'pdf_pending-{}.json'.format(harvester.shard)
+        self.workers = workers
+        self.tries = tries
+        self.wait = wait
+        self.backoff = backoff
+        self.max_wait = max_wait
+        # There's nowhere to save the pending renditions if the articles are only being streamed
+        self.state_path = os.path.join(harvester.data_dir, self.state_file) if harvester.data_dir else None
+        self.pending = self.load_pending()
+
+    def load_pending(self):
+        '''
+        Get the prep ids of any renditions left in progress by an interrupted harvest.
+        '''
+        if self.state_path is None:
+            return {}
+        try:
+            with open(self.state_path, 'r') as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError):
+            return {}
+
+    def save_pending(self):
+        if self.state_path is None:
+            return
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.pending, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    def poll(self, article_id):
+        '''
+        Ping a pending rendition.
+        If a prep id saved by an earlier harvest has expired, ask for a new one.
+        '''
+        try:
+            return self.harvester.ping_pdf(self.harvester.get_ping_url(article_id, self.pending[article_id]))
+        except HTTPError:
+            if article_id not in self.resumed:
+                raise
+            self.resumed.discard(article_id)
+            self.pending[article_id] = self.harvester.prep_pdf(article_id)
+            return False
+
+    def get_pdfs(self, articles, fetch=False):
+        '''
+        Save PDFs of the supplied articles, returning a dictionary of article ids and filenames.
+        If fetch is True, the PDFs aren't saved and the dictionary holds their contents instead.
+        Articles whose PDFs aren't ready after the last round of pings are skipped.
+        '''
+        pdf_files = {}
+        download = self.harvester.fetch_pdf if fetch else self.harvester.download_pdf
+        if self.harvester.pdf_store is None and not fetch:
+            # PDFs saved before a restart don't need to be requested again
+            for article in articles:
+                pdf_file = self.harvester.get_pdf_path(article)
+                if os.path.exists(pdf_file):
+                    pdf_files[article['id']] = pdf_file
+        waiting = {article['id']: article for article in articles if article['id'] not in pdf_files}
+        self.resumed = set(waiting) & set(self.pending)
+        # Time how long each rendition takes to be ready
+        requested = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Ask for all the PDFs to be created
+            futures = {executor.submit(self.harvester.prep_pdf, article_id): article_id for article_id in waiting if article_id not in self.pending}
+            for future in as_completed(futures):
+                self.pending[futures[future]] = future.result()
+            self.save_pending()
+            downloads = {}
+            wait = self.wait
+            tries = 0
+            while waiting and tries < self.tries:
+                # Give some time to generate pdfs
+                time.sleep(wait)
+                # Are you ready yet?
+                futures = {executor.submit(self.poll, article_id): article_id for article_id in waiting}
+                for future in as_completed(futures):
+                    article_id = futures[future]
+                    if future.result():
+                        self.harvester.metrics.observe('pdf_rendition', time.perf_counter() - requested)
+                        article = waiting.pop(article_id)
+                        pdf_url = self.harvester.get_pdf_download_url(article_id, self.pending[article_id])
+                        downloads[self.harvester.downloader.submit(download, article, pdf_url)] = article_id
+                tries += 1
+                wait = min(wait * self.backoff, self.max_wait)
+            self.harvester.metrics.increment('pdf_timeouts', len(waiting))
+            for future in as_completed(downloads):
+                pdf_files[downloads[future]] = future.result()
+        # Clear the finished (or abandoned) renditions from the saved state
+        for article in articles:
+            self.pending.pop(article['id'], None)
+        self.save_pending()
+        return pdf_files
+
+
+class PageImageCache:
+    '''
+    A size-bounded, least-recently-used cache of page images on disk, keyed by page id.
+    Many articles can share a page, so this saves downloading the same page image over and over.
+    '''
+    image_url = 'https://trove.nla.gov.au/ndp/imageservice/nla.news-page{}/level{}'
+    level = 7
+
+    def __init__(self, cache_dir, max_size=500, level=None, client=http, downloader=None):
+        self.cache_dir = cache_dir
+        self.http = client
+        self.downloader = downloader or Downloader(client)
+        # Maximum size is in MB
+        self.max_size = max_size * 1024 * 1024
+        self.level = level or self.level
+        # The cache can be shared by the shards of a harvest
+        self.lock = threading.Lock()
+        make_dir(cache_dir)
+        # Rebuild the LRU order from the files already in the cache, oldest first
+        self.pages = OrderedDict()
+        files = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.jpg')]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self.pages[entry.name[:-4]] = entry.stat().st_size
+        self.size = sum(self.pages.values())
+
+    def page_path(self, page_id):
+        return os.path.join(self.cache_dir, '{}.jpg'.format(page_id))
+
+    def get(self, page_id, metrics=None):
+        '''
+        Return the contents of a page image, downloading it if it's not in the cache.
+        Hits and misses are counted in metrics (if given).
+        '''
+        page_id = str(page_id)
+        path = self.page_path(page_id)
+        with self.lock:
+            if page_id in self.pages:
+                try:
+                    with open(path, 'rb') as page_file:
+                        content = page_file.read()
+                except FileNotFoundError:
+                    self.size -= self.pages.pop(page_id)
+                else:
+                    self.pages.move_to_end(page_id)
+                    os.utime(path)
+                    if metrics is not None:
+                        metrics.increment('page_cache_hits')
+                    return content
+        if metrics is not None:
+            metrics.increment('page_cache_misses')
+        self.downloader.download(self.image_url.format(page_id, self.level), path, metrics)
+        with open(path, 'rb') as page_file:
+            content = page_file.read()
+        self.track(page_id, content)
+        return content
+
+    def track(self, page_id, content):
+        with self.lock:
+            self.size += len(content) - self.pages.pop(page_id, 0)
+            self.pages[page_id] = len(content)
+            # Remove the least recently used pages until we're back under the limit
+            while self.size > self.max_size and len(self.pages) > 1:
+                old_id, old_size = self.pages.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(self.page_path(old_id))
+                except FileNotFoundError:
+                    pass
+
+
+class PagePrefetcher:
+    '''
+    Fetch pages of results from the API in a background thread, following the nextStart tokens,
+    so that up to `size` pages are waiting in a queue while the current page is processed.
+    The harvester still saves its own nextStart token once each page has been processed,
+    so a restart picks up after the last page that was actually saved.
+    '''
+
+    def __init__(self, harvester, size=2):
+        self.harvester = harvester
+        self.pages = queue.Queue(maxsize=size)
+        self.stopped = threading.Event()
+
+    def put(self, item):
+        # Wait for space in the queue, unless the harvest has been stopped
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(item, timeout=0.5)
+            except queue.Full:
+                pass
+            else:
+                return
+
+    def fetch(self):
+        # The harvester stops the prefetcher once it has harvested enough articles
+        start = self.harvester.start
+        try:
+            while start and not self.stopped.is_set():
+                records = self.harvester.fetch_page(start)
+                if records is not None:
+                    self.put(records)
+                    start = records.get('nextStart')
+        except Exception as error:
+            # Pass on the error to be raised in the harvest
+            self.put(error)
+        self.put(None)
+
+    def __iter__(self):
+        thread = threading.Thread(target=self.fetch, daemon=True)
+        thread.start()
+        try:
+            while True:
+                records = self.pages.get()
+                if records is None:
+                    break
+                elif isinstance(records, Exception):
+                    raise records
+                yield records
+        finally:
+            self.stopped.set()
+            thread.join()
+
+
+def load_pyarrow():
+    '''
+    Import pyarrow (only when it's needed, as it's optional and slow to load).
+    '''
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet output needs pyarrow -- try: pip install pyarrow')
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+IMAGE_FORMATS = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp'}
+
+
+def save_crop(img, box, filename, size=3000, format='jpeg', quality=75, scale=(1, 1)):
+    '''
+    Crop an article from a page image, resize it if necessary, and save it.
+    If filename is None, the encoded image is returned rather than saved.
+    `scale` is the size of the (possibly reduced) page image relative to the coordinates in the box.
+    '''
+    from PIL import Image
+    x_scale, y_scale = scale
+    points = (round(box['left'] * x_scale), round(box['top'] * y_scale), round(box['right'] * x_scale), round(box['bottom'] * y_scale))
+    cropped = img.crop(points)
+    if size:
+        cropped.thumbnail((size, size), Image.LANCZOS)
+    options = {'quality': quality} if format in ['jpeg', 'webp'] else {}
+    if filename is None:
+        output = BytesIO()
+        cropped.save(output, format=format, **options)
+        return output.getvalue()
+    # Save to a temporary file first, so any image that exists is complete
+    tmp_file = '{}.tmp'.format(filename)
+    cropped.save(tmp_file, format=format, **options)
+    os.replace(tmp_file, filename)
+    return filename
+
+
+def crop_page(content, crops, size=3000, format='jpeg', quality=75):
+    '''
+    Crop articles from a page image, returning the filenames (or the images, where the filename is None).
+    `crops` is a list of (box, filename) pairs. If none of the crops needs the page's full resolution
+    (because they'll all be shrunk to `size`), the JPEG is decoded at a reduced scale with draft(),
+    which is much quicker and uses much less memory. The coordinates are scaled to match.
+    This is a module-level function so it can be run in a process pool.
+    '''
+    from PIL import Image
+    img = Image.open(BytesIO(content))
+    width, height = img.size
+    # The smallest scale that keeps every crop at (or above) the size it'll be saved at
+    needed = 1
+    if size:
+        needed = max(min(1, size / max(box['right'] - box['left'], box['bottom'] - box['top'], 1)) for box, filename in crops)
+    if needed < 1:
+        img.draft(img.mode, (math.ceil(width * needed), math.ceil(height * needed)))
+    scale = (img.size[0] / width, img.size[1] / height)
+    img.load()
+    filenames = [save_crop(img, box, filename, size=size, format=format, quality=quality, scale=scale) for box, filename in crops]
+    img.close()
+    return filenames
+
+
+def get_parquet_schema():
+    '''
+    The column types for Parquet output, matching the fields in FIELDS.
+    '''
+    load_pyarrow()
+    return pa.schema([
+        ('article_id', pa.int64()),
+        ('title', pa.string()),
+        ('newspaper_id', pa.int32()),
+        ('newspaper_title', pa.string()),
+        ('page', pa.string()),
+        ('date', pa.date32()),
+        ('category', pa.string()),
+        ('words', pa.int32()),
+        ('illustrated', pa.bool_()),
+        ('corrections', pa.int32()),
+        ('snippet', pa.string()),
+        ('url', pa.string()),
+        ('page_url', pa.string())
+    ])
+
+
+def to_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+def to_parquet_row(row):
+    '''
+    Convert the values of a row from prepare_row to the types in the Parquet schema.
+    '''
+    row = row.copy()
+    for field in ['article_id', 'newspaper_id', 'words', 'corrections']:
+        row[field] = to_int(row[field])
+    if row['page'] is not None:
+        row['page'] = str(row['page'])
+    if row['date']:
+        row['date'] = datetime.date.fromisoformat(row['date'][:10])
+    if row['illustrated'] is not None:
+        row['illustrated'] = row['illustrated'] in ('Y', 'y', True)
+    return row
+
+
+class ParquetResultsWriter:
+    '''
+    Write the results of a harvest as a Parquet dataset -- a results.parquet directory of part files.
+    Each page of results becomes a compressed row group. Part files are written under a temporary name and
+    renamed once they've reached `pages_per_file` pages (or the harvest ends). Only then are the rows recorded
+    in the HarvestState, and `durable` becomes True so the harvester knows it can save its nextStart token.
+    Incomplete part files left by a crash are removed, and the pages in them are harvested again.
+    '''
+
+    def __init__(self, data_dir, state, prefix='part', pages_per_file=50, compression='zstd'):
+        load_pyarrow()
+        self.output_dir = os.path.join(data_dir, 'results.parquet')
+        self.name = os.path.basename(self.output_dir)
+        self.state = state
+        self.prefix = prefix
+        self.pages_per_file = pages_per_file
+        self.compression = compression
+        self.schema = get_parquet_schema()
+        self.writer = None
+        self.tmp_path = None
+        self.pages = 0
+        self.pending_ids = set()
+        self.pending_stats = {}
+        make_dir(self.output_dir)
+        self.parts = 0
+        for filename in os.listdir(self.output_dir):
+            if filename.startswith('{}-'.format(prefix)):
+                if filename.endswith('.tmp'):
+                    os.remove(os.path.join(self.output_dir, filename))
+                else:
+                    self.parts += 1
+        output = state.get_output(self.name)
+        self.rows = output[1] if output else 0
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def durable(self):
+        return self.writer is None
+
+    def write_rows(self, rows):
+        '''
+        Add the new rows from a page of results to the current part file as a row group.
+        Returns the number of new rows.
+        '''
+        saved = self.state.get_saved([row['article_id'] for row in rows])
+        new_rows = []
+        for row in rows:
+            article_id = str(row['article_id'])
+            if article_id not in saved and article_id not in self.pending_ids:
+                new_rows.append(to_parquet_row(row))
+                self.pending_ids.add(article_id)
+                count_rows([row], self.pending_stats)
+        if new_rows:
+            if self.writer is None:
+                filename = '{}-{:05d}.parquet'.format(self.prefix, self.parts)
+                self.tmp_path = os.path.join(self.output_dir, '{}.tmp'.format(filename))
+                self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+            table = pa.Table.from_pylist(new_rows, schema=self.schema)
+            self.writer.write_table(table, row_group_size=len(new_rows))
+            self.pages += 1
+            self.rows += len(new_rows)
+            if self.pages >= self.pages_per_file:
+                self.commit()
+        return len(new_rows)
+
+    def commit(self):
+        '''
+        Finish the current part file and record its rows as saved.
+        '''
+        if self.writer is not None:
+            self.writer.close()
+            final_path = self.tmp_path[:-4]
+            os.replace(self.tmp_path, final_path)
+            self.state.save_rows(self.name, self.pending_ids, os.path.getsize(final_path), stats=self.pending_stats)
+            self.writer = None
+            self.pending_ids = set()
+            self.pending_stats = {}
+            self.pages = 0
+            self.parts += 1
+
+    def close(self):
+        self.commit()
+
+
+class BundleWriter:
+    '''
+    Store files (eg texts or PDFs) in a series of tar files ('bundles') rather than one file per article.
+    A new bundle is started before a file that would take the current one over `max_size` MB (which can be
+    fractional), so only a single file larger than `max_size` makes a bigger bundle. Each harvest session starts
+    a new bundle rather than appending to an old one. An index (index.db, in the same directory) records the bundle,
+    offset, and size of each file, keyed by the filename from Harvester.make_filename, so that files can
+    be read back directly with BundleReader. The bundles are also ordinary tar files.
+    '''
+    index_file = 'index.db'
+
+    def __init__(self, bundle_dir, kind, extension, max_size=1024):
+        self.bundle_dir = bundle_dir
+        self.kind = kind
+        self.extension = extension
+        # Maximum size is in MB
+        self.max_size = int(float(max_size) * 1024 * 1024)
+        self.lock = threading.Lock()
+        make_dir(bundle_dir)
+        self.parts = len([filename for filename in os.listdir(bundle_dir) if filename.endswith('.tar')])
+        self.output = None
+        self.tar = None
+        self.pending = []
+        self.index = sqlite3.connect(os.path.join(bundle_dir, self.index_file), check_same_thread=False)
+        with self.index:
+            self.index.execute('CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, article_id TEXT, bundle TEXT, offset INTEGER, size INTEGER)')
+            self.index.execute('CREATE INDEX IF NOT EXISTS files_article_id ON files (article_id)')
+
+    def open(self):
+        self.bundle = '{}-{:05d}.tar'.format(self.kind, self.parts)
+        self.output = open(os.path.join(self.bundle_dir, self.bundle), 'xb')
+        self.tar = tarfile.open(fileobj=self.output, mode='w', format=tarfile.PAX_FORMAT)
+        self.parts += 1
+
+    def add(self, key, article_id, content):
+        '''
+        Add a file's contents (bytes) to the current bundle.
+        '''
+        with self.lock:
+            info = tarfile.TarInfo('{}.{}'.format(key, self.extension))
+            info.size = len(content)
+            info.mtime = int(time.time())
+            if self.tar is not None and self.get_finished_size(info) > self.max_size:
+                self.finish_bundle()
+            if self.tar is None:
+                self.open()
+            self.tar.addfile(info, BytesIO(content))
+            # The data ends at the current offset, less the padding to a full tar block
+            offset = self.tar.offset - (-(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE)
+            self.pending.append((key, str(article_id), self.bundle, offset, info.size))
+        return key
+
+    def get_finished_size(self, info):
+        '''
+        The size the current bundle would be on closing, if the file described by `info` was added to it.
+        Closing a tar file adds two empty blocks, then pads it out to a full record.
+        '''
+        header = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        size = self.tar.offset + len(header) + -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE
+        return -(-size // tarfile.RECORDSIZE) * tarfile.RECORDSIZE
+
+    def finish_bundle(self):
+        self.tar.close()
+        self.flush_bundle()
+        self.output.close()
+        self.tar = None
+        self.output = None
+
+    def flush_bundle(self):
+        if self.output is not None:
+            self.output.flush()
+            os.fsync(self.output.fileno())
+        if self.pending:
+            with self.index:
+                self.index.executemany('INSERT OR REPLACE INTO files (key, article_id, bundle, offset, size) VALUES (?, ?, ?, ?, ?)', self.pending)
+            self.pending = []
+
+    def add_bundles(self, source_dir, prefix):
+        '''
+        Move the bundles from another directory (eg a work unit's) into this one, adding `prefix` to their names,
+        and add their files to the index.
+        '''
+        with self.lock:
+            source = sqlite3.connect(os.path.join(source_dir, self.index_file))
+            files = [(key, article_id, '{}-{}'.format(prefix, bundle), offset, size) for key, article_id, bundle, offset, size in source.execute('SELECT key, article_id, bundle, offset, size FROM files')]
+            source.close()
+            for filename in os.listdir(source_dir):
+                if filename.endswith('.tar'):
+                    os.replace(os.path.join(source_dir, filename), os.path.join(self.bundle_dir, '{}-{}'.format(prefix, filename)))
+            with self.index:
+                self.index.executemany('INSERT OR REPLACE INTO files (key, article_id, bundle, offset, size) VALUES (?, ?, ?, ?, ?)', files)
+
+    def flush(self):
+        '''
+        Make sure the files added so far are on disk and in the index.
+        '''
+        with self.lock:
+            self.flush_bundle()
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.finish_bundle()
+            else:
+                self.flush_bundle()
+            self.index.close()
+
+
+class BundleReader:
+    '''
+    Read files saved by BundleWriter.
+
+    Usage:
+
+    reader = BundleReader(os.path.join(data_dir, 'text'))
+    text = reader.get(article_id).decode('utf-8')
+    '''
+
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        self.index = sqlite3.connect(os.path.join(bundle_dir, BundleWriter.index_file))
+
+    def __contains__(self, article_id):
+        return self.locate(article_id) is not None
+
+    def __len__(self):
+        return self.index.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def keys(self):
+        return [row[0] for row in self.index.execute('SELECT key FROM files ORDER BY key')]
+
+    def locate(self, article_id):
+        return self.index.execute('SELECT bundle, offset, size FROM files WHERE article_id = ?', (str(article_id),)).fetchone()
+
+    def read(self, location):
+        bundle, offset, size = location
+        with open(os.path.join(self.bundle_dir, bundle), 'rb') as bundle_file:
+            bundle_file.seek(offset)
+            return bundle_file.read(size)
+
+    def get(self, article_id):
+        '''
+        Get the contents of the file for an article, or None if there isn't one.
+        '''
+        location = self.locate(article_id)
+        if location:
+            return self.read(location)
+
+    def get_by_key(self, key):
+        location = self.index.execute('SELECT bundle, offset, size FROM files WHERE key = ?', (key,)).fetchone()
+        if location:
+            return self.read(location)
+
+    def close(self):
+        self.index.close()
+
+
+class ResponseCache:
+    '''
+    Save the raw JSON of each page of API results, gzipped, in the harvest's responses directory.
+    Files are keyed by a hash of the query (less the API key) and the nextStart token,
+    and their order is recorded in the HarvestState, so the harvest can be rebuilt later without going back to Trove.
+    Texts that aren't in the API responses (as with AWW) are saved too, keyed by article id,
+    so they're only downloaded once.
+    '''
+    text_file = os.path.join('texts', '{}.html.gz')
+
+    def __init__(self, data_dir, state):
+        self.data_dir = data_dir
+        self.cache_dir = os.path.join(data_dir, 'responses')
+        self.state = state
+        make_dir(os.path.join(self.cache_dir, 'texts'))
+
+    def query_key(self, params):
+        query = {key: value for key, value in params.items() if key not in ['key', 's']}
+        return hashlib.sha1(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def save(self, params, start, content):
+        query = self.query_key(params)
+        filename = '{}-{}.json.gz'.format(query, hashlib.sha1(str(start).encode('utf-8')).hexdigest()[:16])
+        path = os.path.join(self.cache_dir, filename)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp_path, 'wb') as response_file:
+            response_file.write(content)
+        os.replace(tmp_path, path)
+        self.state.add_response(query, start, os.path.join('responses', filename))
+        return os.path.join('responses', filename)
+
+    def get_text(self, article_id):
+        try:
+            with gzip.open(os.path.join(self.cache_dir, self.text_file.format(article_id)), 'rt', encoding='utf-8') as text_file:
+                return text_file.read()
+        except FileNotFoundError:
+            return None
+
+    def save_text(self, article_id, html_text):
+        path = os.path.join(self.cache_dir, self.text_file.format(article_id))
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as text_file:
+            text_file.write(html_text)
+        os.replace(tmp_path, path)
+
+
+def rebuild_page(path, text, include_linebreaks):
+    '''
+    Prepare the rows and texts from a saved page of API results.
+    This is a module-level function so it can be run in a process pool.
+    Texts that weren't included in the API response (as with AWW) are read from the ones
+    downloaded by the harvest and saved with the responses, or skipped if they're not there.
+    '''
+    with gzip.open(path, 'rb') as response_file:
+        results = json.load(response_file)
+    records = results['response']['zone'][0]['records']
+    rows = []
+    texts = []
+    for article in records.get('article', []):
+        rows.append(Harvester.prepare_row(article))
+        if not text:
+            continue
+        html_text = article.get('articleText')
+        if not html_text:
+            try:
+                with gzip.open(os.path.join(os.path.dirname(path), ResponseCache.text_file.format(article['id'])), 'rt', encoding='utf-8') as text_file:
+                    html_text = text_file.read()
+            except FileNotFoundError:
+                continue
+        # Just the details needed to make a filename
+        details = {'id': article['id'], 'date': article['date'], 'title': {'id': article['title']['id']}}
+        texts.append((details, convert_text(html_text, include_linebreaks)))
+    return rows, texts
+
+
 class Harvester:
     '''
     Usage:
@@ -65,29 +1944,114 @@ class Harvester:
         pdf=[optional, True or False],
         text=[optional, True or False],
         include_linebreaks=[optional, True or False],
+        pdf_workers=[optional, number of PDFs to request at once, integer],
+        image_cache_size=[optional, maximum size of the page image cache in MB, integer],
+        text_workers=[optional, number of processes used to convert text, integer, 0 to convert in this process],
+        image_size=[optional, maximum width or height of article images, integer],
+        image_format=[optional, 'jpeg', 'png', or 'webp'],
+        image_quality=[optional, quality of JPEG and WebP images, integer, 1-100],
+        image_workers=[optional, number of processes used to crop images, integer, 0 to crop in this process],
+        prefetch=[optional, number of pages of results to fetch ahead, integer, 0 to fetch one at a time],
+        format=[optional, 'csv' or 'parquet'],
+        bundle=[optional, True or False, save texts and PDFs in tar bundles rather than separate files],
+        bundle_size=[optional, maximum size of each bundle in MB, can be fractional],
+        cache_responses=[optional, True or False, save the raw API responses],
+        index=[optional, True or False, add the texts to a full-text search index],
         start=[optional, Trove nextStart token, string],
         max=[optional, maximum number of results, integer)
     harvester.harvest()
+
+    Or, to get the articles without saving anything (data_dir can be None):
+
+    for row in harvester.iter_articles():
+        ...
     '''
     zoom = 3
     api_url = 'https://api.trove.nla.gov.au/v2/result'
+    rendition_url = 'https://trove.nla.gov.au/newspaper/rendition/'
+    article_url = 'http://nla.gov.au/nla.news-article{}'
 
     def __init__(self, **kwargs):
         self.data_dir = kwargs.get('data_dir')
-        self.csv_file = os.path.join(self.data_dir, 'results.csv')
+        self.csv_file = os.path.join(self.data_dir, 'results.csv') if self.data_dir else None
         self.pdf = kwargs.get('pdf', False)
         self.text = kwargs.get('text', False)
         self.image = kwargs.get('image', False)
         self.include_linebreaks = kwargs.get('include_linebreaks', False)
         self.api_key = kwargs.get('key')
+        self.http = kwargs.get('http') or http
+        self.downloader = kwargs.get('downloader') or Downloader(self.http)
         self.query_params = kwargs.get('query_params', None)
         self.start = kwargs.get('start', '*')
-        # If we're restarting a harvest get the number of rows already harvested
-        if self.start != '*':
-            self.harvested = pd.read_csv(self.csv_file).shape[0]
+        # When harvesting in shards, each shard saves its own nextStart token via the checkpoint function
+        self.shard = kwargs.get('shard')
+        self.checkpoint = kwargs.get('checkpoint')
+        # And anything that must hold before a page is saved (like a work unit's lease) is checked by before_save
+        self.before_save = kwargs.get('before_save')
+        # Progress is saved in harvest.db
+        self.own_state = kwargs.get('state') is None
+        self.state = kwargs.get('state') or HarvestState(self.data_dir)
+        # In a batch, texts, PDFs, and images are saved in a store shared by all the harvests
+        self.store = kwargs.get('store')
+        self.files_dir = self.store.store_dir if self.store is not None else self.data_dir
+        # Counters and latencies are saved in metrics.json and metrics.prom
+        self.own_metrics = kwargs.get('metrics') is None
+        self.metrics = kwargs.get('metrics') or HarvestMetrics(self.data_dir)
+        # If we're restarting a harvest the writer picks up the rows already harvested
+        self.format = kwargs.get('format') or 'csv'
+        self.own_writer = kwargs.get('writer') is None
+        if not self.own_writer:
+            self.writer = kwargs.get('writer')
+        elif not self.data_dir:
+            # Articles can only be streamed with iter_articles()
+            self.writer = None
+        elif self.format == 'parquet':
+            self.writer = ParquetResultsWriter(self.data_dir, self.state, prefix=self.shard or 'part')
         else:
-            self.harvested = 0
+            self.writer = ResultsWriter(self.csv_file, state=self.state)
+        self.harvested = kwargs.get('harvested')
+        if self.harvested is None:
+            self.harvested = len(self.writer) if self.writer is not None else 0
         self.number = int(kwargs.get('number', 100))
+        self.prefetch = int(kwargs.get('prefetch', 2))
+        if self.pdf:
+            self.renditions = PDFRenditions(self, workers=int(kwargs.get('pdf_workers', 10)))
+        # Converting HTML to text is done in a pool of processes
+        # Defaults to the number of CPUs, set text_workers to 0 to do it all in the current process
+        self.text_workers = kwargs.get('text_workers')
+        self.text_pool = kwargs.get('text_pool')
+        self.own_text_pool = self.text_pool is None
+        # Texts and PDFs can be saved in bundles rather than individual files
+        self.bundle = kwargs.get('bundle', False)
+        self.text_store = kwargs.get('text_store')
+        self.pdf_store = kwargs.get('pdf_store')
+        self.own_stores = self.bundle and self.text_store is None and self.pdf_store is None
+        if self.own_stores:
+            bundle_size = float(kwargs.get('bundle_size', 1024))
+            if self.text:
+                self.text_store = BundleWriter(os.path.join(self.files_dir, 'text'), 'text', 'txt', max_size=bundle_size)
+            if self.pdf:
+                self.pdf_store = BundleWriter(os.path.join(self.files_dir, 'pdf'), 'pdf', 'pdf', max_size=bundle_size)
+        # Texts can be added to a full-text search index (search.db) as they're saved
+        self.search_index = kwargs.get('search_index')
+        self.own_index = self.search_index is None and bool(kwargs.get('index')) and self.text and bool(self.files_dir)
+        if self.own_index:
+            self.search_index = SearchIndex(self.files_dir)
+        # Save the raw API responses so the harvest can be rebuilt
+        self.responses = ResponseCache(self.data_dir, self.state) if self.data_dir and kwargs.get('cache_responses', True) else None
+        # The saved response of each page fetched (but not yet processed), keyed by its nextStart token
+        self.response_paths = {}
+        # Images are cropped in a pool of processes (set image_workers to 0 to crop in the current process)
+        self.image_size = int(kwargs.get('image_size') or 3000)
+        self.image_format = kwargs.get('image_format') or 'jpeg'
+        self.image_quality = int(kwargs.get('image_quality') or 75)
+        self.image_workers = kwargs.get('image_workers')
+        self.image_pool = kwargs.get('image_pool')
+        self.own_image_pool = self.image_pool is None
+        # Without a data_dir there's no cache, and page images are downloaded as they're needed
+        self.page_images = kwargs.get('page_images')
+        if self.image and self.page_images is None and self.files_dir:
+            self.page_images = PageImageCache(os.path.join(self.files_dir, 'page_cache'), max_size=int(kwargs.get('image_cache_size', 500)), client=self.http, downloader=self.downloader)
 
         max_results = kwargs.get('max')
         if max_results:
@@ -98,7 +2062,7 @@ class Harvester:
     def _get_total(self):
         params = self.query_params.copy()
         params['n'] = 0
-        response = s.get(self.api_url, params=params, timeout=30)
+        response = self.http.get(self.api_url, params=params)
         # print(response.url)
         try:
             results = response.json()
@@ -114,41 +2078,198 @@ class Harvester:
         '''
         pass
 
-    def harvest(self):
+    def harvest(self, pbar=None):
         '''
         Start the harvest and loop over the result set until finished.
+        A progress bar can be supplied if the harvest is part of a larger (sharded) harvest.
+        '''
+        from tqdm import tqdm
+        started = time.perf_counter()
+        try:
+            if pbar is None:
+                with tqdm(total=self.maximum, unit='article') as pbar:
+                    pbar.update(self.harvested)
+                    self.harvest_pages(pbar)
+            else:
+                self.harvest_pages(pbar)
+        finally:
+            self.metrics.increment('harvest_seconds', time.perf_counter() - started)
+            if self.own_metrics:
+                self.metrics.write()
+
+    def fetch_page(self, start):
+        '''
+        Get a page of results from the API starting at the supplied nextStart token.
+        Returns None if the response can't be read.
         '''
-        number = self.number
         params = self.query_params.copy()
         params['n'] = self.number
-        with tqdm(total=self.maximum, unit='article') as pbar:
-            pbar.update(self.harvested)
-            while self.start and (self.harvested < self.maximum):
-                params['s'] = self.start
-                response = s.get(self.api_url, params=params, timeout=30)
-                # print(response.url)
-                try:
-                    results = response.json()
-                except (AttributeError, ValueError):
-                    # Log errors?
-                    pass
-                else:
-                    records = results['response']['zone'][0]['records']
-                    self.process_results(records, pbar)
-                    # pbar.update(len(records['article']))
+        params['s'] = start
+        started = time.perf_counter()
+        response = self.http.get(self.api_url, params=params)
+        # print(response.url)
+        try:
+            results = response.json()
+        except (AttributeError, ValueError):
+            # Log errors?
+            self.metrics.increment('api_errors')
+            return None
+        else:
+            elapsed = time.perf_counter() - started
+            self.state.add_timing('api', elapsed)
+            self.metrics.observe('api', elapsed)
+            self.metrics.increment('pages')
+            if self.responses:
+                self.response_paths[start] = self.responses.save(params, start, response.content)
+            return results['response']['zone'][0]['records']
+
+    def get_pages(self):
+        '''
+        Loop through the pages of results one at a time, fetching the next page after the current one has been processed.
+        '''
+        while self.start and (self.harvested < self.maximum):
+            records = self.fetch_page(self.start)
+            if records is not None:
+                yield records
+
+    def harvest_pages(self, pbar):
+        if self.prefetch:
+            pages = PagePrefetcher(self, size=self.prefetch)
+        else:
+            pages = self.get_pages()
+        try:
+            for records in pages:
+                self.process_results(records, pbar)
+                # pbar.update(len(records['article']))
+                if not (self.start and (self.harvested < self.maximum)):
+                    break
+            if not getattr(self.writer, 'durable', True):
+                # Save any rows still waiting to be written, then the final nextStart token
+                self.writer.commit()
+                self.update_meta(self.start)
+        finally:
+            self.close()
+
+    def iter_articles(self, start=None):
+        '''
+        Yield the articles in the results one at a time as rows (see prepare_row), without saving them.
+        If the harvester was created with text, pdf, or image set, each row also has the article's
+        text (a string), pdf (bytes), and images (a list of bytes) -- None or empty if they couldn't be had.
+        Pages of results are only fetched as the rows are used (with up to `prefetch` pages fetched ahead),
+        so memory use stays the same however many articles there are.
+        Once the last row from a page has been yielded, `start` holds the nextStart token of the
+        following page -- pass it to iter_articles (or to a new harvester) to carry on from there.
+        The pools are shut down when the iterator finishes or is closed, but the harvester can be iterated
+        again -- call close() once you've finished with it.
+        Nothing is written to disk unless the harvester has a data_dir (for its state, metrics, and caches).
+        '''
+        if start is not None:
+            self.start = start
+        if self.prefetch:
+            pages = iter(PagePrefetcher(self, size=self.prefetch))
+        else:
+            pages = self.get_pages()
+        try:
+            if not (self.start and (self.harvested < self.maximum)):
+                return
+            for records in pages:
+                rows = self.prepare_articles(records.get('article', []))
+                if not rows:
+                    self.start = records.get('nextStart')
+                for index, row in enumerate(rows, 1):
+                    if index == len(rows):
+                        # Move on to the next page before the last row is used, in case it's the last one wanted
+                        self.harvested += len(rows)
+                        self.start = records.get('nextStart')
+                    yield row
+                if not (self.start and (self.harvested < self.maximum)):
+                    break
+        finally:
+            pages.close()
+            self.close_pools()
+
+    def prepare_articles(self, articles):
+        '''
+        Prepare the rows for a page of articles, adding their texts, PDFs, and images (if wanted) in memory.
+        '''
+        started = time.perf_counter()
+        rows = [self.prepare_row(article) for article in articles]
+        if self.text:
+            html_texts = {article['id']: article.get('articleText') for article in articles}
+            # If the texts aren't in the API response (as with AWW), download them all at once
+            html_texts.update(self.get_aww_texts([article_id for article_id, html_text in html_texts.items() if not html_text]))
+            html_texts = {article_id: html_text for article_id, html_text in html_texts.items() if html_text}
+            # Start converting the texts while the PDFs and images are processed
+            texts = self.convert_texts(list(html_texts.values()))
+        started = self.record_timing('prepare', started)
+        if self.pdf:
+            pdfs = self.renditions.get_pdfs(articles, fetch=True)
+            self.metrics.increment('pdfs', len(pdfs))
+            started = self.record_timing('pdf', started)
+        if self.image:
+            images = self.get_batch_images(articles, fetch=True)
+            self.metrics.increment('images', sum(len(article_images) for article_images in images.values()))
+            started = self.record_timing('image', started)
+        if self.text:
+            texts = dict(zip(html_texts, texts))
+            self.metrics.increment('texts', len(texts))
+            started = self.record_timing('text', started)
+        for row in rows:
+            if self.text:
+                row['text'] = texts.get(row['article_id'])
+            if self.pdf:
+                row['pdf'] = pdfs.get(row['article_id'])
+            if self.image:
+                row['images'] = images.get(row['article_id'], [])
+        self.metrics.increment('articles', len(rows))
+        return rows
+
+    def close_pools(self):
+        '''
+        Shut down the text and image pools unless they're shared with other harvesters.
+        They're started again if they're needed.
+        '''
+        if self.own_text_pool and self.text_pool is not None:
+            self.text_pool.shutdown()
+            self.text_pool = None
+        if self.own_image_pool and self.image_pool is not None:
+            self.image_pool.shutdown()
+            self.image_pool = None
+
+    def close(self):
+        '''
+        Close the writer, pools, bundles, and state unless they're shared with other harvesters.
+        '''
+        if self.own_writer and self.writer is not None:
+            self.writer.close()
+        self.close_pools()
+        if self.own_stores:
+            for store in [self.text_store, self.pdf_store]:
+                if store is not None:
+                    store.close()
+        if self.own_index:
+            self.search_index.close()
+        if self.own_state:
+            self.state.close()
 
     def update_meta(self, start):
         '''
         Update the metadata file with the current nextStart token.
         This is needed to restart an interrupted harvest.
         '''
+        self.metrics.write_periodically()
+        if self.checkpoint:
+            self.checkpoint(self.shard, start, self.harvested)
+            return
+        self.state.save_cursor(start, self.harvested)
         meta = get_metadata(self.data_dir)
         if meta:
             meta['start'] = start
-        with open(os.path.join(self.data_dir, 'metadata.json'), 'w') as meta_file:
-            json.dump(meta, meta_file, indent=4)
+            meta['harvested'] = len(self.writer)
+        write_metadata(self.data_dir, meta)
 
-    def prepare_row(self, article):
+    @staticmethod
+    def prepare_row(article):
         '''
         Flatten and reorganise article data into a single row for writing to CSV.
         '''
@@ -179,7 +2300,8 @@ class Harvester:
             row['page_url'] = None
         return row
 
-    def make_filename(self, article):
+    @staticmethod
+    def make_filename(article):
         '''
         Create a filename for a text file or PDF.
         For easy sorting/aggregation the filename has the format:
@@ -200,7 +2322,8 @@ class Harvester:
         # req = Request(ping_url)
         try:
             # urlopen(req)
-            response = s.get(ping_url, timeout=30)
+            with self.metrics.timer('pdf_ping'):
+                response = self.http.get(ping_url)
             response.raise_for_status()
         except HTTPError:
             if response.status_code == 423:
@@ -211,57 +2334,74 @@ class Harvester:
             ready = True
         return ready
 
-    def get_pdf_url(self, article_id, zoom=3):
+    def prep_pdf(self, article_id, zoom=3):
+        '''
+        Ask for the PDF version of an article to be created, returning the prep id (a hash)
+        that's used to check on its progress.
+        '''
+        prep_url = '{}nla.news-article{}/level/{}/prep'.format(self.rendition_url, article_id, zoom)
+        with self.metrics.timer('pdf_prep'):
+            response = self.http.get(prep_url)
+        return response.text
+
+    def get_ping_url(self, article_id, prep_id, zoom=3):
+        '''
+        Url to check if the PDF is ready.
+        '''
+        return '{}nla.news-article{}.{}.ping?followup={}'.format(self.rendition_url, article_id, zoom, prep_id)
+
+    def get_pdf_download_url(self, article_id, prep_id, zoom=3):
+        return '{}nla.news-article{}.{}.pdf?followup={}'.format(self.rendition_url, article_id, zoom, prep_id)
+
+    def download_pdf(self, article, pdf_url):
         '''
-        Download the PDF version of an article.
-        These can take a while to generate, so we need to ping the server to see if it's ready before we download.
+        Save the PDF of an article, returning the filename (or the key in the bundle).
         '''
-        pdf_url = None
-        # Ask for the PDF to be created
-        prep_url = 'https://trove.nla.gov.au/newspaper/rendition/nla.news-article{}/level/{}/prep'.format(article_id, zoom)
-        response = s.get(prep_url)
-        # Get the hash
-        prep_id = response.text
-        # Url to check if the PDF is ready
-        ping_url = 'https://trove.nla.gov.au/newspaper/rendition/nla.news-article{}.{}.ping?followup={}'.format(article_id, zoom, prep_id)
-        tries = 0
-        ready = False
-        time.sleep(2)  # Give some time to generate pdf
-        # Are you ready yet?
-        while ready is False and tries < 5:
-            ready = self.ping_pdf(ping_url)
-            if not ready:
-                tries += 1
-                time.sleep(2)
-        # Download if ready
-        if ready:
-            pdf_url = 'https://trove.nla.gov.au/newspaper/rendition/nla.news-article{}.{}.pdf?followup={}'.format(article_id, zoom, prep_id)
-        return pdf_url
+        with self.metrics.timer('pdf_download'):
+            if self.pdf_store is not None:
+                return self.pdf_store.add(self.make_filename(article), article['id'], self.downloader.fetch(pdf_url))
+            return self.downloader.download(pdf_url, self.get_pdf_path(article), self.metrics)
+
+    def fetch_pdf(self, article, pdf_url):
+        '''
+        Download the PDF of an article, returning its contents.
+        '''
+        with self.metrics.timer('pdf_download'):
+            return self.downloader.fetch(pdf_url)
+
+    def get_pdf_path(self, article):
+        return os.path.join(self.files_dir, 'pdf', '{}.pdf'.format(self.make_filename(article)))
 
     # I'd like to be able to make use to trove-newspaper-images instead of the code below
     # But there seems to be a clash between fastcore & argparse (or something like that)
     # Can't get it to work ATM
 
+    def get_boxes(self, page_ids, x, y, w, h):
+        '''
+        Find the outer limits of each run of zones on the same page.
+        Return a bounding box around the article for each run.
+        '''
+        import numpy as np
+        if not len(page_ids):
+            return []
+        # Indexes where a new run of zones starts
+        starts = np.concatenate(([0], np.flatnonzero(page_ids[1:] != page_ids[:-1]) + 1))
+        lefts = np.minimum.reduceat(x, starts)
+        tops = np.minimum.reduceat(y, starts)
+        rights = np.maximum.reduceat(x + w, starts)
+        bottoms = np.maximum.reduceat(y + h, starts)
+        return [
+            {'page_id': str(page_ids[start]), 'left': int(left), 'top': int(top), 'right': int(right), 'bottom': int(bottom)}
+            for start, left, top, right, bottom in zip(starts, lefts, tops, rights, bottoms)
+        ]
+
     def get_box(self, zones):
         '''
-        Loop through all the zones to find the outer limits of each boundary.
-        Return a bounding box around the article.
-        '''
-        left = 10000
-        right = 0
-        top = 10000
-        bottom = 0
-        page_id = zones[0]['data-page-id']
-        for zone in zones:
-            if int(zone['data-y']) < top:
-                top = int(zone['data-y'])
-            if int(zone['data-x']) < left:
-                left = int(zone['data-x'])
-            if (int(zone['data-x']) + int(zone['data-w'])) > right:
-                right = int(zone['data-x']) + int(zone['data-w'])
-            if (int(zone['data-y']) + int(zone['data-h'])) > bottom:
-                bottom = int(zone['data-y']) + int(zone['data-h'])
-        return {'page_id': page_id, 'left': left, 'top': top, 'right': right, 'bottom': bottom}
+        Return a bounding box around the supplied zones (as returned by extract_zones).
+        '''
+        import numpy as np
+        page_ids = np.full(len(zones['x']), zones['page_id'][0])
+        return self.get_boxes(page_ids, zones['x'], zones['y'], zones['w'], zones['h'])[0]
 
     def get_article_boxes(self, article_url):
         '''
@@ -269,130 +2409,492 @@ class Harvester:
         This function loads the HTML version of the article and scrapes the x, y, and width values for each line of text
         to determine the coordinates of a box around the article.
         '''
+        with self.metrics.timer('article_html'):
+            response = self.http.get(article_url)
+        return self.get_zone_boxes(response.text)
+
+    def get_zone_boxes(self, html):
+        '''
+        Get the boxes around the parts of an article on each page from the article's HTML.
+        '''
+        zones = extract_zones(html)
         boxes = []
-        response = requests.get(article_url)
-        soup = BeautifulSoup(response.text, 'lxml')
-        # Lines of OCR are in divs with the class 'zone'
-        # 'onPage' limits to those on the current page
-        zones = soup.select('div.zone.onPage')
-        boxes.append(self.get_box(zones))
-        off_page_zones = soup.select('div.zone.offPage')
-        if off_page_zones:
-            current_page = off_page_zones[0]['data-page-id']
-            zones = []
-            for zone in off_page_zones:
-                if zone['data-page-id'] == current_page:
-                    zones.append(zone)
-                else:
-                    boxes.append(self.get_box(zones))
-                    zones = [zone]
-                    current_page = zone['data-page-id']
-            boxes.append(self.get_box(zones))
+        # 'onPage' zones are on the article's own page
+        on_page = zones['on_page']
+        if on_page.any():
+            boxes.append(self.get_box({key: values[on_page] for key, values in zones.items()}))
+        # 'offPage' zones are grouped into boxes for each following page
+        off_page = ~on_page
+        boxes += self.get_boxes(zones['page_id'][off_page], zones['x'][off_page], zones['y'][off_page], zones['w'][off_page], zones['h'][off_page])
         return boxes
     
-    def get_page_images(self, article, size=3000):
+    def get_image_path(self, article, page_id):
+        return os.path.join(self.files_dir, 'image', '{}-{}.{}'.format(self.make_filename(article), page_id, IMAGE_FORMATS[self.image_format]))
+
+    def get_page_images(self, article, size=None):
         '''
         Extract an image of the article from the page image(s), save it, and return the filename(s).
         '''
-        images = []
-        # Get position of article on the page(s)
-        boxes = self.get_article_boxes('http://nla.gov.au/nla.news-article{}'.format(article['id']))
-        image_filename = self.make_filename(article)
-        for box in boxes:
-            # print(box)
-            # Construct the url we need to download the page image
-            page_url = 'https://trove.nla.gov.au/ndp/imageservice/nla.news-page{}/level{}'.format(box['page_id'], 7)
-            # Download the page image
-            response = requests.get(page_url)
-            # Open download as an image for editing
-            img = Image.open(BytesIO(response.content))
-            # Use coordinates of top line to create a square box to crop thumbnail
-            points = (box['left'], box['top'], box['right'], box['bottom'])
-            # Crop image to article box
-            cropped = img.crop(points)
-            # Resize if necessary
-            if size:
-                cropped.thumbnail((size, size), Image.ANTIALIAS)
-            # Save and display thumbnail
-            cropped_file = os.path.join(self.data_dir, 'image', '{}-{}.jpg'.format(image_filename, box['page_id']))
-            cropped.save(cropped_file)
-            images.append(cropped_file)
+        return self.get_batch_images([article], size=size).get(article['id'], [])
+
+    def get_batch_images(self, articles, size=None, fetch=False):
+        '''
+        Extract images of a batch of articles from their page images.
+        The articles are grouped by page, so each page image is only loaded once
+        and all the articles on it are cropped from the same decoded image.
+        Unless image_workers is 0, the pages are cropped in a process pool,
+        with no more than two pages per process waiting at once to keep memory use down.
+        Returns a dictionary of article ids and image filenames
+        (or, if fetch is True, the images themselves, which aren't saved).
+        '''
+        size = size or self.image_size
+        images = {}
+        pages = OrderedDict()
+        # Get position of the articles on the page(s)
+        article_urls = [self.article_url.format(article['id']) for article in articles]
+        for article, boxes in zip(articles, self.http.map(self.get_article_boxes, article_urls)):
+            for box in boxes:
+                # Skip images that were saved before a restart
+                image_file = None if fetch else self.get_image_path(article, box['page_id'])
+                if image_file and os.path.exists(image_file):
+                    images.setdefault(article['id'], []).append(image_file)
+                else:
+                    pages.setdefault(box['page_id'], []).append((article, box))
+        if self.image_workers != 0 and self.image_pool is None:
+            self.image_pool = make_process_pool(self.image_workers)
+        max_pending = 2 * (self.image_workers or os.cpu_count() or 1)
+        pending = {}
+
+        def collect(futures):
+            for future in futures:
+                page_id = pending.pop(future)
+                for (article, box), filename in zip(pages[page_id], future.result()):
+                    images.setdefault(article['id'], []).append(filename)
+
+        # Get the page images from the cache (or download them), cropping each one as it arrives
+        for page_id, content in self.http.as_completed(self.get_page_image, list(pages)):
+            crops = [(box, None if fetch else self.get_image_path(article, box['page_id'])) for article, box in pages[page_id]]
+            if self.image_pool is None:
+                with self.metrics.timer('crop'):
+                    filenames = crop_page(content, crops, size=size, format=self.image_format, quality=self.image_quality)
+                for (article, box), filename in zip(pages[page_id], filenames):
+                    images.setdefault(article['id'], []).append(filename)
+                continue
+            if len(pending) >= max_pending:
+                # Wait for a page to finish before sending another
+                with self.metrics.timer('crop_wait'):
+                    finished, unfinished = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[self.image_pool.submit(crop_page, content, crops, size, self.image_format, self.image_quality)] = page_id
+        with self.metrics.timer('crop_wait'):
+            collect(list(as_completed(pending)))
         return images
 
+    def get_page_image(self, page_id):
+        with self.metrics.timer('page_image'):
+            if self.page_images is None:
+                return self.downloader.fetch(PageImageCache.image_url.format(page_id, PageImageCache.level))
+            return self.page_images.get(page_id, self.metrics)
+
     def get_aww_text(self, article_id):
-        # Download text using the link from the web interface
-        url = f'https://trove.nla.gov.au/newspaper/rendition/nla.news-article{article_id}.txt'
-        response = s.get(url)
+        '''
+        Get the text (as HTML) of an article that isn't included in the API response (as with AWW).
+        The text is downloaded using the link from the web interface, and saved with the API responses
+        so it doesn't have to be downloaded again.
+        '''
+        if self.responses is not None:
+            html_text = self.responses.get_text(article_id)
+            if html_text is not None:
+                return html_text
+        url = f'{self.rendition_url}nla.news-article{article_id}.txt'
+        with self.metrics.timer('aww_text'):
+            response = self.http.get(url)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'lxml')
-            # Remove the header
-            soup.find('p').decompose()
-            soup.find('hr').decompose()
-            return str(soup)
+            html_text = strip_text_header(response.text)
+            if self.responses is not None:
+                self.responses.save_text(article_id, html_text)
+            return html_text
+
+    def get_aww_texts(self, article_ids):
+        '''
+        Get the texts of a batch of articles that aren't included in the API response, downloading them all at once.
+        Returns a dictionary of article ids and texts (as HTML).
+        '''
+        return dict(zip(article_ids, self.http.map(self.get_aww_text, article_ids)))
+
+    def convert_texts(self, html_texts, batch_size=10):
+        '''
+        Convert a list of HTML texts to plain text, returning an iterator over the results in the same order.
+        Unless text_workers is 0, the texts are sent to a process pool in batches and the conversion
+        runs in the background while the rest of the page is processed.
+        '''
+        if self.text_workers == 0:
+            return [convert_text(html_text, self.include_linebreaks) for html_text in html_texts]
+        if self.text_pool is None:
+            self.text_pool = make_process_pool(self.text_workers)
+        return self.text_pool.map(convert_text, html_texts, repeat(self.include_linebreaks), chunksize=batch_size)
+
+    def save_text(self, article, text):
+        '''
+        Save the text of an article, returning the filename (or the key in the bundle).
+        '''
+        text_filename = self.make_filename(article)
+        if self.text_store is not None:
+            return self.text_store.add(text_filename, article['id'], text.encode('utf-8'))
+        text_file = os.path.join(self.files_dir, 'text', '{}.txt'.format(text_filename))
+        with open(text_file, 'wb') as text_output:
+            text_output.write(text.encode('utf-8'))
+        return text_file
+
+    def record_timing(self, stage, started):
+        '''
+        Add the time since `started` to the total for a stage of the harvest, returning the current time.
+        '''
+        now = time.perf_counter()
+        self.state.add_timing(stage, now - started)
+        self.metrics.observe(stage, now - started)
+        return now
+
+    def get_files_state(self):
+        '''
+        Get the HarvestState that records which files have been saved (the store's, in a batch).
+        '''
+        return self.store.state if self.store is not None else self.state
+
+    def claim_files(self, article_ids):
+        '''
+        Find the articles that still need their PDFs, texts, and images saved, returning a dictionary of stages and ids.
+        In a batch, the articles are claimed in the shared store so that the other harvests skip them.
+        '''
+        if self.store is not None:
+            return {stage: self.store.claim(stage, article_ids) if getattr(self, stage) else set() for stage in HarvestState.stages}
+        return {stage: set(article_ids) - self.state.get_completed(stage, article_ids) for stage in HarvestState.stages}
+
+    def release_files(self, todo):
+        if self.store is not None:
+            for stage, article_ids in todo.items():
+                self.store.release(stage, article_ids)
 
     def process_results(self, records, pbar):
         '''
         Processes a page full of results.
         '''
         rows = []
+        html_texts = []
+        missing_texts = []
         try:
             articles = records['article']
         except KeyError:
             raise
         else:
-            for article in articles:
-                article_id = article['id']
-                rows.append(self.prepare_row(article))
+            started = time.perf_counter()
+            article_ids = [article['id'] for article in articles]
+            if self.before_save:
+                self.before_save(self.shard)
+            # Skip any files already saved before a restart (or, in a batch, by another harvest)
+            todo = self.claim_files(article_ids)
+            try:
+                for article in articles:
+                    article_id = article['id']
+                    rows.append(self.prepare_row(article))
+
+                    if self.text and article_id in todo['text']:
+                        html_text = article.get('articleText')
+                        if html_text:
+                            html_texts.append((article, html_text))
+                        else:
+                            missing_texts.append(article)
+
+                    pbar.update(1)
+
+                if missing_texts:
+                    # If the texts aren't in the API response (as with AWW), download them all at once
+                    aww_texts = self.get_aww_texts([article['id'] for article in missing_texts])
+                    html_texts += [(article, aww_texts[article['id']]) for article in missing_texts if aww_texts[article['id']]]
+
+                if html_texts:
+                    # Start converting the texts while the PDFs and images are processed
+                    texts = self.convert_texts([html_text for article, html_text in html_texts])
+                started = self.record_timing('prepare', started)
 
                 if self.pdf:
-                    pdf_url = self.get_pdf_url(article_id)
-                    if pdf_url:
-                        pdf_filename = self.make_filename(article)
-                        pdf_file = os.path.join(self.data_dir, 'pdf', '{}.pdf'.format(pdf_filename))
-                        response = s.get(pdf_url, stream=True)
-                        with open(pdf_file, 'wb') as pf:
-                            for chunk in response.iter_content(chunk_size=128):
-                                pf.write(chunk)
-
-                if self.text:
-                    html_text = article.get('articleText')
-                    if not html_text:
-                        # If the text isn't in the API response (as with AWW), download separately
-                        html_text = self.get_aww_text(article_id)
-                    if html_text:
-                        text_filename = self.make_filename(article)
-                        text = html2text.html2text(html_text)
-                        if self.include_linebreaks == False:
-                            text = re.sub("\s+", " ", text)
-                        text_file = os.path.join(self.data_dir, 'text', '{}.txt'.format(text_filename))
-                        with open(text_file, 'wb') as text_output:
-                            text_output.write(text.encode('utf-8'))
+                    # Request and download the PDFs for the whole page at once
+                    pdf_files = self.renditions.get_pdfs([article for article in articles if article['id'] in todo['pdf']])
+                    if self.pdf_store is not None:
+                        self.pdf_store.flush()
+                    self.get_files_state().mark_completed('pdf', pdf_files.keys())
+                    self.metrics.increment('pdfs', len(pdf_files))
+                    started = self.record_timing('pdf', started)
 
                 if self.image:
-                    images = self.get_page_images(article)
+                    # Crop images of all the articles, loading each page image once
+                    images = self.get_batch_images([article for article in articles if article['id'] in todo['image']])
+                    self.get_files_state().mark_completed('image', images.keys())
+                    self.metrics.increment('images', sum(len(files) for files in images.values()))
+                    started = self.record_timing('image', started)
 
-                pbar.update(1)
+                if html_texts:
+                    # Save the texts in the order they were submitted
+                    saved_texts = {}
+                    for (article, html_text), text in zip(html_texts, texts):
+                        self.save_text(article, text)
+                        saved_texts[article['id']] = text
+                    if self.text_store is not None:
+                        self.text_store.flush()
+                    if self.search_index is not None:
+                        self.search_index.add(rows, saved_texts)
+                    self.get_files_state().mark_completed('text', [article['id'] for article, html_text in html_texts])
+                    self.metrics.increment('texts', len(html_texts))
+                    started = self.record_timing('text', started)
+            finally:
+                self.release_files(todo)
 
-            new_df = pd.DataFrame(rows)
-            try:
-                old_df = pd.read_csv(self.csv_file)
-                results_df = pd.concat([old_df, new_df], ignore_index=True).drop_duplicates()
-            except FileNotFoundError:
-                results_df = new_df
-            results_df.to_csv(self.csv_file, index=False)
-            time.sleep(0.2)
+            # Getting the files can take a while, so check again before the rows are saved
+            if self.before_save:
+                self.before_save(self.shard)
+            # Note the saved response the rows come from, so a rebuild replays just the pages (and rows) that were saved
+            response_path = self.response_paths.pop(self.start, None)
+            if response_path:
+                self.state.add_page(response_path, article_ids)
+            # Append the new rows to the CSV file
+            added = self.writer.write_rows(rows)
+            # Keep track of the newest article, so an update knows where to start
+            dates = [row['date'] for row in rows if row.get('date')]
+            if dates:
+                self.state.save_latest_date(max(dates))
+            self.record_timing('write', started)
             # Update the number harvested
-            self.harvested = results_df.shape[0]
+            self.harvested += added
+            self.metrics.increment('articles', added)
             # Get the nextStart token
             try:
                 self.start = records['nextStart']
             except KeyError:
                 self.start = None
             # Save the nextStart token to the metadata file
-            self.update_meta(self.start)
+            # (if the writer is buffering rows in a part file, wait until they're saved)
+            if getattr(self.writer, 'durable', True):
+                self.update_meta(self.start)
             # print('Harvested: {}'.format(self.harvested))
 
 
+class ShardedHarvest:
+    '''
+    Split a harvest into shards by date and harvest the shards in parallel.
+    The shards are made from the decade (or year) facets of the query,
+    and each shard follows its own nextStart token. The shards are listed in shards.json
+    and their nextStart tokens are saved in harvest.db, so that a restarted harvest
+    only resumes the shards that haven't finished.
+    All the shards write to the same results.csv.
+
+    Usage:
+
+    harvest = ShardedHarvest(
+        query_params=[required, dictionary of parameters],
+        data_dir=[required, output path, string],
+        shard_by=[optional, 'decade' or 'year'],
+        workers=[optional, number of shards to harvest at once, integer],
+        max=[optional, maximum number of results, integer],
+        ...any other Harvester options)
+    harvest.harvest()
+    '''
+    state_file = 'shards.json'
+
+    def __init__(self, **kwargs):
+        self.data_dir = kwargs.get('data_dir')
+        self.query_params = kwargs.get('query_params')
+        self.shard_by = kwargs.get('shard_by', 'decade')
+        self.workers = int(kwargs.get('workers', 4))
+        self.maximum = kwargs.get('max')
+        self.options = kwargs
+        self.state_path = os.path.join(self.data_dir, self.state_file)
+        self.lock = threading.Lock()
+        self.state = HarvestState(self.data_dir)
+        self.metrics = HarvestMetrics(self.data_dir)
+        self.downloader = Downloader(kwargs.get('http') or http)
+        self.shards = self.load_shards()
+        if self.shards is None:
+            self.shards = self.make_shards()
+            self.save_shards()
+        # Add the progress of each shard
+        for shard_id, (start, harvested) in self.state.get_cursors().items():
+            if shard_id in self.shards:
+                self.shards[shard_id].update({'start': start, 'harvested': harvested})
+
+    def load_shards(self):
+        try:
+            with open(self.state_path, 'r') as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError):
+            return None
+
+    def save_shards(self):
+        tmp_path = '{}.tmp'.format(self.state_path)
+        with open(tmp_path, 'w') as state_file:
+            json.dump(self.shards, state_file, indent=4)
+        os.replace(tmp_path, self.state_path)
+
+    @staticmethod
+    def get_facet_terms(params, facet):
+        '''
+        Get the values and counts of a facet for a query.
+        '''
+        params = params.copy()
+        params['n'] = 0
+        params['facet'] = facet
+        # Facets aren't needed for the harvest itself
+        params.pop('bulkHarvest', None)
+        response = http.get(Harvester.api_url, params=params)
+        try:
+            facets = response.json()['response']['zone'][0]['facets']['facet']
+        except (AttributeError, ValueError, KeyError, TypeError):
+            return []
+        # Single values aren't wrapped in lists
+        if isinstance(facets, dict):
+            facets = [facets]
+        terms = []
+        for item in facets:
+            if item.get('name') == facet:
+                term = item.get('term', [])
+                terms = [term] if isinstance(term, dict) else term
+        return [(term['search'], int(term['count'])) for term in terms if int(term['count']) > 0]
+
+    def make_shards(self):
+        '''
+        Divide the query into shards using the decade and year facets.
+        If the query is already limited to a single year, there's only one shard.
+        If there's a maximum number of results, it's allocated across the shards in date order.
+        '''
+        params = self.query_params
+        shards = []
+        if 'l-year' in params:
+            shards.append({'params': {}, 'total': None})
+        elif 'l-decade' in params or self.shard_by == 'year':
+            decades = [(None, None)] if 'l-decade' in params else self.get_facet_terms(params, 'decade')
+            for decade, _ in decades:
+                decade_params = params.copy()
+                if decade:
+                    decade_params['l-decade'] = decade
+                for year, count in self.get_facet_terms(decade_params, 'year'):
+                    shard_params = {'l-year': year}
+                    if decade:
+                        shard_params['l-decade'] = decade
+                    shards.append({'params': shard_params, 'total': count})
+        else:
+            for decade, count in self.get_facet_terms(params, 'decade'):
+                shards.append({'params': {'l-decade': decade}, 'total': count})
+        if not shards:
+            # No facets to split on, so harvest everything in a single shard
+            shards.append({'params': {}, 'total': None})
+        remaining = self.maximum
+        state = {}
+        for shard in shards:
+            if self.maximum:
+                if remaining <= 0:
+                    break
+                if shard['total'] is None or shard['total'] > remaining:
+                    shard['total'] = remaining
+                remaining -= shard['total']
+            shard_id = shard['params'].get('l-year') or shard['params'].get('l-decade') or 'all'
+            state[shard_id] = {'params': shard['params'], 'total': shard['total'], 'start': '*', 'harvested': 0}
+        return state
+
+    def update_shard(self, shard_id, start, harvested):
+        '''
+        Save a shard's nextStart token.
+        '''
+        with self.lock:
+            self.shards[shard_id]['start'] = start
+            self.shards[shard_id]['harvested'] = harvested
+        self.state.save_cursor(start, harvested, shard=shard_id)
+
+    def unfinished(self):
+        return {shard_id: shard for shard_id, shard in self.shards.items() if shard['start'] and (shard['total'] is None or shard['harvested'] < shard['total'])}
+
+    def harvest_shard(self, shard_id, shard, writer, page_images, text_pool, image_pool, stores, search_index, pbar):
+        params = self.query_params.copy()
+        params.update(shard['params'])
+        options = self.options.copy()
+        options.update({
+            'query_params': params,
+            'start': shard['start'],
+            'max': shard['total'],
+            'shard': shard_id,
+            'checkpoint': self.update_shard,
+            'writer': writer,
+            'harvested': shard['harvested'],
+            'page_images': page_images,
+            'text_pool': text_pool,
+            'image_pool': image_pool,
+            'text_store': stores.get('text'),
+            'pdf_store': stores.get('pdf'),
+            'search_index': search_index,
+            'state': self.state,
+            'metrics': self.metrics,
+            'downloader': self.downloader
+        })
+        harvester = Harvester(**options)
+        harvester.harvest(pbar=pbar)
+
+    def harvest(self):
+        '''
+        Harvest all the unfinished shards, a few at a time.
+        '''
+        if self.options.get('format') == 'parquet':
+            # Each shard writes its own Parquet part files
+            writer = None
+        else:
+            writer = ResultsWriter(os.path.join(self.data_dir, 'results.csv'), state=self.state)
+        page_images = None
+        if self.options.get('image'):
+            page_images = PageImageCache(os.path.join(self.data_dir, 'page_cache'), max_size=int(self.options.get('image_cache_size', 500)), downloader=self.downloader)
+        text_pool = None
+        if self.options.get('text') and self.options.get('text_workers') != 0:
+            text_pool = make_process_pool(self.options.get('text_workers'))
+        image_pool = None
+        if self.options.get('image') and self.options.get('image_workers') != 0:
+            image_pool = make_process_pool(self.options.get('image_workers'))
+        # Shards share the bundles
+        stores = {}
+        if self.options.get('bundle'):
+            bundle_size = float(self.options.get('bundle_size', 1024))
+            if self.options.get('text'):
+                stores['text'] = BundleWriter(os.path.join(self.data_dir, 'text'), 'text', 'txt', max_size=bundle_size)
+            if self.options.get('pdf'):
+                stores['pdf'] = BundleWriter(os.path.join(self.data_dir, 'pdf'), 'pdf', 'pdf', max_size=bundle_size)
+        search_index = SearchIndex(self.data_dir) if self.options.get('text') and self.options.get('index') else None
+        from tqdm import tqdm
+        total = sum([shard['total'] or 0 for shard in self.shards.values()])
+        try:
+            with tqdm(total=total, unit='article') as pbar:
+                pbar.update(sum([shard['harvested'] for shard in self.shards.values()]))
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = [executor.submit(self.harvest_shard, shard_id, shard, writer, page_images, text_pool, image_pool, stores, search_index, pbar) for shard_id, shard in self.unfinished().items()]
+                    for future in as_completed(futures):
+                        future.result()
+        finally:
+            if writer is not None:
+                writer.close()
+            for pool in [text_pool, image_pool]:
+                if pool is not None:
+                    pool.shutdown()
+            for store in stores.values():
+                store.close()
+            if search_index is not None:
+                search_index.close()
+            self.metrics.write()
+        # Mark the whole harvest as finished
+        if not self.unfinished():
+            harvested = sum([shard['harvested'] for shard in self.shards.values()])
+            self.state.save_cursor(None, harvested)
+            meta = get_metadata(self.data_dir)
+            if meta:
+                meta['start'] = None
+                meta['harvested'] = harvested
+                write_metadata(self.data_dir, meta)
+        self.state.close()
+
+
 def format_date(date, start=False):
     '''
     The web interface uses YYYY-MM-DD dates, but the API expects YYYY-MM-DDT00:00:00Z.
@@ -424,6 +2926,7 @@ def prepare_query(query, text, api_key):
         new_params = parse_qs(parsed_url.query)
     else:
         # These params can be accepted as is.
+        from trove_query_parser.parser import parse_query
         new_params = parse_query(query)
     new_params['key'] = api_key
     new_params['encoding'] = 'json'
@@ -437,6 +2940,19 @@ def prepare_query(query, text, api_key):
     return new_params
 
 
+def limit_query(params, since):
+    '''
+    Limit a query to articles published on or after `since` (YYYY-MM-DD).
+    '''
+    params = params.copy()
+    date_range = 'date:[{} TO *]'.format(format_date(since, start=True))
+    query = params.get('q', '')
+    if isinstance(query, list):
+        query = ' '.join(query)
+    params['q'] = '({}) AND {}'.format(query, date_range) if query.strip() else date_range
+    return params
+
+
 def make_dir(dir):
     '''
     Create a directory.
@@ -461,11 +2977,36 @@ def save_meta(args, data_dir, harvest):
     meta['text'] = args.text
     meta['image'] = args.image
     meta['include_linebreaks'] = args.include_linebreaks
+    meta['pdf_workers'] = args.pdf_workers
+    meta['image_cache_size'] = args.image_cache_size
+    meta['shard_by'] = args.shard_by
+    meta['shard_workers'] = args.shard_workers
+    meta['text_workers'] = args.text_workers
+    meta['image_size'] = args.image_size
+    meta['image_format'] = args.image_format
+    meta['image_quality'] = args.image_quality
+    meta['image_workers'] = args.image_workers
+    meta['prefetch'] = args.prefetch
+    meta['format'] = args.format
+    meta['bundle'] = args.bundle
+    meta['bundle_size'] = args.bundle_size
+    meta['cache_responses'] = not args.no_response_cache
+    meta['index'] = args.index
     meta['harvest'] = harvest
     meta['date_started'] = datetime.datetime.now().isoformat()
     meta['start'] = '*'
-    with open(os.path.join(data_dir, 'metadata.json'), 'w') as meta_file:
+    write_metadata(data_dir, meta)
+
+
+def write_metadata(data_dir, meta):
+    '''
+    Save the metadata file, writing to a temporary file first so a crash can't leave it half written.
+    '''
+    meta_path = os.path.join(data_dir, 'metadata.json')
+    tmp_path = '{}.tmp'.format(meta_path)
+    with open(tmp_path, 'w') as meta_file:
         json.dump(meta, meta_file, indent=4)
+    os.replace(tmp_path, meta_path)
 
 
 def get_harvest(args):
@@ -494,22 +3035,66 @@ def get_metadata(data_dir):
     return meta
 
 
-def get_results(data_dir):
+def get_results(data_dir, meta=None):
     '''
     Get details from a harvest's results.csv file.
+    For Parquet harvests, the number of rows comes from harvest.db (or, failing that, the part files' footers)
+    and the last row from the last part file.
     '''
     results = {}
-    try:
-        csv_file = os.path.join(data_dir, 'results.csv')
-        df_results = pd.read_csv(csv_file)
-        results['num_rows'] = df_results.shape[0]
-        results['last_row'] = df_results.to_dict(orient='records')[0]
-    except FileNotFoundError:
+    if meta and meta.get('format') == 'parquet':
+        load_pyarrow()
         results['num_rows'] = 0
         results['last_row'] = None
+        parquet_dir = os.path.join(data_dir, 'results.parquet')
+        parts = sorted([filename for filename in os.listdir(parquet_dir) if filename.endswith('.parquet')], key=lambda filename: os.path.getmtime(os.path.join(parquet_dir, filename))) if os.path.isdir(parquet_dir) else []
+        output = None
+        if os.path.exists(os.path.join(data_dir, HarvestState.db_file)):
+            state = HarvestState(data_dir)
+            output = state.get_output(os.path.basename(parquet_dir))
+            state.close()
+        if output:
+            results['num_rows'] = output[1]
+        else:
+            results['num_rows'] = sum(pq.ParquetFile(os.path.join(parquet_dir, filename)).metadata.num_rows for filename in parts)
+        if parts:
+            parquet_file = pq.ParquetFile(os.path.join(parquet_dir, parts[-1]))
+            results['last_row'] = parquet_file.read_row_group(parquet_file.num_row_groups - 1).to_pylist()[-1]
+        return results
+    results['num_rows'] = 0
+    results['last_row'] = None
+    csv_file = os.path.join(data_dir, 'results.csv')
+    if not os.path.exists(csv_file):
+        return results
+    # The number of rows and the position of the last row are kept in harvest.db
+    if os.path.exists(os.path.join(data_dir, HarvestState.db_file)):
+        state = HarvestState(data_dir)
+        output = state.get_output(os.path.basename(csv_file))
+        last_row = state.get_last_row(os.path.basename(csv_file))
+        state.close()
+        if output and last_row is not None:
+            size, results['num_rows'] = output
+            results['last_row'] = read_csv_row(csv_file, last_row, size)
+            return results
+    # Older harvests don't have the index, so read through the file a row at a time
+    with open(csv_file, 'r', newline='', encoding='utf-8') as results_file:
+        for row in csv.DictReader(results_file):
+            results['num_rows'] += 1
+            results['last_row'] = row
     return results
 
 
+def read_csv_row(csv_file, offset, size=None):
+    '''
+    Read the row starting at `offset` in a CSV file, using the header for the field names.
+    '''
+    with open(csv_file, 'rb') as results_file:
+        header = next(csv.reader([results_file.readline().decode('utf-8')]))
+        results_file.seek(offset)
+        content = results_file.read(size - offset if size else -1).decode('utf-8')
+    return next(csv.DictReader(StringIO(content, newline=''), fieldnames=header), None)
+
+
 def report_harvest(args):
     '''
     Provide some details of a harvest.
@@ -519,7 +3104,7 @@ def report_harvest(args):
     data_dir = os.path.join(os.getcwd(), 'data', harvest)
     meta = get_metadata(data_dir)
     if meta:
-        results = get_results(data_dir)
+        results = get_results(data_dir, meta)
         print('')
         print('HARVEST METADATA')
         print('================')
@@ -539,22 +3124,421 @@ def report_harvest(args):
         print('Last article harvested:')
         print('')
         pprint(results['last_row'], indent=2)
+        if meta.get('queue') and not meta.get('merged'):
+            report_queue(data_dir, meta)
+        report_metrics(data_dir)
+
+
+def report_queue(data_dir, meta):
+    '''
+    Summarise the progress of the work units of a harvest started with --queue.
+    '''
+    queue = WorkQueue(os.path.join(data_dir, meta['queue']))
+    units = queue.get_units()
+    done = queue.get_done()
+    leases = {unit_id: lease for unit_id, lease in queue.get_leases().items() if unit_id not in done and lease}
+    expired = [unit_id for unit_id, lease in leases.items() if lease['expires'] <= time.time()]
+    print('')
+    print('WORK QUEUE')
+    print('==========')
+    print('Work units: {}'.format(len(units)))
+    print('Finished: {}'.format(len(done)))
+    print('In progress: {}'.format(len(leases) - len(expired)))
+    print('Stalled (lease expired): {}'.format(len(expired)))
+    print('Waiting: {}'.format(len(units) - len(done) - len(leases)))
+    workers = sorted(set(lease['worker'] for lease in leases.values() if lease['worker']))
+    if workers:
+        print('Workers: {}'.format(', '.join(workers)))
+
+
+def report_metrics(data_dir):
+    '''
+    Summarise the counters and stage timings saved in metrics.json.
+    '''
+    metrics = HarvestMetrics(data_dir)
+    if not (metrics.counters or metrics.stages):
+        return
+    print('')
+    print('HARVEST METRICS')
+    print('===============')
+    for name, value in sorted(metrics.counters.items()):
+        print('{}: {}'.format(name.replace('_', ' ').capitalize(), round(value, 2)))
+    if metrics.stages:
+        print('')
+        print('{:<15} {:>8} {:>10} {:>10} {:>8} {:>8}'.format('Stage', 'Count', 'Total (s)', 'Mean (s)', 'p50 <=', 'p95 <='))
+        for stage, histogram in sorted(metrics.stages.items(), key=lambda item: item[1]['seconds'], reverse=True):
+            print('{:<15} {:>8} {:>10.2f} {:>10.3f} {:>8} {:>8}'.format(
+                stage, histogram['count'], histogram['seconds'], histogram['seconds'] / histogram['count'], metrics.quantile(stage, 0.5), metrics.quantile(stage, 0.95)))
+
+
+def rebuild_stats(data_dir, meta, state):
+    '''
+    Recalculate the statistics of a harvest (eg one from an older version) from its results in a single pass.
+    '''
+    stats = {}
+    if meta.get('format') == 'parquet':
+        load_pyarrow()
+        parquet_dir = os.path.join(data_dir, 'results.parquet')
+        if os.path.isdir(parquet_dir):
+            for filename in sorted(os.listdir(parquet_dir)):
+                if filename.endswith('.parquet'):
+                    for batch in pq.ParquetFile(os.path.join(parquet_dir, filename)).iter_batches(columns=['date', 'newspaper_id', 'newspaper_title', 'category', 'words']):
+                        count_rows(batch.to_pylist(), stats)
+    else:
+        try:
+            with open(os.path.join(data_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+                count_rows(csv.DictReader(results_file), stats)
+        except FileNotFoundError:
+            pass
+    state.add_stats(stats, replace=True)
+    return stats
+
+
+def format_stats(stats, facet, limit=None):
+    '''
+    Get the lines of a table of the statistics for one facet.
+    Years and lengths are in order, newspapers and categories are sorted by the number of articles.
+    '''
+    counts = [(key, label, articles, words) for (stats_facet, key), (label, articles, words) in stats.items() if stats_facet == facet]
+    if facet == 'year':
+        counts.sort()
+    elif facet == 'words':
+        counts.sort(key=lambda count: int(count[0]))
+    else:
+        counts.sort(key=lambda count: count[2], reverse=True)
+    headings = {'year': 'Year', 'newspaper': 'Newspaper', 'category': 'Category', 'words': 'Length (words)'}
+    lines = ['{:<50} {:>10} {:>14} {:>10}'.format(headings[facet], 'Articles', 'Words', 'Mean')]
+    for key, label, articles, words in counts[:limit] if limit else counts:
+        if facet == 'newspaper':
+            key = '{} ({})'.format(label, key) if label else key
+        elif facet == 'words':
+            bucket = WORD_BUCKETS.index(int(key))
+            key = '{}-{}'.format(key, WORD_BUCKETS[bucket + 1] - 1) if bucket + 1 < len(WORD_BUCKETS) else '{}+'.format(key)
+        lines.append('{:<50} {:>10} {:>14} {:>10.0f}'.format(str(key or 'None')[:50], articles, words, words / articles))
+    if limit and len(counts) > limit:
+        lines.append('...and {} more'.format(len(counts) - limit))
+    return lines
+
+
+def export_stats(stats, path):
+    '''
+    Save the statistics as a CSV file (if the path ends with .csv) or as JSON.
+    '''
+    rows = [{'facet': facet, 'key': key, 'label': label, 'articles': articles, 'words': words} for (facet, key), (label, articles, words) in sorted(stats.items())]
+    with open(path, 'w', newline='', encoding='utf-8') as stats_file:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(stats_file, fieldnames=['facet', 'key', 'label', 'articles', 'words'])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, stats_file, indent=4)
+
+
+def stats_harvest(args):
+    '''
+    Show the number of articles and words in a harvest by year, newspaper, category, and length.
+    The statistics are kept up to date in harvest.db as the harvest runs, so there's no need to read the results.
+    Use --rebuild to recalculate them from the results (eg for a harvest made by an older version).
+    '''
+    harvest = get_harvest(args)
+    data_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(data_dir)
+    if not meta:
+        return
+    state = HarvestState(data_dir)
+    try:
+        if args.rebuild:
+            stats = rebuild_stats(data_dir, meta, state)
+        else:
+            stats = state.get_stats()
+        output = state.get_output('results.parquet' if meta.get('format') == 'parquet' else 'results.csv')
+    finally:
+        state.close()
+    label, articles, words = stats.get(('total', ''), [None, 0, 0])
+    if args.export:
+        export_stats(stats, args.export)
+        print('Statistics saved to {}'.format(args.export))
+        return
+    print('')
+    print('HARVEST STATISTICS')
+    print('==================')
+    print('Articles: {}'.format(articles))
+    print('Words: {}'.format(words))
+    if output and output[1] != articles:
+        print('')
+        print('The statistics only include {} of the {} articles harvested -- use --rebuild to recalculate them'.format(articles, output[1]))
+    if not articles:
+        return
+    for facet in [args.facet] if args.facet else ['year', 'newspaper', 'category', 'words']:
+        print('')
+        for line in format_stats(stats, facet, limit=args.limit):
+            print(line)
+
+
+def search_harvest(args):
+    '''
+    Search the texts of a harvest (run with --text and --index).
+    In a batch, the index is kept in the batch's store, so it covers all the batch's harvests.
+    '''
+    harvest = get_harvest(args)
+    data_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(data_dir)
+    if not meta:
+        return
+    index_dir = get_store_dir(data_dir, meta) or data_dir
+    if not os.path.exists(os.path.join(index_dir, SearchIndex.db_file)):
+        print('No search index -- harvest (or rebuild) with --text and --index to create one')
+        return
+    index = SearchIndex(index_dir)
+    started = time.perf_counter()
+    try:
+        results = index.search(args.query, start_date=args.start_date, end_date=args.end_date, newspaper=args.newspaper, category=args.category, limit=args.limit)
+    except sqlite3.OperationalError as error:
+        print('Sorry, the search failed: {}'.format(error))
+        return
+    finally:
+        index.close()
+    elapsed = time.perf_counter() - started
+    print('')
+    print('{} results ({:.0f} ms)'.format(len(results), elapsed * 1000))
+    for row in results:
+        print('')
+        print('{} -- {}, {} ({})'.format(row['title'], row['newspaper_title'], row['date'], row['category']))
+        print(row['url'])
+        print(row['snippet'])
 
 
 def restart_harvest(args):
     '''
-    Restart a harvest using the nextStart token saved in the metadata file.
+    Restart a harvest using the nextStart token saved in harvest.db (or the metadata file for older harvests).
     '''
     harvest = get_harvest(args)
     data_dir = os.path.join(os.getcwd(), 'data', harvest)
     meta = get_metadata(data_dir)
-    if meta:
-        if meta['start']:
-            start_harvest(data_dir=data_dir, key=meta['key'], query=meta['query'], pdf=meta['pdf'], text=meta['text'], image=meta['image'], include_linebreaks=meta['include_linebreaks'], start=meta['start'], max=meta['max'])
+    if meta and meta.get('queue') and not meta.get('merged'):
+        print('Use work to carry on with a harvest started with --queue')
+    elif meta:
+        # Updates aren't sharded, and are limited to articles published since the date in the metadata
+        since = meta.get('since')
+        shard_by = None if since else meta.get('shard_by')
+        start, harvested = get_progress(data_dir, meta)
+        if start:
+            start_harvest(data_dir=data_dir, key=meta['key'], query=meta['query'], pdf=meta['pdf'], text=meta['text'], image=meta['image'], include_linebreaks=meta['include_linebreaks'], start=start, max=0 if since else meta['max'], pdf_workers=meta.get('pdf_workers', 10), image_cache_size=meta.get('image_cache_size', 500), shard_by=shard_by, shard_workers=meta.get('shard_workers', 4), text_workers=meta.get('text_workers'), prefetch=meta.get('prefetch', 2), format=meta.get('format', 'csv'), bundle=meta.get('bundle', False), bundle_size=meta.get('bundle_size', 1024), cache_responses=meta.get('cache_responses', True), index=meta.get('index', False), harvested=harvested if since else None, since=since, store_dir=get_store_dir(data_dir, meta), **get_image_options(meta))
         else:
             print('Harvest completed')
 
 
+def get_progress(data_dir, meta):
+    '''
+    Get the nextStart token of a harvest and the number of articles it has harvested,
+    from harvest.db, or from the metadata file for older (or sharded) harvests.
+    '''
+    start = meta['start']
+    harvested = meta.get('harvested')
+    if (meta.get('since') or not meta.get('shard_by')) and os.path.exists(os.path.join(data_dir, HarvestState.db_file)):
+        state = HarvestState(data_dir)
+        cursor = state.get_cursor()
+        state.close()
+        if cursor:
+            start, harvested = cursor
+    return start, harvested
+
+
+def get_image_options(meta):
+    '''
+    Get the image options from a harvest's metadata (older harvests won't have them).
+    '''
+    return {
+        'image_size': meta.get('image_size', 3000),
+        'image_format': meta.get('image_format', 'jpeg'),
+        'image_quality': meta.get('image_quality', 75),
+        'image_workers': meta.get('image_workers')
+    }
+
+
+def get_store_dir(data_dir, meta):
+    '''
+    Harvests in a batch save their files in a shared store, the path (relative to the harvest) is in the metadata.
+    '''
+    if meta.get('store'):
+        return os.path.normpath(os.path.join(data_dir, meta['store']))
+
+
+def get_latest_date(data_dir, meta):
+    '''
+    Get the publication date of the newest article in a harvest.
+    Older harvests don't record it in harvest.db, so it's found by reading through the results
+    (one Parquet file, or one CSV row, at a time -- only the latest date so far is kept).
+    '''
+    latest = None
+    if os.path.exists(os.path.join(data_dir, HarvestState.db_file)):
+        state = HarvestState(data_dir)
+        latest = state.get_latest_date()
+        state.close()
+    if latest:
+        return latest
+    if meta.get('format') == 'parquet':
+        load_pyarrow()
+        parquet_dir = os.path.join(data_dir, 'results.parquet')
+        if os.path.isdir(parquet_dir):
+            # Only finished files -- parts still being written end in .tmp
+            for filename in sorted(os.listdir(parquet_dir)):
+                if filename.endswith('.parquet'):
+                    dates = pq.read_table(os.path.join(parquet_dir, filename), columns=['date']).column('date').drop_null()
+                    if len(dates):
+                        date = max(dates.to_pylist()).isoformat()
+                        latest = max(latest, date) if latest else date
+        return latest
+    try:
+        with open(os.path.join(data_dir, 'results.csv'), 'r', newline='', encoding='utf-8') as results_file:
+            for row in csv.DictReader(results_file):
+                if row.get('date') and (latest is None or row['date'] > latest):
+                    latest = row['date']
+    except FileNotFoundError:
+        pass
+    return latest
+
+
+def update_harvest(args):
+    '''
+    Add articles published since the last harvest (or update) to an existing harvest.
+    The saved query is limited to articles published after the newest article already harvested,
+    less a few days' overlap to pick up anything added late. Articles (and their files) that have
+    already been harvested are skipped, and the new ones are added to the same results.
+    '''
+    harvest = get_harvest(args)
+    data_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(data_dir)
+    if meta and meta.get('queue') and not meta.get('merged'):
+        print('Harvest not merged -- use work and merge to complete it before updating')
+    elif meta:
+        start, harvested = get_progress(data_dir, meta)
+        if start:
+            print('Harvest not finished -- use restart to complete it before updating')
+            return
+        latest = get_latest_date(data_dir, meta)
+        since = arrow.get(latest).shift(days=-args.overlap).format('YYYY-MM-DD') if latest else None
+        meta['since'] = since
+        meta['start'] = '*'
+        meta.setdefault('updates', []).append({'date_started': datetime.datetime.now().isoformat(), 'since': since})
+        write_metadata(data_dir, meta)
+        for output in ['pdf', 'text', 'image']:
+            if meta[output]:
+                make_dir(os.path.join(data_dir, output))
+        print('Harvesting articles published since {}'.format(since or 'the beginning'))
+        start_harvest(data_dir=data_dir, key=meta['key'], query=meta['query'], pdf=meta['pdf'], text=meta['text'], image=meta['image'], include_linebreaks=meta['include_linebreaks'], start='*', max=0, pdf_workers=meta.get('pdf_workers', 10), image_cache_size=meta.get('image_cache_size', 500), text_workers=meta.get('text_workers'), prefetch=meta.get('prefetch', 2), format=meta.get('format', 'csv'), bundle=meta.get('bundle', False), bundle_size=meta.get('bundle_size', 1024), cache_responses=meta.get('cache_responses', True), index=meta.get('index', False), harvested=0, since=since, store_dir=get_store_dir(data_dir, meta), **get_image_options(meta))
+
+
+def link_file(path, new_path):
+    '''
+    Hard link a file to a new path, or copy it if it can't be linked.
+    '''
+    try:
+        os.link(path, new_path)
+    except OSError:
+        shutil.copy2(path, new_path)
+
+
+def rebuild_harvest(args):
+    '''
+    Create a new harvest from the API responses saved by an earlier harvest, without going back to Trove.
+    This means you can change the output options (text, linebreaks, format, bundles) without harvesting again.
+    The saved pages are processed in a pool of processes.
+    Only the rows the original harvest saved are rebuilt -- each from the response it was saved from -- so responses
+    that were fetched but never processed (eg pages prefetched before a harvest reached its maximum) are skipped.
+    PDFs and images aren't rebuilt. The original harvest needs to have been run with --text for the responses
+    to include the texts (texts that had to be downloaded separately, as with AWW, are saved with the responses).
+    '''
+    harvest = get_harvest(args)
+    source_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(source_dir)
+    if not meta:
+        return
+    source_state = HarvestState(source_dir)
+    responses = source_state.get_responses()
+    cursors = source_state.get_cursors()
+    # Older harvests don't record which rows came from which response, so all their responses are replayed
+    pages = source_state.get_pages() or None
+    source_state.close()
+    if not responses:
+        print('No saved responses to rebuild from!')
+        return
+    # The new harvest gets its own directory
+    new_harvest = str(int(time.time()))
+    while os.path.exists(os.path.join(os.getcwd(), 'data', new_harvest)):
+        new_harvest = str(int(new_harvest) + 1)
+    data_dir = os.path.join(os.getcwd(), 'data', new_harvest)
+    make_dir(os.path.join(data_dir, 'responses'))
+    if args.text:
+        make_dir(os.path.join(data_dir, 'text'))
+    new_meta = meta.copy()
+    new_meta.update({
+        'harvest': new_harvest,
+        'date_started': datetime.datetime.now().isoformat(),
+        'rebuilt_from': harvest,
+        'pdf': False,
+        'image': False,
+        'text': args.text,
+        'include_linebreaks': args.include_linebreaks,
+        'format': args.format,
+        'bundle': args.bundle,
+        'bundle_size': args.bundle_size,
+        'index': args.index
+    })
+    write_metadata(data_dir, new_meta)
+    if os.path.exists(os.path.join(source_dir, ShardedHarvest.state_file)):
+        shutil.copy2(os.path.join(source_dir, ShardedHarvest.state_file), data_dir)
+    harvester = Harvester(query_params={}, data_dir=data_dir, text=args.text, include_linebreaks=args.include_linebreaks, format=args.format, bundle=args.bundle, bundle_size=args.bundle_size, max=meta['max'] or 1, text_workers=0, cache_responses=False, index=args.index)
+    # Link (or copy) the saved responses into the new harvest, so it can be rebuilt or restarted in turn
+    replay = []
+    for query, start, path in responses:
+        link_file(os.path.join(source_dir, path), os.path.join(data_dir, path))
+        harvester.state.add_response(query, start, path)
+        if pages is None or path in pages:
+            replay.append(path)
+    # Along with the texts that weren't in the responses
+    text_dir = os.path.dirname(os.path.join(source_dir, 'responses', ResponseCache.text_file))
+    if os.path.isdir(text_dir):
+        new_text_dir = os.path.dirname(os.path.join(data_dir, 'responses', ResponseCache.text_file))
+        make_dir(new_text_dir)
+        for entry in os.scandir(text_dir):
+            if entry.name.endswith('.gz'):
+                link_file(entry.path, os.path.join(new_text_dir, entry.name))
+    from tqdm import tqdm
+    try:
+        with tqdm(total=len(replay), unit='page') as pbar:
+            with make_process_pool(args.workers) as executor:
+                response_files = [os.path.join(data_dir, path) for path in replay]
+                for path, (rows, texts) in zip(replay, executor.map(rebuild_page, response_files, repeat(args.text), repeat(args.include_linebreaks), chunksize=4)):
+                    if pages is not None:
+                        # Just the rows that were saved from this response
+                        rows = [row for row in rows if str(row['article_id']) in pages[path]]
+                        texts = [(article, text) for article, text in texts if str(article['id']) in pages[path]]
+                    harvester.state.add_page(path, [row['article_id'] for row in rows])
+                    # Only save texts for articles that haven't already been saved
+                    saved = harvester.state.get_saved([row['article_id'] for row in rows])
+                    texts = [(article, text) for article, text in texts if str(article['id']) not in saved]
+                    for article, text in texts:
+                        harvester.save_text(article, text)
+                    if harvester.text_store is not None:
+                        harvester.text_store.flush()
+                    if harvester.search_index is not None:
+                        harvester.search_index.add(rows, {str(article['id']): text for article, text in texts})
+                    harvester.state.mark_completed('text', [article['id'] for article, text in texts])
+                    harvester.harvested += harvester.writer.write_rows(rows)
+                    pbar.update(1)
+        if not getattr(harvester.writer, 'durable', True):
+            harvester.writer.commit()
+        # Copy across the progress of the original harvest, so if it wasn't finished the new one can be restarted
+        for shard, (start, shard_harvested) in cursors.items():
+            harvester.state.save_cursor(start, harvester.harvested if shard == '' else shard_harvested, shard=shard)
+        new_meta['harvested'] = len(harvester.writer)
+        write_metadata(data_dir, new_meta)
+    finally:
+        harvester.close()
+    print('Rebuilt harvest {} as {}'.format(harvest, new_harvest))
+
+
 def prepare_harvest(args):
     '''
     Route the actions appropriately.
@@ -565,6 +3549,20 @@ def prepare_harvest(args):
         report_harvest(args)
     elif args.action == 'restart':
         restart_harvest(args)
+    elif args.action == 'rebuild':
+        rebuild_harvest(args)
+    elif args.action == 'update':
+        update_harvest(args)
+    elif args.action == 'batch':
+        batch_harvest(args)
+    elif args.action == 'search':
+        search_harvest(args)
+    elif args.action == 'stats':
+        stats_harvest(args)
+    elif args.action == 'work':
+        work_harvest(args)
+    elif args.action == 'merge':
+        merge_harvest(args)
     else:
         # Harvest directory names are timestamps
         harvest = str(int(time.time()))  # Get rid of fractions
@@ -577,19 +3575,406 @@ def prepare_harvest(args):
             make_dir(os.path.join(data_dir, 'text'))
         if args.image:
             make_dir(os.path.join(data_dir, 'image'))
-        start_harvest(data_dir=data_dir, key=args.key, query=args.query, pdf=args.pdf, text=args.text, image=args.image, include_linebreaks=args.include_linebreaks, start='*', max=args.max)
+        if args.queue:
+            queue_harvest(args, data_dir, harvest)
+            return
+        start_harvest(data_dir=data_dir, key=args.key, query=args.query, pdf=args.pdf, text=args.text, image=args.image, include_linebreaks=args.include_linebreaks, start='*', max=args.max, pdf_workers=args.pdf_workers, image_cache_size=args.image_cache_size, shard_by=args.shard_by, shard_workers=args.shard_workers, text_workers=args.text_workers, prefetch=args.prefetch, format=args.format, bundle=args.bundle, bundle_size=args.bundle_size, cache_responses=not args.no_response_cache, index=args.index, image_size=args.image_size, image_format=args.image_format, image_quality=args.image_quality, image_workers=args.image_workers)
+
+
+def batch_harvest(args):
+    '''
+    Harvest a list of queries at the same time.
+    Each query gets its own harvest directory (data/[batch id]/[query number]) with its own results,
+    but the texts, PDFs, and images are saved in a store shared by the batch (data/[batch id]/store),
+    so an article that turns up in more than one query is only fetched once. The harvests all go
+    through the same rate limiter, so the batch as a whole stays within the API's limits.
+    Each harvest's metadata.json has the path of the store (relative to the harvest), and the files in it
+    are named from the rows (PUBLICATIONDATE-NEWSPAPERID-ARTICLEID) just as in a single harvest -- or, if
+    they're bundled, can be read from the store's bundles by article id with BundleReader.
+    Use --batch to restart the unfinished harvests in a batch.
+    '''
+    if args.batch:
+        batch = args.batch
+        batch_dir = os.path.join(os.getcwd(), 'data', batch)
+        with open(os.path.join(batch_dir, 'batch.json'), 'r') as batch_file:
+            harvests = json.load(batch_file)['harvests']
+    else:
+        if not (args.queries and args.key):
+            print('A file of queries and an API key are needed to start a batch')
+            return
+        with open(args.queries, 'r') as queries_file:
+            queries = [line.strip() for line in queries_file if line.strip() and not line.startswith('#')]
+        batch = str(int(time.time()))
+        batch_dir = os.path.join(os.getcwd(), 'data', batch)
+        harvests = []
+        for number, query in enumerate(queries, start=1):
+            harvest = '{:03d}'.format(number)
+            data_dir = os.path.join(batch_dir, harvest)
+            make_dir(data_dir)
+            save_meta(argparse.Namespace(query=query, shard_by=None, shard_workers=1, **vars(args)), data_dir, '{}/{}'.format(batch, harvest))
+            meta = get_metadata(data_dir)
+            meta['batch'] = batch
+            meta['store'] = os.path.join('..', 'store')
+            write_metadata(data_dir, meta)
+            harvests.append(harvest)
+        with open(os.path.join(batch_dir, 'batch.json'), 'w') as batch_file:
+            json.dump({'batch': batch, 'date_started': datetime.datetime.now().isoformat(), 'queries': queries, 'harvests': harvests}, batch_file, indent=4)
+    run_batch(batch_dir, harvests, workers=args.workers)
+
+
+# Options that set up the store, cache, and pools shared by the harvests in a batch
+BATCH_OPTIONS = ['pdf', 'text', 'image', 'include_linebreaks', 'text_workers', 'image_workers', 'image_size', 'image_format', 'image_quality', 'image_cache_size', 'bundle', 'bundle_size', 'index']
+
+
+def run_batch(batch_dir, harvests, workers=4):
+    '''
+    Run the unfinished harvests in a batch, a few at a time, sharing the content store,
+    page image cache, text conversion processes, and bundles.
+    '''
+    from tqdm import tqdm
+    metas = {harvest: get_metadata(os.path.join(batch_dir, harvest)) for harvest in harvests}
+    # The harvests in a batch are started with the same options, and the ones that set up
+    # the shared store, cache, and pools have to stay the same
+    options = metas[harvests[0]]
+    for harvest, meta in metas.items():
+        conflicts = [option for option in BATCH_OPTIONS if meta.get(option) != options.get(option)]
+        if conflicts:
+            print('Harvest {} has different options ({}) to the rest of the batch'.format(harvest, ', '.join(conflicts)))
+            return
+    size_pool(harvests=min(workers, len(harvests)), pdf_workers=max(meta.get('pdf_workers', 10) if meta['pdf'] else 0 for meta in metas.values()), prefetch=max(meta.get('prefetch', 2) for meta in metas.values()))
+    store = ContentStore(os.path.join(batch_dir, 'store'))
+    downloader = Downloader()
+    page_images = None
+    if options['image']:
+        page_images = PageImageCache(os.path.join(store.store_dir, 'page_cache'), max_size=int(options.get('image_cache_size', 500)), downloader=downloader)
+    text_pool = None
+    if options['text'] and options.get('text_workers') != 0:
+        text_pool = make_process_pool(options.get('text_workers'))
+    image_pool = None
+    if options['image'] and options.get('image_workers') != 0:
+        image_pool = make_process_pool(options.get('image_workers'))
+    stores = {}
+    if options.get('bundle'):
+        bundle_size = float(options.get('bundle_size', 1024))
+        if options['text']:
+            stores['text'] = BundleWriter(os.path.join(store.store_dir, 'text'), 'text', 'txt', max_size=bundle_size)
+        if options['pdf']:
+            stores['pdf'] = BundleWriter(os.path.join(store.store_dir, 'pdf'), 'pdf', 'pdf', max_size=bundle_size)
+    # The texts are indexed in the store, along with the rest of the batch's files
+    search_index = SearchIndex(store.store_dir) if options['text'] and options.get('index') else None
+
+    def make_harvester(harvest):
+        data_dir = os.path.join(batch_dir, harvest)
+        meta = metas[harvest]
+        start, harvested = get_progress(data_dir, meta)
+        if not start:
+            return None
+        params = prepare_query(meta['query'], meta['text'], meta['key'])
+        return Harvester(query_params=params, data_dir=data_dir, pdf=meta['pdf'], text=meta['text'], image=meta['image'], include_linebreaks=meta['include_linebreaks'], start=start, max=meta['max'], pdf_workers=meta.get('pdf_workers', 10), text_workers=meta.get('text_workers'), prefetch=meta.get('prefetch', 2), format=meta.get('format', 'csv'), bundle=meta.get('bundle', False), bundle_size=meta.get('bundle_size', 1024), image_cache_size=meta.get('image_cache_size', 500), cache_responses=meta.get('cache_responses', True), store=store, downloader=downloader, page_images=page_images, text_pool=text_pool, image_pool=image_pool, text_store=stores.get('text'), pdf_store=stores.get('pdf'), search_index=search_index, **get_image_options(meta))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            harvesters = [harvester for harvester in executor.map(make_harvester, harvests) if harvester is not None]
+            if not harvesters:
+                print('Batch completed')
+                return
+            with tqdm(total=sum([harvester.maximum for harvester in harvesters]), unit='article') as pbar:
+                pbar.update(sum([harvester.harvested for harvester in harvesters]))
+                futures = [executor.submit(harvester.harvest, pbar) for harvester in harvesters]
+                for future in as_completed(futures):
+                    future.result()
+    finally:
+        for pool in [text_pool, image_pool]:
+            if pool is not None:
+                pool.shutdown()
+        for bundle in stores.values():
+            bundle.close()
+        if search_index is not None:
+            search_index.close()
+        store.close()
+
+
+def make_units(params, maximum=0):
+    '''
+    Divide a query into work units by newspaper, using the title facet.
+    If there's a maximum number of results, it's allocated across the units, largest first.
+    '''
+    terms = [] if 'l-title' in params else ShardedHarvest.get_facet_terms(params, 'title')
+    if not terms:
+        # No titles to split on, so it's all one unit
+        return {'all': {'params': {}, 'total': maximum or None}}
+    units = {}
+    remaining = maximum
+    for title, count in sorted(terms, key=lambda term: term[1], reverse=True):
+        if maximum:
+            if remaining <= 0:
+                break
+            count = min(count, remaining)
+            remaining -= count
+        units[title] = {'params': {'l-title': title}, 'total': count}
+    return units
+
+
+def queue_harvest(args, data_dir, harvest):
+    '''
+    Set up a harvest to be run by workers on any number of machines.
+    The query is divided into work units by newspaper title, and the units are added to a work queue
+    in the harvest directory (which needs to be on storage shared by the machines).
+    '''
+    params = prepare_query(args.query, args.text, args.key)
+    units = make_units(params, args.max)
+    queue = WorkQueue(os.path.join(data_dir, 'queue'))
+    for unit_id, unit in units.items():
+        queue.add(unit_id, unit)
+    meta = get_metadata(data_dir)
+    meta['queue'] = 'queue'
+    write_metadata(data_dir, meta)
+    print('Added {} work units to the queue for harvest {}'.format(len(units), harvest))
+    print('To harvest them, run `troveharvester work [your API key] --harvest {}` on each machine, then `troveharvester merge --harvest {}`'.format(harvest, harvest))
+
+
+def harvest_unit(queue, unit_id, unit, data_dir, meta, key, downloader, text_pool, image_pool, pbar):
+    '''
+    Harvest a work unit into its own directory (units/[unit id]) within the harvest, using the supplied API key.
+    If the unit was started by another worker, the harvest picks up from the unit's saved nextStart token.
+    The lease on the unit is renewed before anything from a page is saved, and the harvest stops
+    (leaving the page to the new owner) if another worker has taken the unit.
+    '''
+    unit_dir = os.path.join(data_dir, 'units', unit_id)
+    make_dir(unit_dir)
+    for output in ['pdf', 'text', 'image']:
+        if meta[output]:
+            make_dir(os.path.join(unit_dir, output))
+    # The units are on storage shared by the workers, where WAL's shared memory index doesn't work
+    state = HarvestState(unit_dir, journal_mode='DELETE')
+    search_index = SearchIndex(unit_dir, journal_mode='DELETE') if meta['text'] and meta.get('index') else None
+    start, harvested = state.get_cursor() or ('*', 0)
+
+    def renew(shard):
+        queue.renew(unit_id)
+
+    def checkpoint(shard, start, harvested):
+        queue.renew(unit_id)
+        state.save_cursor(start, harvested)
+
+    try:
+        if start:
+            params = prepare_query(meta['query'], meta['text'], key)
+            params.update(unit['params'])
+            harvester = Harvester(query_params=params, data_dir=unit_dir, pdf=meta['pdf'], text=meta['text'], image=meta['image'], include_linebreaks=meta['include_linebreaks'], start=start, max=unit['total'], pdf_workers=meta.get('pdf_workers', 10), image_cache_size=meta.get('image_cache_size', 500), text_workers=meta.get('text_workers'), prefetch=meta.get('prefetch', 2), format=meta.get('format', 'csv'), bundle=meta.get('bundle', False), bundle_size=meta.get('bundle_size', 1024), cache_responses=meta.get('cache_responses', True), index=meta.get('index', False), shard=unit_id, checkpoint=checkpoint, before_save=renew, state=state, search_index=search_index, downloader=downloader, text_pool=text_pool, image_pool=image_pool, **get_image_options(meta))
+            harvester.harvest(pbar=pbar)
+            harvested = harvester.harvested
+        queue.finish(unit_id, harvested)
+    except LeaseLost:
+        # Another worker has it now
+        pass
+    except BaseException:
+        queue.release(unit_id)
+        raise
+    finally:
+        if search_index is not None:
+            search_index.close()
+        state.close()
+
 
+def work_harvest(args):
+    '''
+    Harvest units from a harvest's work queue, using your own API key, until they're all finished.
+    Run this on as many machines as you like (with the harvest directory on storage they all share).
+    Units left unfinished by workers that have stopped are taken over once their leases expire.
+    Use merge to combine the units once they're all done.
+    '''
+    harvest = get_harvest(args)
+    data_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(data_dir)
+    if not meta:
+        return
+    if not meta.get('queue'):
+        print("This harvest doesn't have a work queue -- use start with --queue to create one")
+        return
+    from tqdm import tqdm
+    queue = WorkQueue(os.path.join(data_dir, meta['queue']), lease_time=args.lease).start()
+    units = queue.get_units()
+    size_pool(harvests=args.workers, pdf_workers=meta.get('pdf_workers', 10) if meta['pdf'] else 0, prefetch=meta.get('prefetch', 2))
+    downloader = Downloader()
+    text_pool = None
+    if meta['text'] and meta.get('text_workers') != 0:
+        text_pool = make_process_pool(meta.get('text_workers'))
+    image_pool = None
+    if meta['image'] and meta.get('image_workers') != 0:
+        image_pool = make_process_pool(meta.get('image_workers'))
+
+    def work(pbar):
+        while True:
+            claimed = queue.claim()
+            if claimed is not None:
+                harvest_unit(queue, *claimed, data_dir, meta, args.key, downloader, text_pool, image_pool, pbar)
+            elif queue.get_done() >= set(units):
+                return
+            else:
+                # Wait for the other workers to finish (or for their leases to expire)
+                queue.wait()
+
+    try:
+        with tqdm(total=sum([unit['total'] or 0 for unit in units.values()]), unit='article') as pbar:
+            pbar.update(sum([units[unit_id]['total'] or 0 for unit_id in queue.get_done()]))
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                futures = [executor.submit(work, pbar) for _ in range(args.workers)]
+                for future in as_completed(futures):
+                    future.result()
+    finally:
+        queue.stop()
+        for pool in [text_pool, image_pool]:
+            if pool is not None:
+                pool.shutdown()
+    print('All the work units are finished -- use merge to combine them')
+
+
+def move_files(source_dir, dest_dir):
+    make_dir(dest_dir)
+    for entry in os.scandir(source_dir):
+        if entry.is_file():
+            os.replace(entry.path, os.path.join(dest_dir, entry.name))
+
+
+def merge_unit(unit_dir, unit_id, data_dir, state, writer, search_index, bundles):
+    '''
+    Move the results, files, search index, and saved API responses of a finished work unit into the harvest.
+    '''
+    unit_state = HarvestState(unit_dir, journal_mode='DELETE')
+    try:
+        if writer is not None:
+            csv_file = os.path.join(unit_dir, 'results.csv')
+            if os.path.exists(csv_file):
+                with open(csv_file, 'r', newline='', encoding='utf-8') as results_file:
+                    rows = []
+                    for row in csv.DictReader(results_file):
+                        rows.append(row)
+                        if len(rows) == 1000:
+                            writer.write_rows(rows)
+                            rows = []
+                    writer.write_rows(rows)
+        else:
+            # Parquet part files are named by unit, so they can just be moved
+            parquet_dir = os.path.join(unit_dir, 'results.parquet')
+            new_parquet_dir = os.path.join(data_dir, 'results.parquet')
+            make_dir(new_parquet_dir)
+            if os.path.isdir(parquet_dir):
+                for filename in sorted(os.listdir(parquet_dir)):
+                    if filename.endswith('.parquet'):
+                        article_ids = pq.read_table(os.path.join(parquet_dir, filename), columns=['article_id']).column('article_id').to_pylist()
+                        os.replace(os.path.join(parquet_dir, filename), os.path.join(new_parquet_dir, filename))
+                        state.save_rows('results.parquet', article_ids, os.path.getsize(os.path.join(new_parquet_dir, filename)))
+            state.add_stats(unit_state.get_stats())
+        state.add_articles(unit_state.path)
+        latest = unit_state.get_latest_date()
+        if latest:
+            state.save_latest_date(latest)
+        for output in ['pdf', 'text', 'image']:
+            source_dir = os.path.join(unit_dir, output)
+            if os.path.isdir(source_dir):
+                if output in bundles:
+                    bundles[output].add_bundles(source_dir, unit_id)
+                else:
+                    move_files(source_dir, os.path.join(data_dir, output))
+        if search_index is not None and os.path.exists(os.path.join(unit_dir, SearchIndex.db_file)):
+            search_index.add_index(unit_dir)
+        for query, start, path in unit_state.get_responses():
+            if os.path.exists(os.path.join(unit_dir, path)):
+                make_dir(os.path.dirname(os.path.join(data_dir, path)))
+                os.replace(os.path.join(unit_dir, path), os.path.join(data_dir, path))
+                state.add_response(query, start, path)
+        text_dir = os.path.dirname(os.path.join(unit_dir, 'responses', ResponseCache.text_file))
+        if os.path.isdir(text_dir):
+            move_files(text_dir, os.path.dirname(os.path.join(data_dir, 'responses', ResponseCache.text_file)))
+    finally:
+        unit_state.close()
+
+
+def merge_harvest(args):
+    '''
+    Combine the work units of a queued harvest into a single harvest once they're all finished.
+    The results, files, bundles, search index, and saved API responses of each unit are moved into
+    the harvest directory, so it ends up just like a harvest run on a single machine.
+    '''
+    harvest = get_harvest(args)
+    data_dir = os.path.join(os.getcwd(), 'data', harvest)
+    meta = get_metadata(data_dir)
+    if not meta:
+        return
+    if not meta.get('queue'):
+        print("This harvest doesn't have a work queue, so there's nothing to merge")
+        return
+    if meta.get('merged'):
+        print('Harvest already merged')
+        return
+    queue = WorkQueue(os.path.join(data_dir, meta['queue']))
+    units = queue.get_units()
+    unfinished = set(units) - queue.get_done()
+    if unfinished:
+        print('{} of {} work units are still to be harvested -- run more workers to finish them'.format(len(unfinished), len(units)))
+        return
+    from tqdm import tqdm
+    state = HarvestState(data_dir)
+    if meta.get('format') == 'parquet':
+        load_pyarrow()
+        writer = None
+    else:
+        writer = ResultsWriter(os.path.join(data_dir, 'results.csv'), state=state)
+    search_index = SearchIndex(data_dir) if meta['text'] and meta.get('index') else None
+    bundles = {}
+    if meta.get('bundle'):
+        for output, extension in [('text', 'txt'), ('pdf', 'pdf')]:
+            if meta[output]:
+                bundles[output] = BundleWriter(os.path.join(data_dir, output), output, extension, max_size=float(meta.get('bundle_size', 1024)))
+    try:
+        for unit_id in tqdm(sorted(units), unit='unit'):
+            unit_dir = os.path.join(data_dir, 'units', unit_id)
+            if os.path.exists(os.path.join(unit_dir, HarvestState.db_file)):
+                merge_unit(unit_dir, unit_id, data_dir, state, writer, search_index, bundles)
+        if writer is not None:
+            harvested = len(writer)
+        else:
+            harvested = (state.get_output('results.parquet') or (0, 0))[1]
+        state.save_cursor(None, harvested)
+    finally:
+        if writer is not None:
+            writer.close()
+        if search_index is not None:
+            search_index.close()
+        for bundle in bundles.values():
+            bundle.close()
+        state.close()
+    meta['start'] = None
+    meta['harvested'] = harvested
+    meta['merged'] = datetime.datetime.now().isoformat()
+    write_metadata(data_dir, meta)
+    print('Merged {} work units into harvest {} ({} articles)'.format(len(units), harvest, harvested))
 
-def start_harvest(data_dir, key, query, pdf, text, image, include_linebreaks, start, max):
+
+def start_harvest(data_dir, key, query, pdf, text, image, include_linebreaks, start, max, pdf_workers=10, image_cache_size=500, shard_by=None, shard_workers=4, text_workers=None, prefetch=2, format='csv', bundle=False, bundle_size=1024, cache_responses=True, index=False, harvested=None, since=None, store_dir=None, image_size=3000, image_format='jpeg', image_quality=75, image_workers=None):
     '''
     Start a harvest.
+    If `since` is set (as YYYY-MM-DD), only articles published since then are harvested.
+    If `store_dir` is set, files are saved in that (batch) store rather than the harvest directory.
     '''
     # Turn the query url into a dictionary of parameters
     params = prepare_query(query, text, key)
+    if since:
+        params = limit_query(params, since)
+    size_pool(harvests=shard_workers if shard_by else 1, pdf_workers=pdf_workers if pdf else 0, prefetch=prefetch)
     # Create the harvester
-    harvester = Harvester(query_params=params, data_dir=data_dir, pdf=pdf, text=text, image=image, include_linebreaks=include_linebreaks, start=start, max=max)
+    if shard_by:
+        # Harvest shards of the query in parallel
+        harvester = ShardedHarvest(query_params=params, data_dir=data_dir, pdf=pdf, text=text, image=image, include_linebreaks=include_linebreaks, max=max, pdf_workers=pdf_workers, image_cache_size=image_cache_size, text_workers=text_workers, prefetch=prefetch, format=format, bundle=bundle, bundle_size=bundle_size, cache_responses=cache_responses, index=index, image_size=image_size, image_format=image_format, image_quality=image_quality, image_workers=image_workers, shard_by=shard_by, workers=shard_workers)
+    else:
+        harvester = Harvester(query_params=params, data_dir=data_dir, pdf=pdf, text=text, image=image, include_linebreaks=include_linebreaks, start=start, max=max, pdf_workers=pdf_workers, image_cache_size=image_cache_size, text_workers=text_workers, prefetch=prefetch, format=format, bundle=bundle, bundle_size=bundle_size, cache_responses=cache_responses, index=index, image_size=image_size, image_format=image_format, image_quality=image_quality, image_workers=image_workers, harvested=harvested, store=ContentStore(store_dir) if store_dir else None)
     # Go!
-    harvester.harvest()
+    try:
+        harvester.harvest()
+    finally:
+        if getattr(harvester, 'store', None) is not None:
+            harvester.store.close()
 
 
 def main():
@@ -602,11 +3987,83 @@ def main():
     parser_restart.add_argument('--harvest', help='Restart the harvest with this id (default is the most recent harvest)')
     parser_report = subparsers.add_parser('report', help='Report on a harvest')
     parser_report.add_argument('--harvest', help='Report on the harvest with this id (default is the most recent harvest)')
+    parser_stats = subparsers.add_parser('stats', help='Show the number of articles and words in a harvest by year, newspaper, category, and length')
+    parser_stats.add_argument('--harvest', help='Show the statistics of the harvest with this id (default is the most recent harvest)')
+    parser_stats.add_argument('--facet', choices=['year', 'newspaper', 'category', 'words'], help='Only show the statistics for this facet')
+    parser_stats.add_argument('--limit', type=int, default=20, help='Maximum number of rows to show for each facet (0 shows them all)')
+    parser_stats.add_argument('--export', help='Save the statistics to this file (as CSV if it ends with .csv, otherwise JSON)')
+    parser_stats.add_argument('--rebuild', action="store_true", help='Recalculate the statistics from the results')
+    parser_update = subparsers.add_parser('update', help='Add articles published since the last harvest to an existing harvest')
+    parser_update.add_argument('--harvest', help='Update the harvest with this id (default is the most recent harvest)')
+    parser_update.add_argument('--overlap', type=int, default=7, help='Number of days before the newest article harvested to start from')
+    parser_batch = subparsers.add_parser('batch', help='Harvest a list of queries at the same time, sharing the texts, PDFs, and images')
+    parser_batch.add_argument('queries', nargs='?', help='A file with the url of a search on each line')
+    parser_batch.add_argument('key', nargs='?', help='Your Trove API key')
+    parser_batch.add_argument('--batch', help='Restart the unfinished harvests in the batch with this id')
+    parser_batch.add_argument('--workers', type=int, default=4, help='Number of queries to harvest at once')
+    parser_batch.add_argument('--max', type=int, default=0, help='Maximum number of results to return for each query')
+    parser_batch.add_argument('--pdf', action="store_true", help='Save PDFs of articles')
+    parser_batch.add_argument('--pdf_workers', type=int, default=10, help='Number of PDFs to request and download at once')
+    parser_batch.add_argument('--text', action="store_true", help='Save text contents of articles')
+    parser_batch.add_argument('--image', action="store_true", help='Save images of articles')
+    parser_batch.add_argument('--text_workers', type=int, help='Number of processes used to convert text (default is the number of CPUs, 0 converts text in the main process)')
+    parser_batch.add_argument('--image_size', type=int, default=3000, help='Maximum width or height (in pixels) of article images')
+    parser_batch.add_argument('--image_format', choices=list(IMAGE_FORMATS), default='jpeg', help='Format of article images')
+    parser_batch.add_argument('--image_quality', type=int, default=75, help='Quality (1-100) of JPEG and WebP article images')
+    parser_batch.add_argument('--image_workers', type=int, help='Number of processes used to crop images (default is the number of CPUs, 0 crops images in the main process)')
+    parser_batch.add_argument('--image_cache_size', type=int, default=500, help='Maximum size (in MB) of the cache of downloaded page images')
+    parser_batch.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Save the results as a CSV file or a Parquet dataset')
+    parser_batch.add_argument('--bundle', action="store_true", help='Save texts and PDFs in bundles (tar files) rather than one file per article')
+    parser_batch.add_argument('--bundle_size', type=float, default=1024, help='Maximum size (in MB) of each bundle')
+    parser_batch.add_argument('--no_response_cache', action="store_true", help="Don't save the raw API responses (needed to rebuild the harvest)")
+    parser_batch.add_argument('--prefetch', type=int, default=2, help='Number of pages of results to fetch ahead while the current page is processed (0 to fetch one at a time)')
+    parser_batch.add_argument('--include_linebreaks', action="store_true", help='Preserve line breaks in text files')
+    parser_batch.add_argument('--index', action="store_true", help='Add the texts to a full-text search index (use the search command to search it)')
+    parser_search = subparsers.add_parser('search', help='Search the texts of a harvest')
+    parser_search.add_argument('query', help='Words or "phrases" to search for (AND, OR, NOT, and prefix* searches are supported)')
+    parser_search.add_argument('--harvest', help='Search the harvest with this id (default is the most recent harvest)')
+    parser_search.add_argument('--start_date', help='Only include articles published on or after this date (YYYY, YYYY-MM, or YYYY-MM-DD)')
+    parser_search.add_argument('--end_date', help='Only include articles published on or before this date (YYYY, YYYY-MM, or YYYY-MM-DD)')
+    parser_search.add_argument('--newspaper', help='Only include articles from the newspaper with this id, or with this in its title')
+    parser_search.add_argument('--category', help='Only include articles in this category (eg Article, Advertising)')
+    parser_search.add_argument('--limit', type=int, default=20, help='Maximum number of results to show')
+    parser_work = subparsers.add_parser('work', help='Harvest units from the work queue of a harvest started with --queue')
+    parser_work.add_argument('key', help='Your Trove API key')
+    parser_work.add_argument('--harvest', help='Work on the harvest with this id (default is the most recent harvest)')
+    parser_work.add_argument('--workers', type=int, default=2, help='Number of units to harvest at once')
+    parser_work.add_argument('--lease', type=int, default=600, help='Seconds before the lease on a unit expires if its worker stops')
+    parser_merge = subparsers.add_parser('merge', help='Combine the finished work units of a harvest started with --queue')
+    parser_merge.add_argument('--harvest', help='Merge the harvest with this id (default is the most recent harvest)')
+    parser_rebuild = subparsers.add_parser('rebuild', help='Rebuild a harvest from its saved API responses with new output options')
+    parser_rebuild.add_argument('--harvest', help='Rebuild the harvest with this id (default is the most recent harvest)')
+    parser_rebuild.add_argument('--text', action="store_true", help='Save text contents of articles')
+    parser_rebuild.add_argument('--include_linebreaks', action="store_true", help='Preserve line breaks in text files')
+    parser_rebuild.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Save the results as a CSV file or a Parquet dataset')
+    parser_rebuild.add_argument('--bundle', action="store_true", help='Save texts in bundles (tar files) rather than one file per article')
+    parser_rebuild.add_argument('--bundle_size', type=float, default=1024, help='Maximum size (in MB) of each bundle')
+    parser_rebuild.add_argument('--index', action="store_true", help='Add the texts to a full-text search index (use the search command to search it)')
+    parser_rebuild.add_argument('--workers', type=int, help='Number of processes to use (default is the number of CPUs)')
     parser_start.add_argument('--max', type=int, default=0, help='Maximum number of results to return')
     parser_start.add_argument('--pdf', action="store_true", help='Save PDFs of articles')
+    parser_start.add_argument('--pdf_workers', type=int, default=10, help='Number of PDFs to request and download at once')
     parser_start.add_argument('--text', action="store_true", help='Save text contents of articles')
     parser_start.add_argument('--image', action="store_true", help='Save images of articles')
+    parser_start.add_argument('--text_workers', type=int, help='Number of processes used to convert text (default is the number of CPUs, 0 converts text in the main process)')
+    parser_start.add_argument('--image_size', type=int, default=3000, help='Maximum width or height (in pixels) of article images')
+    parser_start.add_argument('--image_format', choices=list(IMAGE_FORMATS), default='jpeg', help='Format of article images')
+    parser_start.add_argument('--image_quality', type=int, default=75, help='Quality (1-100) of JPEG and WebP article images')
+    parser_start.add_argument('--image_workers', type=int, help='Number of processes used to crop images (default is the number of CPUs, 0 crops images in the main process)')
+    parser_start.add_argument('--image_cache_size', type=int, default=500, help='Maximum size (in MB) of the cache of downloaded page images')
+    parser_start.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Save the results as a CSV file or a Parquet dataset')
+    parser_start.add_argument('--bundle', action="store_true", help='Save texts and PDFs in bundles (tar files) rather than one file per article')
+    parser_start.add_argument('--bundle_size', type=float, default=1024, help='Maximum size (in MB) of each bundle')
+    parser_start.add_argument('--no_response_cache', action="store_true", help="Don't save the raw API responses (needed to rebuild the harvest)")
+    parser_start.add_argument('--prefetch', type=int, default=2, help='Number of pages of results to fetch ahead while the current page is processed (0 to fetch one at a time)')
+    parser_start.add_argument('--shard_by', choices=['decade', 'year'], help='Split the harvest into shards by decade or year and harvest them in parallel')
+    parser_start.add_argument('--queue', action="store_true", help="Don't harvest, but split the query into work units by newspaper for the work command to harvest on any number of machines")
+    parser_start.add_argument('--shard_workers', type=int, default=4, help='Number of shards to harvest at once')
     parser_start.add_argument('--include_linebreaks', action="store_true", help='Preserve line breaks in text files')
+    parser_start.add_argument('--index', action="store_true", help='Add the texts to a full-text search index (use the search command to search it)')
     args = parser.parse_args()
     prepare_harvest(args)
 